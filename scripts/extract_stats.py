@@ -1,12 +1,19 @@
+import json
 import requests
 import functions as f
 
 if __name__ == "__main__":
-    response = requests.get('https://saomiguelbus-api.herokuapp.com/api/v1/stats').json()
+    # Streamed one stat per line, so neither side holds the whole export in memory
+    response = requests.get('https://saomiguelbus-api.herokuapp.com/api/v1/stats',
+                            params={'format': 'ndjson', 'fields': 'request,origin,destination'}, stream=True)
 
     stats = {}
 
-    for stat in response:
+    for line in response.iter_lines():
+        # Blank keep-alive lines carry no stat
+        if not line.strip():
+            continue
+        stat = json.loads(line)
         if stat['request'] in stats:
             stats[stat['request']].append(stat)
         else:
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+import tempfile
 
 try:
     import environ
@@ -129,6 +130,90 @@ import dj_database_url
 db_from_env = dj_database_url.config(conn_max_age=600)
 DATABASES['default'].update(db_from_env)
 
+# Cache
+# Shared by every gunicorn worker on the host, so in-process indexes can tell when another worker changed the data
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': env('CACHE_LOCATION', default=os.path.join(tempfile.gettempdir(), 'saomiguelbus-cache')),
+    },
+    # Google Directions responses, see app.utils.gmaps_cache. Any cache backend works, e.g.
+    # GMAPS_CACHE_BACKEND=django.core.cache.backends.db.DatabaseCache with a GMAPS_CACHE_LOCATION table made by createcachetable
+    'gmaps': {
+        'BACKEND': env('GMAPS_CACHE_BACKEND', default='django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': env('GMAPS_CACHE_LOCATION', default=os.path.join(tempfile.gettempdir(), 'saomiguelbus-gmaps')),
+        'OPTIONS': {'MAX_ENTRIES': int(env('GMAPS_CACHE_MAX_ENTRIES', default=10000))},
+    },
+    # Statistics dashboard figures, kept apart so their per-minute keys never cull anything else
+    'stats': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': env('STATS_CACHE_LOCATION', default=os.path.join(tempfile.gettempdir(), 'saomiguelbus-stats')),
+    },
+    # Generation tokens of the per-worker caches, see app.utils.generation. There is one key per cached value,
+    # so this never reaches MAX_ENTRIES and the tokens are never culled
+    'generations': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': env('GENERATIONS_CACHE_LOCATION', default=os.path.join(tempfile.gettempdir(), 'saomiguelbus-generations')),
+        'TIMEOUT': None,
+    },
+}
+
+# Google Directions responses are reused for the same stops, language and GMAPS_TIME_BUCKET_MINUTES of time.
+# Fresh for GMAPS_CACHE_SECONDS, then served for GMAPS_CACHE_STALE_SECONDS more while being fetched again in the background
+
+GMAPS_CACHE_SECONDS = int(env('GMAPS_CACHE_SECONDS', default=15 * 60))
+GMAPS_CACHE_STALE_SECONDS = int(env('GMAPS_CACHE_STALE_SECONDS', default=60 * 60))
+GMAPS_TIME_BUCKET_MINUTES = int(env('GMAPS_TIME_BUCKET_MINUTES', default=10))
+GMAPS_COORDINATE_DIGITS = int(env('GMAPS_COORDINATE_DIGITS', default=4))
+
+# Identical Directions requests of the workers of a host wait for one fetch, through lock files in GMAPS_LOCK_DIR
+# (empty to only coalesce within a worker), for at most GMAPS_LOCK_SECONDS
+
+GMAPS_LOCK_DIR = env('GMAPS_LOCK_DIR', default=os.path.join(tempfile.gettempdir(), 'saomiguelbus-gmaps-locks'))
+GMAPS_LOCK_SECONDS = float(env('GMAPS_LOCK_SECONDS', default=10))
+
+# Compiled timetable snapshots, memory-mapped by every worker (see the compile_timetable command)
+
+TIMETABLE_SNAPSHOT_DIR = env('TIMETABLE_SNAPSHOT_DIR', default=os.path.join(tempfile.gettempdir(), 'saomiguelbus-timetable'))
+# Workers wait at most this long for another one compiling the snapshot before compiling it themselves
+TIMETABLE_COMPILE_LOCK_SECONDS = float(env('TIMETABLE_COMPILE_LOCK_SECONDS', default=30))
+
+# Stat events are buffered per worker and written with one bulk INSERT when either limit is reached
+
+STAT_BUFFER_SIZE = int(env('STAT_BUFFER_SIZE', default=500))
+STAT_BUFFER_SECONDS = float(env('STAT_BUFFER_SECONDS', default=5))
+STAT_BATCH_LIMIT = int(env('STAT_BATCH_LIMIT', default=1000))
+# Batched events may have been queued offline, but older ones would rewrite counts already reported
+STAT_MAX_EVENT_AGE_DAYS = int(env('STAT_MAX_EVENT_AGE_DAYS', default=7))
+
+# Ad seen and clicked increments are summed per worker and written with one UPDATE
+
+AD_COUNTER_BUFFER_SIZE = int(env('AD_COUNTER_BUFFER_SIZE', default=1000))
+AD_COUNTER_BUFFER_SECONDS = float(env('AD_COUNTER_BUFFER_SECONDS', default=10))
+
+# The top-K and distinct count sketches of the stats are kept per worker and merged into the stored ones
+
+STAT_SKETCH_BUFFER_SIZE = int(env('STAT_SKETCH_BUFFER_SIZE', default=10000))
+STAT_SKETCH_BUFFER_SECONDS = float(env('STAT_SKETCH_BUFFER_SECONDS', default=60))
+
+# How long the statistics dashboard reuses its aggregates
+
+STATS_CACHE_SECONDS = int(env('STATS_CACHE_SECONDS', default=60))
+
+# Months of raw stats kept in the database, older months are moved to gzipped files by archive_stats.
+# The files are the only copy of those rows, so STAT_ARCHIVE_DIR has no default and must be on a persistent volume
+
+STAT_RETENTION_MONTHS = int(env('STAT_RETENTION_MONTHS', default=12))
+STAT_ARCHIVE_DIR = env('STAT_ARCHIVE_DIR', default='')
+
+# Background jobs run by the run_jobs command. Failed jobs are retried up to JOB_MAX_ATTEMPTS times, waiting
+# JOB_RETRY_SECONDS and then twice as long each time; jobs running for JOB_TIMEOUT_SECONDS are taken as abandoned
+
+JOB_MAX_ATTEMPTS = int(env('JOB_MAX_ATTEMPTS', default=5))
+JOB_RETRY_SECONDS = int(env('JOB_RETRY_SECONDS', default=30))
+JOB_TIMEOUT_SECONDS = int(env('JOB_TIMEOUT_SECONDS', default=600))
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -32,8 +32,10 @@ urlpatterns = [
     path('api/v1/android/load', views.get_android_load_v1),
     path('api/v1/stats', views.get_stats_v1),
     path('api/v1/stat', views.add_stat_v1),
+    path('api/v1/stat/batch', views.add_stats_v1),
     path('api/v1/ad', views.get_ad_v1),
     path('api/v1/ad/click', views.click_ad_v1),
+    path('api/v1/ad/conflicts', views.get_ad_conflicts_v1),
     path('api/v1/groups', views.get_all_groups_v1),
     path('api/v1/info', views.set_info_v1),
     path('api/v1/info/active', views.get_active_infos_v1),
@@ -47,8 +49,11 @@ urlpatterns = [
     #### V2 ####
     path('api/v2/android/load', views.get_android_load_v2),
     path('api/v2/webapp/load', views.get_webapp_load_v2),
+    path('api/v2/android/sync', views.get_android_sync_v2),
     path('api/v2/stops', views.get_all_stops_v2),
     path('api/v2/route', views.get_trip_v2),    
+    #### V3 ####
+    path('api/v3/route', views.get_trip_v3),
 
     #### MODELS ####
     path('api/v2/like/<int:trip_id>', views.like_trip),
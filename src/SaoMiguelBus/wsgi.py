@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'SaoMiguelBus.settings')
 
 application = get_wsgi_application()
+
+from app.utils.route_index import warm_route_index
+
+warm_route_index()
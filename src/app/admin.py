@@ -1,16 +1,37 @@
-from django.contrib import admin
-from app.models import EmailOpen, Info, Stop, Route, Stat, Variables, Ad, Group, Holiday, Data, Trip, TripStop, AIFeedback
+from django.contrib import admin, messages
+from django.db.models import Q
+from app.models import Change, EmailOpen, Info, Stop, Route, RouteStop, Stat, StatArchive, StatRollup, Variables, Ad, AdConflict, AdDailyStat, Group, GroupStop, Holiday, Data, Trip, TripStop, AIFeedback, Job
+
+class RouteAdmin(admin.ModelAdmin):
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('route_stops')
+
+class AdAdmin(admin.ModelAdmin):
+    def save_model(self, request, obj, form, change):
+        # The conflicts are found again by the post_save signal
+        super().save_model(request, obj, form, change)
+        for conflict in AdConflict.objects.filter(Q(ad=obj) | Q(other_ad=obj)).select_related('ad', 'other_ad'):
+            other = conflict.other_ad if conflict.ad_id == obj.id else conflict.ad
+            messages.warning(request, f"Conflicts with {other} on {conflict.group} ({conflict.platform}) from {conflict.start} to {conflict.end}")
 
 admin.site.register(Stop)
-admin.site.register(Route)
+admin.site.register(Route, RouteAdmin)
+admin.site.register(RouteStop)
 admin.site.register(Stat)
 admin.site.register(Variables)
-admin.site.register(Ad)
+admin.site.register(Ad, AdAdmin)
 admin.site.register(Group)
+admin.site.register(GroupStop)
 admin.site.register(Info)
 admin.site.register(Holiday)
 admin.site.register(Data)
 admin.site.register(Trip)
 admin.site.register(TripStop)
 admin.site.register(AIFeedback)
-admin.site.register(EmailOpen)
\ No newline at end of file
+admin.site.register(EmailOpen)
+admin.site.register(Change)
+admin.site.register(StatRollup)
+admin.site.register(StatArchive)
+admin.site.register(AdDailyStat)
+admin.site.register(AdConflict)
+admin.site.register(Job)
\ No newline at end of file
@@ -0,0 +1,83 @@
+import gzip
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from app.models import Stat
+from app.utils.stat_archive import record_archive
+
+# Ids per DELETE, keeping the query parameters under the database limits
+DELETE_CHUNK_SIZE = 500
+
+def add_months(month, months):
+    year, index = divmod(month.year * 12 + month.month - 1 + months, 12)
+    return month.replace(year=year, month=index + 1)
+
+def month_start(moment):
+    return timezone.localtime(moment).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def archive_path(directory, month):
+    """The first free file name for ``month``; stats saved late for an archived month go to a new part."""
+    path = os.path.join(directory, f"stats-{month:%Y-%m}.jsonl.gz")
+    part = 1
+    while os.path.exists(path):
+        path = os.path.join(directory, f"stats-{month:%Y-%m}.{part}.jsonl.gz")
+        part += 1
+    return path
+
+
+class Command(BaseCommand):
+    help = 'Move the Stat rows of every month before the retention window to one gzipped JSON lines file per month'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, default=settings.STAT_RETENTION_MONTHS, help='Months of stats to keep, the current one included')
+        parser.add_argument('--dir', default=settings.STAT_ARCHIVE_DIR, help='Directory to write the archives to, on a persistent volume')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be archived')
+
+    def handle(self, *args, **options):
+        if not options['dir']:
+            # The archived rows are deleted, a directory that does not outlive the container would lose them
+            raise CommandError("Set STAT_ARCHIVE_DIR or pass --dir, pointing to a persistent volume")
+        cutoff = add_months(month_start(timezone.now()), 1 - options['months'])
+        oldest = Stat.objects.order_by('timestamp').values_list('timestamp', flat=True).first()
+        if oldest is None or oldest >= cutoff:
+            self.stdout.write("No stats to archive")
+            return
+
+        os.makedirs(options['dir'], exist_ok=True)
+        month = month_start(oldest)
+        while month < cutoff:
+            self.archive_month(month, add_months(month, 1), options['dir'], options['dry_run'])
+            month = add_months(month, 1)
+
+    def archive_month(self, start, end, directory, dry_run):
+        stats = Stat.objects.filter(timestamp__gte=start, timestamp__lt=end)
+        last_id = stats.order_by('-id').values_list('id', flat=True).first()
+        if last_id is None:
+            return
+        # Rows saved while archiving are left for the next run
+        stats = stats.filter(id__lte=last_id)
+        if dry_run:
+            self.stdout.write(f"Would archive {stats.count()} stats of {start:%Y-%m}")
+            return
+
+        path = archive_path(directory, start)
+        archived_ids = []
+        with gzip.open(f"{path}.tmp", 'wt', encoding='utf-8') as archive:
+            for row in stats.order_by('id').values().iterator():
+                archive.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+                archived_ids.append(row['id'])
+        os.replace(f"{path}.tmp", path)
+
+        # Only the rows written to the file are deleted: rows of the month committed meanwhile, even with
+        # a lower id, are left for the next run. The hourly rollups keep the archived months in the dashboard totals
+        with transaction.atomic():
+            for chunk in range(0, len(archived_ids), DELETE_CHUNK_SIZE):
+                Stat.objects.filter(id__in=archived_ids[chunk:chunk + DELETE_CHUNK_SIZE]).delete()
+            record_archive(start, end, path, len(archived_ids))
+        self.stdout.write(self.style.SUCCESS(f"Archived {len(archived_ids)} stats of {start:%Y-%m} to {path}"))
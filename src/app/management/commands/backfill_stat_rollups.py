@@ -0,0 +1,26 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from app.utils.stat_rollup import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the hourly stat rollups from the raw Stat rows, for every hour or a range of days; archived hours are kept'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='First day to recompute (YYYY-MM-DD)')
+        parser.add_argument('--until', help='Day to stop before (YYYY-MM-DD)')
+
+    def parse_day(self, value):
+        if value is None:
+            return None
+        try:
+            return timezone.make_aware(datetime.strptime(value, '%Y-%m-%d'))
+        except ValueError:
+            raise CommandError(f"Invalid day {value}, expected YYYY-MM-DD")
+
+    def handle(self, *args, **options):
+        written = rebuild_rollups(self.parse_day(options['since']), self.parse_day(options['until']))
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} stat rollups"))
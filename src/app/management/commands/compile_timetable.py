@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from app.utils.generation import bump_generation
+from app.utils.timetable_snapshot import GENERATION_NAME, compile_timetable, remove_old_snapshots, write_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Compile the active Route timetable into a snapshot that every worker memory-maps'
+
+    def handle(self, *args, **options):
+        snapshot = compile_timetable()
+        # Workers reload on the new Route generation and find this snapshot already written for it
+        generation = write_snapshot(snapshot, bump_generation(GENERATION_NAME))
+        remove_old_snapshots()
+        self.stdout.write(self.style.SUCCESS(f"Compiled timetable snapshot {generation}: {len(snapshot)} routes, {len(snapshot.stops)} stops"))
@@ -0,0 +1,22 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from app.models import Change
+
+
+class Command(BaseCommand):
+    help = 'Delete change journal entries older than the retention window; clients older than that get a full sync'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help='Days of changes to keep')
+
+    def handle(self, *args, **options):
+        latest = Change.objects.order_by('-version').first()
+        if latest is None:
+            return
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        # The latest entry is the current data version, so it is always kept
+        deleted, _ = Change.objects.filter(timestamp__lt=cutoff).exclude(id=latest.id).delete()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} changes older than {options['days']} days"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from app.utils.stat_sketches import rebuild_sketches
+
+
+class Command(BaseCommand):
+    help = 'Recompute the most searched and distinct count sketches of the dashboard from the hourly stat rollups'
+
+    def handle(self, *args, **options):
+        sketches = rebuild_sketches()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(sketches)} stat sketches"))
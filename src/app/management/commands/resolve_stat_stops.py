@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from app.models import Stat
+from app.utils.stop_matcher import get_stop_matcher
+
+
+class Command(BaseCommand):
+    help = 'Resolve the origin and destination of every Stat to its Stop and Group again, after stops or groups were edited'
+
+    def handle(self, *args, **options):
+        resolved = get_stop_matcher().resolve_stats(Stat.objects.all())
+        self.stdout.write(self.style.SUCCESS(f"Resolved {resolved} stop names"))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from app.utils.jobs import run_due_jobs
+
+
+class Command(BaseCommand):
+    help = 'Run the queued background jobs, such as extracting the trips of Google Directions responses, until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run the jobs that are due and exit')
+        parser.add_argument('--sleep', type=float, default=1, help='Seconds to wait for new jobs when none is due')
+
+    def handle(self, *args, **options):
+        while True:
+            succeeded, failed = run_due_jobs()
+            if succeeded or failed:
+                self.stdout.write(f"Ran {succeeded + failed} jobs, {failed} failed")
+            if options['once']:
+                return
+            # Like a request, each round starts with a usable database connection
+            close_old_connections()
+            time.sleep(options['sleep'])
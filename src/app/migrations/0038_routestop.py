@@ -0,0 +1,81 @@
+# Generated by Django 3.0.14 on 2026-10-18 15:32
+
+import ast
+import re
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# The parsing of app.utils as of this migration, which must not change with it
+TIME_PATTERN = re.compile(r'(\d{1,2})\s*[h:]\s*(\d{2})')
+TRANSLATION_TABLE = str.maketrans('áàâãäéèêëíìîïóòôõöúùûüç', 'aaaaaeeeeiiiiooooouuuuc')
+
+
+def clean_string(s):
+    return ' '.join(s.lower().translate(TRANSLATION_TABLE).replace('-', '').split())
+
+
+def parse_stops(stops):
+    if isinstance(stops, dict):
+        return list(stops.items())
+    try:
+        parsed = ast.literal_eval(str(stops))
+    except (ValueError, SyntaxError):
+        return []
+    return [(str(name), str(time)) for name, time in parsed.items()] if isinstance(parsed, dict) else []
+
+
+def time_to_minutes(time):
+    match = TIME_PATTERN.search(str(time))
+    return None if match is None else int(match.group(1)) * 60 + int(match.group(2))
+
+
+def backfill_route_stops(apps, schema_editor):
+    Route = apps.get_model('app', 'Route')
+    RouteStop = apps.get_model('app', 'RouteStop')
+    route_stops = []
+    for route in Route.objects.all().iterator():
+        for sequence, (stop, time) in enumerate(parse_stops(route.stops)):
+            route_stops.append(RouteStop(
+                route_id=route.id,
+                sequence=sequence,
+                stop=stop,
+                cleaned_stop=clean_string(stop),
+                time=time,
+                minutes_after_midnight=time_to_minutes(time),
+            ))
+    RouteStop.objects.bulk_create(route_stops)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0037_emailopen'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RouteStop',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('sequence', models.IntegerField()),
+                ('stop', models.CharField(max_length=100)),
+                ('cleaned_stop', models.CharField(max_length=100)),
+                ('time', models.CharField(max_length=20)),
+                ('minutes_after_midnight', models.IntegerField(blank=True, null=True)),
+                ('route', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='route_stops', to='app.Route')),
+            ],
+            options={
+                'ordering': ['route', 'sequence'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='routestop',
+            index=models.Index(fields=['cleaned_stop', 'minutes_after_midnight'], name='app_routest_cleaned_da5524_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='routestop',
+            unique_together={('route', 'sequence')},
+        ),
+        migrations.RunPython(backfill_route_stops, migrations.RunPython.noop),
+    ]
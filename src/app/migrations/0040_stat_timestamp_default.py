@@ -0,0 +1,19 @@
+# Generated by Django 3.0.14 on 2026-10-18 15:43
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0039_change'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stat',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.0.14 on 2026-10-18 15:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0040_stat_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('request', models.CharField(max_length=100)),
+                ('platform', models.CharField(max_length=100)),
+                ('language', models.CharField(max_length=100)),
+                ('origin', models.CharField(max_length=100)),
+                ('destination', models.CharField(max_length=100)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='statrollup',
+            index=models.Index(fields=['request', 'hour'], name='app_statrol_request_82842a_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='statrollup',
+            unique_together={('hour', 'request', 'platform', 'language', 'origin', 'destination')},
+        ),
+    ]
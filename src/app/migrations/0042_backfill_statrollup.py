@@ -0,0 +1,25 @@
+from django.db import migrations
+from django.db.models import Count
+from django.db.models.functions import TruncHour
+
+
+def backfill_stat_rollups(apps, schema_editor):
+    Stat = apps.get_model('app', 'Stat')
+    StatRollup = apps.get_model('app', 'StatRollup')
+    # Rows counted since the previous migration are recomputed with the rest
+    StatRollup.objects.all().delete()
+    rows = (Stat.objects.annotate(hour=TruncHour('timestamp'))
+            .values('hour', 'request', 'platform', 'language', 'origin', 'destination')
+            .annotate(count=Count('id')).order_by())
+    StatRollup.objects.bulk_create([StatRollup(**row) for row in rows.iterator()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0041_statrollup'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_stat_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.0.14 on 2026-10-18 15:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0042_backfill_statrollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stat',
+            index=models.Index(fields=['timestamp'], name='app_stat_timesta_ee05b9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stat',
+            index=models.Index(fields=['request', 'timestamp'], name='app_stat_request_99ad50_idx'),
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 3.0.14 on 2026-10-18 15:49
+
+from difflib import SequenceMatcher
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Stat names are matched as app.utils.stop_matcher did when this migration was written
+UNKNOWN_NAMES = {'NA', 'null'}
+TRANSLATION_TABLE = str.maketrans('áàâãäéèêëíìîïóòôõöúùûüç', 'aaaaaeeeeiiiiooooouuuuc')
+
+
+def clean_string(s):
+    return ' '.join(s.lower().translate(TRANSLATION_TABLE).replace('-', '').split())
+
+
+def is_junk(character):
+    return character in ['do', 'da', 'das', 'dos', 'de', ' ']
+
+
+def resolve_stat_stops(apps, schema_editor):
+    Stat = apps.get_model('app', 'Stat')
+    Stop = apps.get_model('app', 'Stop')
+    Group = apps.get_model('app', 'Group')
+    stops = list(Stop.objects.order_by('id').values_list('id', 'name'))
+    stop_ids = {}
+    for stop_id, name in stops:
+        stop_ids.setdefault(name, stop_id)
+    group_ids = {}
+    for group_id, names in Group.objects.order_by('id').values_list('id', 'stops'):
+        for name in names.split(','):
+            if name.strip():
+                group_ids.setdefault(clean_string(name.strip()), group_id)
+
+    def most_similar(stop):
+        most_similar_stop, most_similar_stop_score = stop, 0
+        for _, name in stops:
+            score = SequenceMatcher(is_junk, name.lower(), stop.lower()).ratio()
+            if score > most_similar_stop_score:
+                most_similar_stop, most_similar_stop_score = name, score
+        return most_similar_stop
+
+    for field in ['origin', 'destination']:
+        for name in Stat.objects.order_by().values_list(field, flat=True).distinct():
+            stop_id = group_id = None
+            if name and name not in UNKNOWN_NAMES:
+                stop = most_similar(name)
+                stop_id = stop_ids.get(stop)
+                group_id = group_ids.get(clean_string(name)) or group_ids.get(clean_string(stop))
+            Stat.objects.filter(**{field: name}).update(**{f'{field}_stop_id': stop_id, f'{field}_group_id': group_id})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0043_stat_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stat',
+            name='destination_group',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='app.Group'),
+        ),
+        migrations.AddField(
+            model_name='stat',
+            name='destination_stop',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='app.Stop'),
+        ),
+        migrations.AddField(
+            model_name='stat',
+            name='origin_group',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='app.Group'),
+        ),
+        migrations.AddField(
+            model_name='stat',
+            name='origin_stop',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='app.Stop'),
+        ),
+        migrations.RunPython(resolve_stat_stops, migrations.RunPython.noop),
+    ]
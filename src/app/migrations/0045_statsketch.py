@@ -0,0 +1,82 @@
+# Generated by Django 3.0.14 on 2026-10-18 15:51
+
+import hashlib
+import json
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+# The sketches are written in the format app.utils.stat_sketches reads, as it was when this migration was written
+SEARCH_REQUESTS = ['get_route', 'get_directions', 'find_routes']
+TOP_CAPACITY = 500
+HLL_PRECISION = 12
+
+
+def search_keys(request, origin, destination):
+    keys = []
+    if request in SEARCH_REQUESTS and destination != 'null':
+        keys.append(('destination', destination))
+    if request == 'get_route' and origin != 'null':
+        keys.append(('origin', origin))
+        if destination != 'null':
+            keys.append(('route', f"{origin} -> {destination}"))
+    return keys
+
+
+def space_saving(counts):
+    """The Space-Saving summary of ``counts``, added largest first."""
+    counters = {}
+    for item, count in counts:
+        if len(counters) < TOP_CAPACITY:
+            counters[item] = [count, 0]
+        else:
+            evicted = min(counters, key=lambda key: counters[key][0])
+            minimum = counters.pop(evicted)[0]
+            counters[item] = [minimum + count, minimum]
+    return json.dumps({'capacity': TOP_CAPACITY, 'counters': counters}).encode()
+
+
+def hyper_log_log(items):
+    registers = bytearray(1 << HLL_PRECISION)
+    for item in items:
+        value = int.from_bytes(hashlib.blake2b(item.encode(), digest_size=8).digest(), 'big')
+        register = value >> (64 - HLL_PRECISION)
+        rest = value & ((1 << (64 - HLL_PRECISION)) - 1)
+        registers[register] = max(registers[register], (64 - HLL_PRECISION) - rest.bit_length() + 1)
+    return bytes([HLL_PRECISION]) + bytes(registers)
+
+
+def build_stat_sketches(apps, schema_editor):
+    StatRollup = apps.get_model('app', 'StatRollup')
+    StatSketch = apps.get_model('app', 'StatSketch')
+    rows = (StatRollup.objects.filter(request__in=SEARCH_REQUESTS).order_by()
+            .values_list('request', 'origin', 'destination').annotate(total=Sum('count')).iterator())
+    counts = {key: Counter() for key in ['destination', 'origin', 'route']}
+    for request, origin, destination, total in rows:
+        for key, item in search_keys(request, origin, destination):
+            counts[key][item] += total
+    StatSketch.objects.bulk_create(
+        [StatSketch(name=f'top:{key}', data=space_saving(counts[key].most_common())) for key in counts]
+        + [StatSketch(name=f'distinct:{key}', data=hyper_log_log(counts[key])) for key in counts]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0044_stat_stop_group'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatSketch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('data', models.BinaryField()),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(build_stat_sketches, migrations.RunPython.noop),
+    ]
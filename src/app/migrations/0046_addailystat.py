@@ -0,0 +1,28 @@
+# Generated by Django 3.0.14 on 2026-10-18 15:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0045_statsketch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AdDailyStat',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('seen', models.IntegerField(default=0)),
+                ('clicked', models.IntegerField(default=0)),
+                ('ad', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='app.Ad')),
+            ],
+            options={
+                'ordering': ['ad', 'date'],
+                'unique_together': {('ad', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 3.0.14 on 2026-10-18 15:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Group names are split and cleaned the way app.models did when this migration was written
+TRANSLATION_TABLE = str.maketrans('áàâãäéèêëíìîïóòôõöúùûüç', 'aaaaaeeeeiiiiooooouuuuc')
+
+
+def clean_string(s):
+    return ' '.join(s.lower().translate(TRANSLATION_TABLE).replace('-', '').split())
+
+
+def split_group_stops(stops):
+    return [stop.strip() for stop in stops.split(',') if stop.strip()]
+
+
+def build_group_stops(apps, schema_editor):
+    Group = apps.get_model('app', 'Group')
+    GroupStop = apps.get_model('app', 'GroupStop')
+    Stop = apps.get_model('app', 'Stop')
+    stop_ids = {}
+    for stop_id, name in Stop.objects.order_by('id').values_list('id', 'name'):
+        stop_ids.setdefault(name, stop_id)
+    GroupStop.objects.bulk_create([
+        GroupStop(group_id=group_id, sequence=sequence, name=name, cleaned_name=clean_string(name), stop_id=stop_ids.get(name))
+        for group_id, stops in Group.objects.order_by('id').values_list('id', 'stops')
+        for sequence, name in enumerate(split_group_stops(stops))
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0046_addailystat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupStop',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('sequence', models.IntegerField()),
+                ('name', models.CharField(max_length=100)),
+                ('cleaned_name', models.CharField(db_index=True, max_length=100)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='group_stops', to='app.Group')),
+                ('stop', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='group_stops', to='app.Stop')),
+            ],
+            options={
+                'ordering': ['group', 'sequence'],
+                'unique_together': {('group', 'sequence')},
+            },
+        ),
+        migrations.RunPython(build_group_stops, migrations.RunPython.noop),
+    ]
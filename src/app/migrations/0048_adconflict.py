@@ -0,0 +1,54 @@
+# Generated by Django 3.0.14 on 2026-10-18 15:58
+
+import heapq
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def detect_ad_conflicts(apps, schema_editor):
+    """Sweep the active ads of each (group, platform) by start, as app.utils.ad_conflicts did when this migration was written."""
+    Ad = apps.get_model('app', 'Ad')
+    AdConflict = apps.get_model('app', 'AdConflict')
+    campaigns = {}
+    for ad in Ad.objects.filter(status='active').order_by('id'):
+        for group in {key.strip().lower() for key in ad.advertise_on.split(',') if key.strip()}:
+            campaigns.setdefault((group, ad.platform), []).append(ad)
+
+    conflicts = []
+    for (group, platform), campaign in sorted(campaigns.items()):
+        running = []
+        for ad in sorted(campaign, key=lambda ad: (ad.start, ad.id)):
+            while running and running[0][0] < ad.start:
+                heapq.heappop(running)
+            for end, _, other in running:
+                first, second = sorted([ad, other], key=lambda ad: ad.id)
+                conflicts.append(AdConflict(ad=first, other_ad=second, group=group, platform=platform, start=ad.start, end=min(end, ad.end)))
+            heapq.heappush(running, (ad.end, ad.id, ad))
+    AdConflict.objects.bulk_create(conflicts)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0047_groupstop'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AdConflict',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('group', models.CharField(max_length=100)),
+                ('platform', models.CharField(max_length=100)),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField()),
+                ('ad', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conflicts', to='app.Ad')),
+                ('other_ad', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='app.Ad')),
+            ],
+            options={
+                'ordering': ['start', 'ad', 'other_ad'],
+            },
+        ),
+        migrations.RunPython(detect_ad_conflicts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 3.0.14 on 2026-10-18 16:25
+
+from datetime import timedelta
+
+from django.db import migrations, models
+
+
+def record_earlier_archives(apps, schema_editor):
+    """Archives written before this table existed are only known from the rollups of hours without stats."""
+    Stat = apps.get_model('app', 'Stat')
+    StatRollup = apps.get_model('app', 'StatRollup')
+    StatArchive = apps.get_model('app', 'StatArchive')
+    first_rollup = StatRollup.objects.order_by('hour').values_list('hour', flat=True).first()
+    if first_rollup is None:
+        return
+    oldest = Stat.objects.order_by('timestamp').values_list('timestamp', flat=True).first()
+    if oldest is None:
+        end = StatRollup.objects.order_by('-hour').values_list('hour', flat=True).first() + timedelta(hours=1)
+    else:
+        end = oldest.replace(minute=0, second=0, microsecond=0)
+    if first_rollup < end:
+        StatArchive.objects.create(month=first_rollup, end=end, path='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0049_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatArchive',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateTimeField()),
+                ('end', models.DateTimeField()),
+                ('path', models.CharField(max_length=500)),
+                ('rows', models.IntegerField(default=0)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['month', 'id'],
+            },
+        ),
+        migrations.RunPython(record_earlier_archives, migrations.RunPython.noop),
+    ]
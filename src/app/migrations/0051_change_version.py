@@ -0,0 +1,40 @@
+# Generated by Django 3.0.14 on 2026-10-18 16:40
+
+from django.db import migrations, models
+from django.db.models import F, Max
+
+
+def number_changes(apps, schema_editor):
+    # The ids the clients already hold stay valid data versions
+    Change = apps.get_model('app', 'Change')
+    DataVersion = apps.get_model('app', 'DataVersion')
+    Change.objects.update(version=F('id'))
+    DataVersion.objects.create(id=1, version=Change.objects.aggregate(Max('id'))['id__max'] or 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0050_statarchive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='change',
+            name='version',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.RunPython(number_changes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='change',
+            name='version',
+            field=models.IntegerField(unique=True),
+        ),
+    ]
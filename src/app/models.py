@@ -1,5 +1,5 @@
 from sqlite3 import Timestamp
-from django.db import models
+from django.db import models, transaction
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 from jsonfield import JSONField
@@ -7,6 +7,7 @@ import json
 from sqlalchemy import null
 
 from app.utils.str_utils import clean_string
+from app.utils.stop_utils import parse_stops, time_to_minutes
 
 
 class Data(models.Model):
@@ -80,7 +81,11 @@ class Stop(models.Model):
 
     def save(self, *args, **kwargs):
         self.cleaned_name = clean_string(self.name)
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            # Group memberships point to the Stop named exactly like them
+            GroupStop.objects.filter(stop=self).exclude(name=self.name).update(stop=None)
+            GroupStop.objects.filter(name=self.name, stop=None).update(stop=self)
 
     def __str__(self):
         return self.name
@@ -114,14 +119,52 @@ class Route(models.Model):
     def save(self, *args, **kwargs):
         self.stops = str(self.stops)
         self.cleaned_stops = clean_string(str(self.stops))
-        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if update_fields is None or 'stops' in update_fields:
+                self.sync_route_stops()
+
+    def sync_route_stops(self):
+        self.route_stops.all().delete()
+        RouteStop.objects.bulk_create(RouteStop.from_stops(self, self.stops))
+
+    def get_stop_times(self):
+        return [(route_stop.stop, route_stop.time) for route_stop in self.route_stops.all()]
 
     def __str__(self):
-        self.start = str(self.stops).split(',')[0].split(':')[0].replace('{','').replace('\'','').strip()
-        self.start_time = str(self.stops).split(',')[0].split(':')[1].replace('{','').replace('\'','').strip()
-        self.end = str(self.stops).split(',')[-1].split(':')[0].replace('}','').replace('\'','').strip()
+        stop_times = self.get_stop_times() if self.pk else parse_stops(self.stops)
+        if stop_times:
+            self.start, self.start_time = stop_times[0]
+            self.end = stop_times[-1][0]
         return f"{self.route.strip()} | {self.start} -> {self.end} | {self.start_time} | {self.type_of_day}"
 
+class RouteStop(models.Model):
+    id = models.AutoField(primary_key=True)
+    route = models.ForeignKey(Route, on_delete=models.CASCADE, related_name='route_stops')
+    sequence = models.IntegerField()
+    stop = models.CharField(max_length=100)
+    cleaned_stop = models.CharField(max_length=100)
+    time = models.CharField(max_length=20)
+    minutes_after_midnight = models.IntegerField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['route', 'sequence']
+        unique_together = ['route', 'sequence']
+        indexes = [
+            models.Index(fields=['cleaned_stop', 'minutes_after_midnight']),
+        ]
+
+    @classmethod
+    def from_stops(cls, route, stops):
+        return [
+            cls(route=route, sequence=sequence, stop=stop, cleaned_stop=clean_string(stop), time=time, minutes_after_midnight=time_to_minutes(time))
+            for sequence, (stop, time) in enumerate(parse_stops(stops))
+        ]
+
+    def __str__(self):
+        return f"{self.route_id} | {self.sequence} | {self.stop} | {self.time}"
+
 class Stat(models.Model):    
     id = models.AutoField(primary_key=True)
     request= models.CharField(max_length=100)
@@ -131,9 +174,65 @@ class Stat(models.Model):
     time = models.CharField(max_length=100)
     platform = models.CharField(max_length=100)
     language = models.CharField(max_length=100)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the event is received, not when the buffer writes it
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+    # Resolved from origin and destination when the stat is saved, see app.utils.stop_matcher
+    origin_stop = models.ForeignKey(Stop, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    destination_stop = models.ForeignKey(Stop, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    origin_group = models.ForeignKey('Group', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    destination_group = models.ForeignKey('Group', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    class Meta:
+        # Time range reports only touch the period they ask for
+        indexes = [
+            models.Index(fields=['timestamp']),
+            models.Index(fields=['request', 'timestamp']),
+        ]
+
     def __str__(self):
         return f"{self.request} | {self.origin} -> {self.destination} | {self.type_of_day}"
+
+class StatRollup(models.Model):
+    """Number of Stat events per hour and dimension, kept up to date as stats are saved."""
+    hour = models.DateTimeField()
+    request = models.CharField(max_length=100)
+    platform = models.CharField(max_length=100)
+    language = models.CharField(max_length=100)
+    origin = models.CharField(max_length=100)
+    destination = models.CharField(max_length=100)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ['hour', 'request', 'platform', 'language', 'origin', 'destination']
+        indexes = [
+            models.Index(fields=['request', 'hour']),
+        ]
+
+    def __str__(self):
+        return f"{self.hour:%Y-%m-%d %H:00} | {self.request} | {self.origin} -> {self.destination} | {self.count}"
+
+class StatSketch(models.Model):
+    """A serialized top-K or distinct-count sketch of the stats, see app.utils.stat_sketches."""
+    name = models.CharField(max_length=100, unique=True)
+    data = models.BinaryField()
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} | {self.updated:%Y-%m-%d %H:%M}"
+
+class StatArchive(models.Model):
+    """A file written by archive_stats. Stats before the newest ``end`` only live in these files and the rollups."""
+    month = models.DateTimeField()
+    end = models.DateTimeField()
+    path = models.CharField(max_length=500)
+    rows = models.IntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['month', 'id']
+
+    def __str__(self):
+        return f"{self.month:%Y-%m} | {self.rows} | {self.path}"
     
 class Variables(models.Model):
     version = models.CharField(max_length=100)
@@ -168,14 +267,85 @@ class Ad(models.Model):
     def __str__(self):
         return f"{self.entity} | {self.status} | {self.start} -> {self.end}"
 
+class AdConflict(models.Model):
+    """Two active ads of the same platform advertised on the same group while both run, found when an Ad is saved."""
+    ad = models.ForeignKey(Ad, on_delete=models.CASCADE, related_name='conflicts')
+    other_ad = models.ForeignKey(Ad, on_delete=models.CASCADE, related_name='+')
+    group = models.CharField(max_length=100)
+    platform = models.CharField(max_length=100)
+    # The time both ads run
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+
+    class Meta:
+        ordering = ['start', 'ad', 'other_ad']
+
+    def __str__(self):
+        return f"{self.ad_id} x {self.other_ad_id} | {self.group} | {self.platform} | {self.start} -> {self.end}"
+
+class AdDailyStat(models.Model):
+    """Impressions and clicks of an Ad per day, written with the buffered ad counters."""
+    ad = models.ForeignKey(Ad, on_delete=models.CASCADE, related_name='daily_stats')
+    date = models.DateField()
+    seen = models.IntegerField(default=0)
+    clicked = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['ad', 'date']
+        unique_together = ['ad', 'date']
+
+    def __str__(self):
+        return f"{self.ad.entity} | {self.date} | {self.seen} seen | {self.clicked} clicked"
+
+def split_group_stops(stops):
+    return [stop.strip() for stop in stops.split(',') if stop.strip()]
+
 class Group(models.Model):
     id = models.AutoField(primary_key=True)
     name = models.CharField(max_length=50)
     stops = models.CharField(max_length=500)
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if update_fields is None or 'stops' in update_fields:
+                self.sync_group_stops()
+
+    def sync_group_stops(self):
+        self.group_stops.all().delete()
+        GroupStop.objects.bulk_create(GroupStop.from_stops(self, self.stops))
+
     def __str__(self):
         return f"{self.name.title()}"
 
+class GroupStop(models.Model):
+    id = models.AutoField(primary_key=True)
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='group_stops')
+    sequence = models.IntegerField()
+    name = models.CharField(max_length=100)
+    cleaned_name = models.CharField(max_length=100, db_index=True)
+    # None while no Stop has exactly this name
+    stop = models.ForeignKey(Stop, on_delete=models.SET_NULL, null=True, blank=True, related_name='group_stops')
+
+    class Meta:
+        ordering = ['group', 'sequence']
+        unique_together = ['group', 'sequence']
+
+    @classmethod
+    def from_stops(cls, group, stops):
+        names = split_group_stops(stops)
+        stop_ids = {}
+        for stop_id, name in Stop.objects.filter(name__in=names).order_by('id').values_list('id', 'name'):
+            stop_ids.setdefault(name, stop_id)
+        return [
+            cls(group=group, sequence=sequence, name=name, cleaned_name=clean_string(name), stop_id=stop_ids.get(name))
+            for sequence, name in enumerate(names)
+        ]
+
+    def __str__(self):
+        return f"{self.group_id} | {self.sequence} | {self.name}"
+
 class Info(models.Model):
     id = models.AutoField(primary_key=True)
 
@@ -206,6 +376,50 @@ class Holiday(models.Model):
     def __str__(self):
         return f"{self.name} | {self.date}"
     
+class Change(models.Model):
+    """Journal of the saves and deletes of the rows sent to the apps; its version is the data version."""
+    id = models.AutoField(primary_key=True)
+    # Taken from DataVersion, unlike ids these follow the order the changes were committed in
+    version = models.IntegerField(unique=True)
+    MODEL_CHOICES = [('route', 'Route'), ('holiday', 'Holiday'), ('info', 'Info')]
+    model = models.CharField(max_length=20, choices=MODEL_CHOICES)
+    object_id = models.IntegerField()
+    ACTION_CHOICES = [('save', 'Save'), ('delete', 'Delete')]
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.version} | {self.action} {self.model} {self.object_id} | {self.timestamp}"
+
+class DataVersion(models.Model):
+    """The single counter row of the Change versions, locked by the transaction that records a change."""
+    version = models.IntegerField(default=0)
+
+    def __str__(self):
+        return str(self.version)
+
+class Job(models.Model):
+    """A background task run by the run_jobs command, see app.utils.jobs."""
+    id = models.AutoField(primary_key=True)
+    task = models.CharField(max_length=50)
+    payload = JSONField(default=dict)
+    # Jobs are deleted once they succeed
+    STATUS_CHOICES = [('pending', 'Pending'), ('running', 'Running'), ('failed', 'Failed')]
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.IntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    started = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+
+    def __str__(self):
+        return f"{self.id} | {self.task} | {self.status} | {self.attempts} attempts"
+
 class ReturnRoute():
     def __init__(self, id, route, origin, destination, start, end, stops, type_of_day, information, likes_percent, dislikes_percent):
         self.id = id
@@ -1,5 +1,10 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
 from rest_framework import serializers
-from app.models import Data, Stop, Route, Stat, ReturnRoute, LoadRoute, Trip, TripStop, Variables, Ad, Group, Info, Holiday
+from app.utils.stat_archive import get_archived_until
+from app.models import Data, Stop, Route, Stat, ReturnRoute, LoadRoute, Trip, TripStop, Variables, Ad, AdConflict, Group, Info, Holiday
 class StopSerializer(serializers.ModelSerializer):
     class Meta:
         model = Stop
@@ -20,11 +25,43 @@ class StatSerializer(serializers.ModelSerializer):
         model = Stat
         fields = '__all__'
 
+class StatEventSerializer(serializers.ModelSerializer):
+    """One event of a stat batch, with the same field names and defaults as the add_stat_v1 query parameters."""
+    day = serializers.CharField(source='type_of_day', max_length=100, default='NA')
+    timestamp = serializers.DateTimeField(required=False)
+
+    class Meta:
+        model = Stat
+        fields = ['request', 'origin', 'destination', 'day', 'time', 'platform', 'language', 'timestamp']
+        extra_kwargs = {
+            'request': {'default': 'NA'},
+            'origin': {'default': '', 'allow_blank': True},
+            'destination': {'default': '', 'allow_blank': True},
+            'time': {'default': 'NA'},
+            'platform': {'default': 'NA'},
+            'language': {'default': 'NA'},
+        }
+
+    def validate_timestamp(self, value):
+        if value < timezone.now() - timedelta(days=settings.STAT_MAX_EVENT_AGE_DAYS):
+            raise serializers.ValidationError(f"Stats older than {settings.STAT_MAX_EVENT_AGE_DAYS} days are not accepted")
+        # The rollups of archived months can no longer be recomputed, so they take no new stats
+        archived_until = get_archived_until()
+        if archived_until is not None and value < archived_until:
+            raise serializers.ValidationError("Stats of archived months are no longer accepted")
+        # Client clocks can run ahead, events never happen in the future
+        return min(value, timezone.now())
+
 class AdSerializer(serializers.ModelSerializer):
     class Meta:
         model = Ad
         fields = '__all__'
 
+class AdConflictSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AdConflict
+        fields = ['ad', 'other_ad', 'group', 'platform', 'start', 'end']
+
 class GroupSerializer(serializers.ModelSerializer):
     class Meta:
         model = Group
@@ -0,0 +1,51 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from app.models import Ad, Group, Holiday, Info, Route, Stat, Stop, Variables
+from app.utils.ad_conflicts import detect_ad_conflicts
+from app.utils.ad_index import COUNTER_FIELDS as AD_COUNTER_FIELDS, GENERATION_NAME as ADS_GENERATION_NAME
+from app.utils.generation import invalidate_generation
+from app.utils.load_bundle import GENERATION_NAME as LOAD_GENERATION_NAME
+from app.utils.route_index import invalidate_route_index
+from app.utils.stop_matcher import GENERATION_NAME as STOPS_GENERATION_NAME, get_stop_matcher
+from app.utils.sync import record_change as journal_change
+
+# Saves that only touch these fields do not change the timetable
+COUNTER_FIELDS = {'likes', 'dislikes'}
+
+def record_change(model, instance, signal):
+    journal_change(model, instance.pk, 'delete' if signal is post_delete else 'save')
+
+@receiver([post_save, post_delete], sender=Route)
+def route_changed(sender, instance, signal, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= COUNTER_FIELDS:
+        return
+    invalidate_route_index()
+    record_change('route', instance, signal)
+
+@receiver([post_save, post_delete], sender=Holiday)
+@receiver([post_save, post_delete], sender=Info)
+def journaled_load_data_changed(sender, instance, signal, **kwargs):
+    invalidate_generation(LOAD_GENERATION_NAME)
+    record_change(sender.__name__.lower(), instance, signal)
+
+@receiver([post_save, post_delete], sender=Variables)
+def load_data_changed(sender, **kwargs):
+    invalidate_generation(LOAD_GENERATION_NAME)
+
+@receiver([post_save, post_delete], sender=Stop)
+@receiver([post_save, post_delete], sender=Group)
+def stops_changed(sender, **kwargs):
+    invalidate_generation(STOPS_GENERATION_NAME)
+
+@receiver([post_save, post_delete], sender=Ad)
+def ads_changed(sender, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= AD_COUNTER_FIELDS:
+        return
+    invalidate_generation(ADS_GENERATION_NAME)
+    detect_ad_conflicts()
+
+@receiver(pre_save, sender=Stat)
+def resolve_stat_stops(sender, instance, **kwargs):
+    # Bulk inserts resolve their stats in save_stats
+    get_stop_matcher().resolve_stat(instance)
@@ -1,3 +1,1119 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import Mock, patch
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from app.models import Ad, AdConflict, AdDailyStat, Change, Data, Group, Holiday, Info, Job, Route, Stat, StatArchive, StatRollup, StatSketch, Stop, Trip, TripStop, Variables
+from app.utils.ad_counters import flush_ad_counters
+from app.utils.ad_index import GENERATION_NAME as ADS_GENERATION_NAME
+from app.utils.generation import GenerationCache, bump_generation, get_generation, invalidate_generation
+from app.utils.gmaps_cache import directions_key, get_directions
+from app.utils.jobs import claim_job, enqueue
+from app.utils.journey_planner import plan_journeys
+from app.utils.load_bundle import msgpack
+from app.utils.route_index import get_route_index
+from app.utils.single_flight import file_lock, striped_lock_path
+from app.utils.stat_buffer import StatBuffer, _stat_buffer, flush_stats
+from app.utils.stat_export import STAT_FIELDS
+from app.utils.stat_archive import GENERATION_NAME as STAT_ARCHIVE_GENERATION_NAME
+from app.utils.stat_rollup import add_to_rollups, save_stats
+from app.utils.stat_series import count_series
+from app.utils.stat_sketches import HyperLogLog, SpaceSaving, flush_sketches, sketch_summary
+from app.utils.stop_matcher import GENERATION_NAME as STOPS_GENERATION_NAME, get_stop_matcher
+from app.utils.stop_utils import parse_stops, time_to_minutes
+from app.utils.timetable_snapshot import GENERATION_NAME, compile_timetable, load_snapshot, read_pointer, read_snapshot, write_snapshot
+from app.views.v1.views import get_trip_v1_logic
+
+
+# TestCase never commits, so the caches are invalidated as soon as a save asks for it
+_on_commit = patch('django.db.transaction.on_commit', lambda function: function())
+
+def setUpModule():
+    _on_commit.start()
+
+
+def tearDownModule():
+    _on_commit.stop()
+    # Written while the test database still exists, instead of when the process exits
+    flush_stats()
+    flush_sketches()
+    flush_ad_counters()
+
+
+def create_route(route, stops, type_of_day='WEEKDAY', **kwargs):
+    return Route.objects.create(route=route, stops=stops, type_of_day=type_of_day, information='None', **kwargs)
+
+
+class StopUtilsTests(TestCase):
+    """Test parsing of the stringified stops dictionaries"""
+
+    def test_parse_stops_keeps_order(self):
+        """Test that stops are returned in timetable order"""
+        stops = str({'Ponta Delgada': '07h00', 'Lagoa': '07h20'})
+        self.assertEqual(parse_stops(stops), [('Ponta Delgada', '07h00'), ('Lagoa', '07h20')])
+
+    def test_time_to_minutes_ignores_suffixes(self):
+        """Test that annotated times such as '07h25*' are still parsed"""
+        self.assertEqual(time_to_minutes('07h25*'), 445)
+        self.assertEqual(time_to_minutes('12:05'), 725)
+        self.assertIsNone(time_to_minutes('---'))
+
+
+class RouteIndexTests(TestCase):
+    """Test the stop -> route inverted index used by route searches"""
+
+    def setUp(self):
+        self.morning = create_route('110', {'Ponta Delgada - Hospital': '07h00', 'Lagoa': '07h20', 'Vila Franca do Campo': '07h45'})
+        self.evening = create_route('110', {'Ponta Delgada - Hospital': '18h00', 'Lagoa': '18h20', 'Vila Franca do Campo': '18h45'})
+        self.back = create_route('110', {'Vila Franca do Campo': '08h00', 'Lagoa': '08h25', 'Ponta Delgada': '08h50'})
+        self.saturday = create_route('110', {'Ponta Delgada': '09h00', 'Lagoa': '09h20'}, type_of_day='SATURDAY')
+
+    def test_search_respects_direction(self):
+        """Test that only routes visiting the origin before the destination are returned"""
+        index = get_route_index()
+        self.assertEqual(index.search('ponta delgada', 'lagoa', 'WEEKDAY'), [self.morning.id, self.evening.id])
+        self.assertEqual(index.search('lagoa', 'ponta delgada', 'WEEKDAY'), [self.back.id])
+
+    def test_search_filters_start_time(self):
+        """Test that routes leaving before the start time are skipped"""
+        index = get_route_index()
+        self.assertEqual(index.search('ponta delgada', 'lagoa', 'WEEKDAY', time_to_minutes('12h00')), [self.evening.id])
+
+    def test_search_uses_departure_from_origin(self):
+        """Test that the start time applies to the departure from the origin, in departure order"""
+        index = get_route_index()
+        self.assertEqual(index.search('lagoa', 'vila franca', 'WEEKDAY', time_to_minutes('07h15')), [self.morning.id, self.evening.id])
+        self.assertEqual(index.search('lagoa', 'vila franca', 'WEEKDAY', time_to_minutes('07h25')), [self.evening.id])
+
+    def test_search_limit(self):
+        """Test that the search stops after the first departures"""
+        index = get_route_index()
+        self.assertEqual(index.search('ponta delgada', 'lagoa', None, 0, limit=2), [self.morning.id, self.saturday.id])
+        self.assertEqual(len(get_trip_v1_logic('ponta delgada', 'lagoa', 'WEEKDAY', '', True, limit=1)), 1)
+
+    def test_index_is_rebuilt_when_route_changes(self):
+        """Test that saving or deleting a Route invalidates the index"""
+        get_route_index()
+        self.evening.disabled = True
+        self.evening.save()
+        self.assertEqual(get_route_index().search('ponta delgada', 'lagoa', 'WEEKDAY'), [self.morning.id])
+        self.morning.delete()
+        self.assertEqual(get_route_index().search('ponta delgada', 'lagoa', 'WEEKDAY'), [])
+
+    def test_get_trip_v1_logic(self):
+        """Test the route search returns the same shape as before"""
+        routes = get_trip_v1_logic('Ponta Delgada', 'Vila Franca', 'weekday', '07h30', True)
+        self.assertEqual(len(routes), 1)
+        self.assertEqual(routes[0]['id'], self.evening.id)
+        self.assertEqual(routes[0]['start'], '18h00')
+        self.assertEqual(routes[0]['end'], '18h45')
+        self.assertEqual(routes[0]['origin'], 'Ponta Delgada')
+        self.assertEqual(routes[0]['stops'], self.evening.stops)
+
+    def test_set_info_invalidates_once(self):
+        """Test that updating the information of many routes starts a single new timetable generation"""
+        callbacks = []
+        with patch('django.db.transaction.on_commit', callbacks.append), patch('app.utils.generation.bump_generation') as bump:
+            response = self.client.post('/api/v1/info?info=Obras&stop=Lagoa')
+            for callback in callbacks:
+                callback()
+        self.assertEqual(response.json()['updated'], 4)
+        bump.assert_called_once_with('routes')
+
+    def test_get_trip_v1_logic_reads_snapshot(self):
+        """Test that only the votes of the found routes are read from the database"""
+        get_route_index()
+        with self.assertNumQueries(1):
+            routes = get_trip_v1_logic('Ponta Delgada', 'Lagoa', 'WEEKDAY', '', True)
+        self.assertEqual([route['id'] for route in routes], [self.morning.id, self.evening.id])
+
+
+class RouteStopTests(TestCase):
+    """Test the normalized RouteStop rows kept in sync with Route.stops"""
+
+    def test_route_stops_follow_route_saves(self):
+        """Test that saving a Route rewrites its RouteStop rows"""
+        route = create_route('208', {'Mosteiros - Ramal': '09h15', 'João Bom': '09h25*'})
+        self.assertEqual(
+            list(route.route_stops.values_list('sequence', 'stop', 'cleaned_stop', 'time', 'minutes_after_midnight')),
+            [(0, 'Mosteiros - Ramal', 'mosteiros ramal', '09h15', 555), (1, 'João Bom', 'joao bom', '09h25*', 565)]
+        )
+        route.stops = {'João Bom': '10h00'}
+        route.save()
+        self.assertEqual(route.get_stop_times(), [('João Bom', '10h00')])
+        self.assertEqual(str(route), '208 | João Bom -> João Bom | 10h00 | WEEKDAY')
+
+    def test_counter_updates_keep_route_stops(self):
+        """Test that like/dislike saves do not rewrite the stops"""
+        route = create_route('208', {'Mosteiros - Ramal': '09h15', 'João Bom': '09h25'})
+        ids = list(route.route_stops.values_list('id', flat=True))
+        route.likes += 1
+        route.save(update_fields=['likes', 'dislikes'])
+        self.assertEqual(list(route.route_stops.values_list('id', flat=True)), ids)
+
+
+class GroupStopTests(TestCase):
+    """Test the GroupStop memberships kept in sync with Group.stops"""
+
+    def tearDown(self):
+        invalidate_generation(STOPS_GENERATION_NAME)
+
+    def test_memberships_follow_group_and_stop_saves(self):
+        """Test that saving a Group rewrites its memberships and saving a Stop links the ones named like it"""
+        furnas = Stop.objects.create(name='Furnas', latitude=0, longitude=0)
+        group = Group.objects.create(name='furnas', stops='Furnas, Povoação')
+        self.assertEqual(list(group.group_stops.values_list('sequence', 'name', 'cleaned_name', 'stop')),
+                         [(0, 'Furnas', 'furnas', furnas.id), (1, 'Povoação', 'povoacao', None)])
+        povoacao = Stop.objects.create(name='Povoação', latitude=0, longitude=0)
+        self.assertEqual(povoacao.group_stops.get().group, group)
+        furnas.name = 'Furnas - Igreja'
+        furnas.save()
+        self.assertFalse(furnas.group_stops.exists())
+
+        group.stops = 'Povoação'
+        group.save()
+        self.assertEqual(list(group.group_stops.values_list('name', flat=True)), ['Povoação'])
+
+    def test_exact_lookup(self):
+        """Test that a short stop name is not matched inside a longer one of another group"""
+        for name in ['Ponta Delgada', 'Ponta']:
+            Stop.objects.create(name=name, latitude=0, longitude=0)
+        delgada = Group.objects.create(name='ponta delgada', stops='Ponta Delgada')
+        ponta = Group.objects.create(name='ponta', stops='Ponta')
+        matcher = get_stop_matcher()
+        self.assertEqual(matcher.group_name('ponta'), 'ponta')
+        self.assertEqual(matcher.group_name('Ponta Delgada'), 'ponta delgada')
+        self.assertEqual(matcher.resolve('Ponta')[1], ponta.id)
+        self.assertEqual(matcher.resolve('ponta delgada')[1], delgada.id)
+        self.assertEqual(self.client.get('/api/v1/groups').json()[1]['stops'], ['Ponta'])
+
+
+class JourneyPlannerTests(TestCase):
+    """Test the local RAPTOR journey planner and the v3 route endpoint"""
+
+    def setUp(self):
+        create_route('206', {'Mosteiros - Ramal': '09h15', 'Capelas': '09h40', 'Ponta Delgada': '10h10'})
+        create_route('318', {'Ponta Delgada': '10h12', 'Lagoa': '10h30', 'Furnas': '11h45'})
+        create_route('318', {'Ponta Delgada': '13h45', 'Lagoa': '14h05', 'Furnas': '15h10'})
+        create_route('320', {'Capelas': '09h50', 'Lagoa': '10h40', 'Furnas': '12h00'})
+
+    def test_direct_journey(self):
+        """Test that a direct route is returned as a single leg"""
+        journeys = plan_journeys('ponta delgada', 'furnas', 'WEEKDAY', time_to_minutes('12h00'))
+        self.assertEqual(len(journeys), 1)
+        self.assertEqual(journeys[0]['transfers'], 0)
+        self.assertEqual((journeys[0]['start'], journeys[0]['end']), ('13h45', '15h10'))
+
+    def test_journey_with_transfer_respects_min_transfer(self):
+        """Test that a 2 minute connection is only used when the minimum transfer time allows it"""
+        journeys = plan_journeys('mosteiros', 'furnas', 'WEEKDAY', 0, min_transfer=2)
+        self.assertEqual([leg['route'] for leg in journeys[0]['legs']], ['206', '318'])
+        self.assertEqual(journeys[0]['end'], '11h45')
+
+        journeys = plan_journeys('mosteiros', 'furnas', 'WEEKDAY', 0, min_transfer=5)
+        self.assertEqual([leg['route'] for leg in journeys[0]['legs']], ['206', '320'])
+        self.assertEqual(journeys[0]['legs'][0]['destination'], 'Capelas')
+        self.assertEqual(journeys[0]['end'], '12h00')
+
+    def test_max_transfers(self):
+        """Test that no journey is found when transfers are not allowed"""
+        self.assertEqual(plan_journeys('mosteiros', 'furnas', 'WEEKDAY', 0, max_transfers=0), [])
+
+    def test_get_trip_v3(self):
+        """Test the v3 route endpoint"""
+        response = self.client.get('/api/v3/route', {'origin': 'Mosteiros', 'destination': 'Furnas', 'day': 'WEEKDAY', 'start': '08:00'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['legs'][0]['origin'], 'Mosteiros - Ramal')
+
+        response = self.client.get('/api/v3/route', {'origin': 'Mosteiros', 'destination': 'Furnas', 'max_transfers': 'x'})
+        self.assertEqual(response.status_code, 400)
+        for parameter, value in [('max_transfers', '-1'), ('min_transfer', '-5'), ('limit', '0')]:
+            response = self.client.get('/api/v3/route', {'origin': 'Mosteiros', 'destination': 'Furnas', parameter: value})
+            self.assertEqual(response.status_code, 400)
+
+
+class GenerationCacheTests(TestCase):
+    """Test the per-worker values rebuilt on a new generation"""
+
+    def test_background_rebuild(self):
+        """Test that an out of date value is served while it is rebuilt in the background"""
+        builds = []
+        release = threading.Event()
+
+        def build():
+            if builds:
+                release.wait(5)
+            builds.append(len(builds) + 1)
+            return builds[-1]
+
+        generation_cache = GenerationCache('background-test', build, background=True)
+        self.assertEqual(generation_cache.get(), 1)
+        bump_generation('background-test')
+        self.assertEqual(generation_cache.get(), 1)
+        self.assertEqual(generation_cache.get(), 1)
+        release.set()
+        for _ in range(100):
+            if not generation_cache.refreshing:
+                break
+            time.sleep(0.01)
+        self.assertEqual(generation_cache.get(), 2)
+        self.assertEqual(builds, [1, 2])
+
+
+class TimetableSnapshotTests(TestCase):
+    """Test compiling the timetable into memory-mapped arrays"""
+
+    def setUp(self):
+        create_route('206', {'Mosteiros - Ramal': '09h15', 'Ponta Delgada': '10h10*'})
+        create_route('318', {'Ponta Delgada': '10h12', 'Furnas': '---'}, type_of_day='SUNDAY')
+        create_route('999', {'Lagoa': '10h00', 'Furnas': '11h00'}, disabled=True)
+
+    def test_snapshot_round_trip(self):
+        """Test that a written snapshot is read back memory-mapped with the same rows"""
+        snapshot = compile_timetable()
+        self.assertEqual(snapshot.stops, ['furnas', 'mosteiros ramal', 'ponta delgada'])
+        with tempfile.TemporaryDirectory() as directory, override_settings(TIMETABLE_SNAPSHOT_DIR=directory):
+            generation = write_snapshot(snapshot, 'token')
+            self.assertEqual(read_pointer(), generation)
+            mapped, routes_generation = read_snapshot(generation)
+            self.assertEqual(routes_generation, 'token')
+            self.assertEqual(list(mapped.route_stop_rows()), list(snapshot.route_stop_rows()))
+            rows = list(mapped.route_stop_rows())
+            self.assertEqual(rows[1][4:], ('Ponta Delgada', 'ponta delgada', '10h10*', 610))
+            self.assertEqual(rows[3][3:], ('SUNDAY', 'Furnas', 'furnas', '---', None))
+            del mapped
+
+    def test_missing_generation_starts_a_new_one(self):
+        """Test that a lost generation token does not let a snapshot of another generation match"""
+        with tempfile.TemporaryDirectory() as directory, override_settings(TIMETABLE_SNAPSHOT_DIR=directory):
+            write_snapshot(compile_timetable(), None)
+            caches['generations'].clear()
+            generation = get_generation(GENERATION_NAME)
+            self.assertIsNotNone(generation)
+            self.assertEqual(get_generation(GENERATION_NAME), generation)
+            load_snapshot()
+            self.assertEqual(read_snapshot(read_pointer())[1], generation)
+
+    def test_load_endpoints_read_snapshot(self):
+        """Test that the load payload is built from the snapshot"""
+        Variables.objects.create(version='5.0', maps=True)
+        response = self.client.get('/api/v2/android/load')
+        self.assertEqual(response.status_code, 200)
+        routes = response.json()
+        self.assertEqual(routes[0]['version'], '5.0')
+        self.assertEqual([(route['route'], route['stops'], route['times'], route['weekday']) for route in routes[1:]], [
+            ('206', ['Mosteiros - Ramal', 'Ponta Delgada'], ['09h15', '10h10*'], 'WEEKDAY'),
+            ('318', ['Ponta Delgada', 'Furnas'], ['10h12', '---'], 'SUNDAY'),
+        ])
+
+
+class LoadBundleTests(TestCase):
+    """Test the precompressed load bundles and their ETags"""
+
+    def setUp(self):
+        Variables.objects.create(version='5.0', maps=True)
+        create_route('206', {'Mosteiros - Ramal': '09h15', 'Ponta Delgada': '10h10'})
+
+    def test_gzip_and_not_modified(self):
+        """Test that the bundle is served gzipped and revalidated with If-None-Match"""
+        response = self.client.get('/api/v2/android/load', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        routes = json.loads(gzip.decompress(response.content))
+        self.assertEqual(routes[1]['stops'], ['Mosteiros - Ramal', 'Ponta Delgada'])
+
+        etag = response['ETag']
+        response = self.client.get('/api/v2/android/load', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes_with_data(self):
+        """Test that a new holiday or route produces a new version of the bundle"""
+        etag = self.client.get('/api/v2/webapp/load')['ETag']
+        Holiday.objects.create(date='2026-12-25', name='Natal')
+        response = self.client.get('/api/v2/webapp/load', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['holidays'][0]['name'], 'Natal')
+
+        etag = response['ETag']
+        create_route('318', {'Ponta Delgada': '10h12', 'Furnas': '11h30'})
+        response = self.client.get('/api/v2/webapp/load', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['stops'], ['Furnas', 'Mosteiros - Ramal', 'Ponta Delgada'])
+
+    def test_columnar_format(self):
+        """Test that the columnar layout sends each stop once and times as minutes"""
+        create_route('318', {'Ponta Delgada': '10h12*', 'Furnas': '11h30'})
+        response = self.client.get('/api/v2/android/load', {'format': 'columnar'})
+        self.assertEqual(response['Content-Type'], 'application/vnd.saomiguelbus.columnar+json')
+        data = response.json()
+        self.assertEqual(data['version'], '5.0')
+        self.assertEqual(data['stops'], ['Furnas', 'Mosteiros - Ramal', 'Ponta Delgada'])
+        self.assertEqual(data['routes']['route'], ['206', '318'])
+        self.assertEqual(data['routes']['stops'], [[1, 2], [2, 0]])
+        self.assertEqual(data['routes']['times'], [[555, 610], [612, 690]])
+        self.assertEqual(data['routes']['labels'], [[1, 0, '10h12*']])
+
+    @skipUnless(msgpack, 'msgpack is not installed')
+    def test_msgpack_by_accept_header(self):
+        """Test that MessagePack is negotiated through the Accept header and versioned separately"""
+        default = self.client.get('/api/v1/android/load')
+        response = self.client.get('/api/v1/android/load', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertNotEqual(response['ETag'], default['ETag'])
+        data = msgpack.unpackb(response.content)
+        self.assertEqual(data['stops'], ['Mosteiros - Ramal', 'Ponta Delgada'])
+        self.assertEqual(data['routes']['times'], [[555, 610]])
+
+
+class SyncTests(TestCase):
+    """Test the delta sync endpoint and its change journal"""
+
+    def setUp(self):
+        self.route = create_route('206', {'Mosteiros - Ramal': '09h15', 'Ponta Delgada': '10h10'})
+        self.holiday = Holiday.objects.create(date='2026-12-25', name='Natal')
+
+    def sync(self, since=None):
+        response = self.client.get('/api/v2/android/sync', {'since': since} if since is not None else {})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_full_sync_for_new_clients(self):
+        """Test that clients without a data version get everything"""
+        data = self.sync()
+        self.assertTrue(data['full'])
+        self.assertEqual([route['id'] for route in data['routes']['changed']], [self.route.id])
+        self.assertEqual(data['holidays']['changed'][0]['name'], 'Natal')
+        self.assertEqual(data['data_version'], Change.objects.latest('version').version)
+
+    def test_delta_sync(self):
+        """Test that only rows changed after the client's version are sent"""
+        version = self.sync()['data_version']
+        self.assertEqual(self.sync(version)['routes'], {'changed': [], 'removed': []})
+
+        route = create_route('318', {'Ponta Delgada': '10h12', 'Furnas': '11h30'})
+        removed_id = self.route.id
+        self.route.delete()
+        self.holiday.name = 'Dia de Natal'
+        self.holiday.save()
+
+        data = self.sync(version)
+        self.assertFalse(data['full'])
+        self.assertEqual([(r['id'], r['stops']) for r in data['routes']['changed']], [(route.id, ['Ponta Delgada', 'Furnas'])])
+        self.assertEqual(data['routes']['removed'], [removed_id])
+        self.assertEqual(data['holidays']['changed'][0]['name'], 'Dia de Natal')
+        self.assertEqual(data['infos'], {'changed': [], 'removed': []})
+
+    def test_disabled_route_is_removed(self):
+        """Test that disabling a route removes it from the clients"""
+        version = self.sync()['data_version']
+        self.route.disabled = True
+        self.route.save()
+        self.assertEqual(self.sync(version)['routes']['removed'], [self.route.id])
+
+    def test_expired_infos_are_not_sent(self):
+        """Test that infos past their end are left out of full syncs and removed by delta syncs"""
+        now = timezone.now()
+        current = Info.objects.create(source='', company='', end=now + timedelta(days=1))
+        expired = Info.objects.create(source='', company='', start=now - timedelta(days=2), end=now - timedelta(days=1))
+        self.assertEqual([info['id'] for info in self.sync()['infos']['changed']], [current.id])
+
+        version = self.sync()['data_version']
+        expired.save()
+        self.assertEqual(self.sync(version)['infos'], {'changed': [], 'removed': [expired.id]})
+
+    def test_versions_follow_the_journal_counter(self):
+        """Test that every change takes the next data version, whatever its id"""
+        version = self.sync()['data_version']
+        Change.objects.filter(version=version).update(id=F('id') + 1000)
+        self.holiday.save()
+        self.assertEqual(Change.objects.latest('version').version, version + 1)
+        self.assertEqual(self.sync(version)['holidays']['changed'][0]['id'], self.holiday.id)
+
+    def test_truncated_journal_falls_back_to_full_sync(self):
+        """Test that a version no longer in the journal gets a full snapshot"""
+        version = self.sync()['data_version']
+        Holiday.objects.create(date='2027-01-01', name='Ano Novo')
+        Change.objects.filter(version__lte=version).delete()
+        data = self.sync(version)
+        self.assertTrue(data['full'])
+        self.assertEqual(len(data['holidays']['changed']), 2)
+
+
+@override_settings(STAT_BUFFER_SIZE=3, STAT_BUFFER_SECONDS=3600)
+class StatBufferTests(TestCase):
+    """Test that stat events are queued and written in bulk"""
+
+    def setUp(self):
+        # Flushes are run by the tests, not by a thread writing outside the test transaction
+        patcher = patch.object(StatBuffer, 'start_flusher')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        _stat_buffer.wake.clear()
+
+    def tearDown(self):
+        flush_stats()
+
+    def add_stat(self, origin):
+        response = self.client.post(f'/api/v1/stat?request=find_route&origin={origin}&destination=Furnas&platform=android')
+        self.assertEqual(response.json(), {'status': 'ok'})
+
+    def test_flush_on_size(self):
+        """Test that a full buffer wakes the flusher instead of being written by the request"""
+        self.add_stat('Ponta Delgada')
+        self.add_stat('Ribeira Grande')
+        self.assertFalse(_stat_buffer.wake.is_set())
+        self.add_stat('Lagoa')
+        self.assertTrue(_stat_buffer.wake.is_set())
+        self.assertEqual(Stat.objects.count(), 0)
+        flush_stats()
+        self.assertEqual(list(Stat.objects.order_by('id').values_list('origin', flat=True)), ['Ponta Delgada', 'Ribeira Grande', 'Lagoa'])
+
+    def test_explicit_flush(self):
+        """Test that a flush writes what is queued, with the time each event was received"""
+        before = timezone.now()
+        self.add_stat('Ponta Delgada')
+        self.assertEqual(flush_stats(), 1)
+        self.assertEqual(flush_stats(), 0)
+        stat = Stat.objects.get()
+        self.assertEqual(stat.platform, 'android')
+        self.assertGreaterEqual(stat.timestamp, before)
+
+    @override_settings(STAT_BUFFER_SIZE=1)
+    def test_unbuffered(self):
+        """Test that a buffer size of one saves every event straight away"""
+        self.add_stat('Ponta Delgada')
+        self.assertEqual(Stat.objects.count(), 1)
+
+    # Long enough for the fixed timestamps of the events
+    @override_settings(STAT_MAX_EVENT_AGE_DAYS=36500)
+    def test_batch(self):
+        """Test that a batch keeps client timestamps, skips invalid events and saves the rest at once"""
+        events = [
+            {'request': 'android_load', 'platform': 'android', 'language': 'pt', 'timestamp': '2026-10-01T08:30:00Z'},
+            {'request': 'find_routes', 'origin': 'Ponta Delgada', 'destination': 'Furnas', 'day': 'WEEKDAY', 'time': '08h00'},
+            {'request': 'get_route', 'timestamp': 'yesterday'},
+            {'request': 'get_directions', 'timestamp': '2999-01-01T00:00:00Z'},
+        ]
+        response = self.client.post('/api/v1/stat/batch', events, content_type='application/json')
+        self.assertEqual(response.json()['created'], 3)
+        self.assertEqual([event['index'] for event in response.json()['rejected']], [2])
+
+        stats = Stat.objects.order_by('id')
+        self.assertEqual([stat.request for stat in stats], ['android_load', 'find_routes', 'get_directions'])
+        self.assertEqual(stats[0].timestamp.isoformat(), '2026-10-01T08:30:00+00:00')
+        self.assertEqual((stats[1].type_of_day, stats[1].platform), ('WEEKDAY', 'NA'))
+        self.assertLessEqual(stats[2].timestamp, timezone.now())
+
+        response = self.client.post('/api/v1/stat/batch', {'request': 'get_route'}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(STAT_MAX_EVENT_AGE_DAYS=7)
+    def test_batch_rejects_old_events(self):
+        """Test that batch events older than STAT_MAX_EVENT_AGE_DAYS are rejected"""
+        now = timezone.now()
+        events = [{'request': 'android_load', 'timestamp': (now - timedelta(days=days)).isoformat()} for days in [1, 8]]
+        events.append({'request': 'android_load', 'timestamp': '1970-01-01T00:00:00Z'})
+        response = self.client.post('/api/v1/stat/batch', events, content_type='application/json').json()
+        self.assertEqual((response['created'], [event['index'] for event in response['rejected']]), (1, [1, 2]))
+
+
+# Long enough for the fixed timestamps of the events
+@override_settings(STAT_MAX_EVENT_AGE_DAYS=36500)
+class StatRollupTests(TestCase):
+    """Test the hourly stat rollups and their backfill"""
+
+    def post_events(self, events):
+        response = self.client.post('/api/v1/stat/batch', events, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+    def rollups(self):
+        return list(StatRollup.objects.order_by('hour', 'request').values_list('hour', 'request', 'destination', 'count'))
+
+    def test_incremental_and_backfill(self):
+        """Test that saved stats are counted per hour and a backfill gives the same counts"""
+        event = {'request': 'get_route', 'origin': 'Ponta Delgada', 'destination': 'Furnas', 'platform': 'android'}
+        self.post_events([dict(event, timestamp='2026-10-01T08:10:00Z'), dict(event, timestamp='2026-10-01T08:50:00Z')])
+        self.post_events([dict(event, timestamp='2026-10-01T08:59:00Z'), dict(event, timestamp='2026-10-01T09:00:00Z', request='find_routes')])
+
+        hour = timezone.make_aware(datetime(2026, 10, 1, 8))
+        expected = [(hour, 'get_route', 'Furnas', 3), (hour + timedelta(hours=1), 'find_routes', 'Furnas', 1)]
+        self.assertEqual(self.rollups(), expected)
+
+        StatRollup.objects.all().delete()
+        call_command('backfill_stat_rollups', stdout=StringIO())
+        self.assertEqual(self.rollups(), expected)
+
+    def test_set_based_rollup_writes(self):
+        """Test that a batch with many keys updates the rollups with a fixed number of statements"""
+        now = timezone.now()
+        def stat(origin):
+            return Stat(request='get_route', origin=origin, destination='Furnas', platform='android', timestamp=now)
+        add_to_rollups([stat('Ponta Delgada')])
+        with self.assertNumQueries(3):
+            add_to_rollups([stat('Ponta Delgada')] * 2 + [stat(f"Stop {number}") for number in range(50)])
+        self.assertEqual(StatRollup.objects.get(origin='Ponta Delgada').count, 3)
+        self.assertEqual(StatRollup.objects.filter(origin__startswith='Stop ', count=1).count(), 50)
+
+    def test_backfill_range(self):
+        """Test that a ranged backfill only replaces the hours in the range"""
+        self.post_events([{'request': 'android_load', 'timestamp': '2026-10-01T08:10:00Z'},
+                          {'request': 'android_load', 'timestamp': '2026-10-02T08:10:00Z'}])
+        StatRollup.objects.update(count=7)
+        call_command('backfill_stat_rollups', since='2026-10-02', stdout=StringIO())
+        self.assertEqual([count for _, _, _, count in self.rollups()], [7, 1])
+
+
+class GroupStatsTests(TestCase):
+    """Test the group impressions report"""
+
+    def setUp(self):
+        for name in ['Furnas', 'Povoação', 'Ponta Delgada']:
+            Stop.objects.create(name=name, latitude=0, longitude=0)
+        self.group = Group.objects.create(name='furnas', stops='Furnas,Povoação')
+        stats = [
+            ('get_route', 'Furnas', 'android'),
+            ('get_route', 'Povoacao', 'web'),
+            ('find_routes', 'furnas ', 'android'),
+            ('get_directions', 'Ponta Delgada', 'android'),
+            ('get_route', 'NA', 'android'),
+            ('get_route', 'Furnas', 'ios'),
+        ]
+        for request, destination, platform in stats:
+            Stat.objects.create(request=request, origin='Ponta Delgada', destination=destination, platform=platform,
+                                type_of_day='WEEKDAY', time='08h00', language='pt')
+
+    def tearDown(self):
+        # The stops are rolled back without signals, so the cached matcher would keep their ids
+        invalidate_generation(STOPS_GENERATION_NAME)
+
+    def get_report(self, **params):
+        now = timezone.now()
+        params = dict({'group': 'furnas', 'start_time': int((now - timedelta(hours=1)).timestamp()),
+                       'end_time': int((now + timedelta(hours=1)).timestamp())}, **params)
+        return self.client.get('/api/v1/stats/group', params).json()
+
+    def test_destinations_matched_to_group(self):
+        """Test that exact and similar destinations of the group's stops are counted per page"""
+        report = self.get_report(platform='android,web')
+        self.assertEqual(report['total_impressions'], 3)
+        self.assertEqual(report['search_page_impressions'], 2)
+        self.assertEqual(report['find_page_impressions'], 1)
+        self.assertEqual(report['directions_page_impressions'], 0)
+        self.assertEqual(len(report['detailed_impressions']), 4)
+
+    def test_stops_resolved_on_save(self):
+        """Test that stats keep the raw names and point to the resolved stop and group"""
+        stat = Stat.objects.get(destination='Povoacao')
+        self.assertEqual((stat.destination_stop.name, stat.destination_group), ('Povoação', self.group))
+        self.assertEqual((stat.origin_stop.name, stat.origin_group), ('Ponta Delgada', None))
+        self.assertIsNone(Stat.objects.get(destination='NA').destination_stop)
+
+        Group.objects.create(name='ponta delgada', stops='Ponta Delgada')
+        call_command('resolve_stat_stops', stdout=StringIO())
+        self.assertEqual(Stat.objects.filter(origin_group__name='ponta delgada').count(), 6)
+
+    def test_single_platform(self):
+        """Test that a single platform is filtered on too"""
+        report = self.get_report(platform='ios')
+        self.assertEqual(report['total_impressions'], 1)
+
+    def test_home_page_impressions(self):
+        """Test that home impressions are the median daily loads, counting days without loads"""
+        now = timezone.now()
+        loads = [now - timedelta(days=3)] * 4 + [now - timedelta(days=2)] * 2 + [now - timedelta(days=1)] * 3
+        for timestamp in loads:
+            Stat.objects.create(request='android_load', platform='android', language='pt', timestamp=timestamp)
+        report = self.get_report(group='home', start_time=int((now - timedelta(days=4)).timestamp()), end_time=int(now.timestamp()))
+        # Five days: 0, 4, 2, 3 and 0 loads
+        self.assertEqual(report['home_page_impressions'], 2 * 5)
+
+
+class StatSeriesTests(TestCase):
+    """Test the zero-filled stat time series"""
+
+    def test_daily_and_hourly(self):
+        """Test that stats are bucketed by day and hour with the empty buckets included"""
+        start = timezone.make_aware(datetime(2026, 10, 1, 22, 30))
+        for hours in [0, 0.5, 2, 26]:
+            Stat.objects.create(request='android_load', timestamp=start + timedelta(hours=hours))
+        self.assertEqual(count_series(Stat.objects.all(), start, start + timedelta(days=2)),
+                         [(date(2026, 10, 1), 2), (date(2026, 10, 2), 1), (date(2026, 10, 3), 1)])
+        hourly = count_series(Stat.objects.all(), start, start + timedelta(hours=3), unit='hour')
+        self.assertEqual([count for _, count in hourly], [1, 1, 1, 0])
+        self.assertEqual(hourly[0][0], timezone.make_aware(datetime(2026, 10, 1, 22)))
+
+
+# Long enough for the month old event
+@override_settings(STAT_MAX_EVENT_AGE_DAYS=365)
+class StatisticsDashboardTests(TestCase):
+    """Test the statistics dashboard aggregates"""
+
+    def setUp(self):
+        caches['stats'].clear()
+        now = timezone.now()
+        events = [
+            {'request': 'android_load', 'language': 'pt', 'timestamp': (now - timedelta(days=30)).isoformat()},
+            {'request': 'android_load', 'language': 'en', 'timestamp': now.isoformat()},
+            {'request': 'android_load', 'language': 'pt', 'timestamp': now.isoformat()},
+            {'request': 'android_load', 'language': 'pt', 'timestamp': now.isoformat()},
+            {'request': 'get_route', 'origin': 'Ponta Delgada', 'destination': 'Furnas', 'timestamp': now.isoformat()},
+            {'request': 'get_route', 'origin': 'Ponta Delgada', 'destination': 'Furnas', 'timestamp': (now - timedelta(days=30)).isoformat()},
+            {'request': 'find_routes', 'origin': 'Lagoa', 'destination': 'Nordeste', 'timestamp': now.isoformat()},
+        ]
+        # Sketch items left by other tests are merged and dropped, in this test's transaction
+        flush_sketches()
+        StatSketch.objects.all().delete()
+        self.client.post('/api/v1/stat/batch', events, content_type='application/json')
+        flush_sketches()
+
+    def test_dashboard(self):
+        """Test that all-time figures cover every stat and window figures only the window"""
+        now = timezone.now()
+        response = self.client.get('/statistics', {'start_time': int((now - timedelta(hours=1)).timestamp()),
+                                                   'end_time': int((now + timedelta(minutes=1)).timestamp())})
+        context = response.context
+        self.assertEqual(context['no'][:2], [75.0, 25.0])
+        self.assertEqual(context['most_searched_destinations_labels'], ['Furnas', 'Nordeste'])
+        self.assertEqual(context['most_searched_destinations_values'], [2, 1])
+        self.assertEqual(context['most_searched_routes_labels'], ['Ponta Delgada -> Furnas'])
+        self.assertEqual(context['android_loads_today_count'], 3)
+        self.assertEqual(context['get_routes_today'], 1)
+        self.assertEqual(sum(context['android_loads_timestamp_values']), 3)
+        self.assertEqual(len(context['latests_activity']), 7)
+
+    def test_sketches_and_exact_counts(self):
+        """Test that the sketches are kept up to date as stats arrive and agree with the exact counts"""
+        approximate = self.client.get('/statistics').context
+        exact = self.client.get('/statistics', {'exact': 'true'}).context
+        self.assertTrue(approximate['approximate'])
+        self.assertFalse(exact['approximate'])
+        for key in ['most_searched_destinations_labels', 'most_searched_destinations_values', 'most_searched_routes_values',
+                    'distinct_destinations', 'distinct_origins', 'distinct_routes']:
+            self.assertEqual(approximate[key], exact[key])
+        self.assertEqual(exact['distinct_destinations'], 2)
+
+        call_command('rebuild_stat_sketches', stdout=StringIO())
+        self.assertEqual(sketch_summary(1)['destination'], ([('Furnas', 2)], 2))
+
+
+class SketchTests(TestCase):
+    """Test the top-K and distinct count sketches"""
+
+    def test_space_saving(self):
+        """Test that frequent items survive a stream of many rare ones"""
+        sketch = SpaceSaving(capacity=20)
+        for i in range(2000):
+            sketch.add('Furnas' if i % 4 == 0 else 'Nordeste' if i % 4 == 1 else f'rare {i}')
+        top = SpaceSaving.from_bytes(sketch.to_bytes()).top(2)
+        self.assertEqual([item for item, _ in top], ['Furnas', 'Nordeste'])
+        self.assertEqual(top[0][1], 500)
+
+    def test_hyperloglog(self):
+        """Test that distinct counts are within a few percent, small and large"""
+        sketch = HyperLogLog()
+        for i in range(50):
+            sketch.add(f'stop {i % 10}')
+        self.assertEqual(sketch.count(), 10)
+        for i in range(20000):
+            sketch.add(f'stop {i}')
+        self.assertAlmostEqual(HyperLogLog.from_bytes(sketch.to_bytes()).count() / 20000, 1, delta=0.05)
+
+    def test_merge(self):
+        """Test that merged sketches count the items of both, with full summaries bounding what they dropped"""
+        first, second = SpaceSaving(capacity=3), SpaceSaving(capacity=3)
+        for item in ['Furnas'] * 5 + ['Nordeste'] * 2 + ['Lagoa']:
+            first.add(item)
+        for item in ['Furnas'] * 3 + ['Sete Cidades'] * 4:
+            second.add(item)
+        first.merge(second)
+        self.assertEqual(first.top(2), [('Furnas', 8), ('Sete Cidades', 5)])
+        self.assertEqual(len(first.counters), 3)
+
+        first, second = HyperLogLog(), HyperLogLog()
+        for i in range(1000):
+            (first if i % 2 else second).add(f'stop {i}')
+            second.add(f'stop {i % 10}')
+        first.merge(second)
+        self.assertAlmostEqual(first.count() / 1000, 1, delta=0.05)
+
+
+class ArchiveStatsTests(TestCase):
+    """Test the archival of stats past the retention window"""
+
+    def tearDown(self):
+        # The archive records are rolled back without telling the cached watermark
+        invalidate_generation(STAT_ARCHIVE_GENERATION_NAME)
+
+    def test_archive_old_months(self):
+        """Test that whole months before the window are written to gzipped files and deleted"""
+        now = timezone.now()
+        old = [now - timedelta(days=days) for days in [400, 401, 430]]
+        for timestamp in old + [now]:
+            Stat.objects.create(request='android_load', language='pt', timestamp=timestamp)
+
+        with tempfile.TemporaryDirectory() as directory:
+            call_command('archive_stats', months=12, dir=directory, stdout=StringIO())
+            self.assertEqual(list(Stat.objects.values_list('timestamp', flat=True)), [now])
+
+            archived = []
+            for name in sorted(os.listdir(directory)):
+                self.assertTrue(name.startswith('stats-') and name.endswith('.jsonl.gz'))
+                with gzip.open(os.path.join(directory, name), 'rt') as archive:
+                    archived += [json.loads(line) for line in archive]
+            self.assertEqual(len(archived), 3)
+            self.assertEqual({row['request'] for row in archived}, {'android_load'})
+
+            # Late stats for an archived month go to a new part
+            Stat.objects.create(request='get_route', timestamp=old[0])
+            call_command('archive_stats', months=12, dir=directory, stdout=StringIO())
+            self.assertEqual(Stat.objects.count(), 1)
+            self.assertTrue(any('.1.jsonl.gz' in name for name in os.listdir(directory)))
+
+    def test_rows_saved_while_archiving_are_kept(self):
+        """Test that a row of the month committed after its file was written is not deleted"""
+        old = timezone.now() - timedelta(days=400)
+        Stat.objects.create(id=10, request='android_load', timestamp=old)
+        replace = os.replace
+
+        def replace_and_save_late_row(source, destination):
+            replace(source, destination)
+            # Ids are taken when a transaction inserts, not when it commits
+            Stat.objects.create(id=5, request='get_route', timestamp=old)
+
+        with tempfile.TemporaryDirectory() as directory, patch('app.management.commands.archive_stats.os.replace', replace_and_save_late_row):
+            call_command('archive_stats', months=12, dir=directory, stdout=StringIO())
+        self.assertEqual(list(Stat.objects.values_list('request', flat=True)), ['get_route'])
+
+    @override_settings(STAT_ARCHIVE_DIR='')
+    def test_archive_dir_required(self):
+        """Test that archiving refuses to run without an explicit directory"""
+        Stat.objects.create(request='android_load', timestamp=timezone.now() - timedelta(days=400))
+        with self.assertRaises(CommandError):
+            call_command('archive_stats', dir='', stdout=StringIO())
+        self.assertEqual(Stat.objects.count(), 1)
+
+    def test_rebuild_keeps_archived_hours(self):
+        """Test that a full backfill after archiving keeps the rollups of the archived months"""
+        now = timezone.now()
+        save_stats([Stat(request='android_load', language='pt', timestamp=timestamp)
+                    for timestamp in [now - timedelta(days=400), now - timedelta(days=430), now]])
+        with tempfile.TemporaryDirectory() as directory:
+            call_command('archive_stats', months=12, dir=directory, stdout=StringIO())
+        # A stat left in an archived month does not let the backfill recompute it
+        Stat.objects.create(request='android_load', timestamp=now - timedelta(days=430))
+        call_command('backfill_stat_rollups', stdout=StringIO())
+        self.assertEqual(sum(StatRollup.objects.values_list('count', flat=True)), 3)
+        self.assertTrue(StatArchive.objects.exists())
+
+    def test_archived_months_refuse_stats(self):
+        """Test that batch events timestamped in an archived month are rejected"""
+        now = timezone.now()
+        Stat.objects.create(request='android_load', timestamp=now - timedelta(days=400))
+        with tempfile.TemporaryDirectory() as directory:
+            call_command('archive_stats', months=12, dir=directory, stdout=StringIO())
+        events = [{'request': 'android_load', 'timestamp': (now - timedelta(days=400)).isoformat()},
+                  {'request': 'android_load', 'timestamp': now.isoformat()}]
+        response = self.client.post('/api/v1/stat/batch', events, content_type='application/json').json()
+        self.assertEqual((response['created'], [rejected['index'] for rejected in response['rejected']]), (1, [0]))
+
+
+class StatExportTests(TestCase):
+    """Test the streaming stat exports"""
+
+    def setUp(self):
+        now = timezone.now()
+        self.params = {'start_time': int((now - timedelta(hours=1)).timestamp()), 'end_time': int((now + timedelta(hours=1)).timestamp())}
+        for origin in ['Ponta Delgada', 'Lagoa', 'Furnas']:
+            Stat.objects.create(request='get_route', origin=origin, destination='Nordeste', platform='android')
+
+    def export(self, **params):
+        response = self.client.get('/api/v1/stats', dict(self.params, **params))
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content).decode() if response.streaming else None
+
+    def test_csv(self):
+        """Test that CSV exports stream the chosen fields with a header row"""
+        response, content = self.export(format='csv', fields='origin,destination')
+        self.assertTrue(response['Content-Type'].startswith('text/csv'))
+        self.assertEqual(content.splitlines(), ['origin,destination', 'Ponta Delgada,Nordeste', 'Lagoa,Nordeste', 'Furnas,Nordeste'])
+
+    def test_ndjson_cursor(self):
+        """Test that NDJSON pages follow the cursor until the last page"""
+        response, content = self.export(format='ndjson', fields='id,origin', limit=2)
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([row['origin'] for row in rows], ['Ponta Delgada', 'Lagoa'])
+        self.assertEqual(response['X-Next-Cursor'], str(rows[-1]['id']))
+
+        response, content = self.export(format='ndjson', fields='origin', limit=2, after=response['X-Next-Cursor'])
+        self.assertEqual([json.loads(line) for line in content.splitlines()], [{'origin': 'Furnas'}])
+        self.assertFalse(response.has_header('X-Next-Cursor'))
+
+    def test_json_and_unknown_fields(self):
+        """Test that the JSON response is unchanged and unknown fields are rejected"""
+        response, _ = self.export()
+        self.assertEqual(len(response.json()), 3)
+        self.assertEqual(set(response.json()[0]), set(STAT_FIELDS))
+        response = self.client.get('/api/v1/stats', dict(self.params, format='csv', fields='origin,password'))
+        self.assertEqual(response.status_code, 400)
+
+
+class AdIndexTests(TestCase):
+    """Test ad selection from the in-memory ad index"""
+
+    def setUp(self):
+        now = timezone.now()
+        Stop.objects.create(name='Furnas', latitude=0, longitude=0)
+        Group.objects.create(name='furnas', stops='Furnas,Povoação')
+        Group.objects.create(name='lagoa', stops='Lagoa')
+        self.home = Ad.objects.create(entity='Home', media='home.png', advertise_on='home', platform='android', status='active',
+                                      start=now - timedelta(days=1), end=now + timedelta(days=1))
+        self.furnas = Ad.objects.create(entity='Furnas', media='furnas.png', advertise_on='furnas', platform='android', status='active',
+                                        start=now - timedelta(days=1), end=now + timedelta(days=1))
+        self.expired = Ad.objects.create(entity='Lagoa', media='lagoa.png', advertise_on='lagoa', platform='android', status='active',
+                                         start=now - timedelta(days=3), end=now - timedelta(days=2))
+        self.default = Ad.objects.create(entity='Default', media='default.png', advertise_on='home', platform='android', status='default')
+
+    def tearDown(self):
+        flush_ad_counters()
+        invalidate_generation(STOPS_GENERATION_NAME)
+        invalidate_generation(ADS_GENERATION_NAME)
+
+    def get_ad(self, on):
+        return self.client.get('/api/v1/ad', {'on': on, 'platform': 'android'}).json()['id']
+
+    def test_selection(self):
+        """Test that ads are picked by group, falling back from destination to origin and then to a default ad"""
+        self.assertEqual(self.get_ad('home'), self.home.id)
+        self.assertEqual(self.get_ad('Furnas -> Lagoa'), self.furnas.id)
+        self.assertEqual(self.get_ad('Lagoa -> Furnas'), self.furnas.id)
+        # Matched to the group of the most similar stop
+        self.assertEqual(self.get_ad('Lagoa -> Furna'), self.furnas.id)
+        # The Lagoa ad is over
+        self.assertEqual(self.get_ad('Lagoa -> Lagoa'), self.default.id)
+
+    @override_settings(AD_COUNTER_BUFFER_SECONDS=3600)
+    def test_no_queries_and_buffered_counters(self):
+        """Test that a warm index needs no query, counters are written on flush and ad edits rebuild the index"""
+        self.get_ad('home')
+        self.get_ad('Furnas -> Lagoa')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_ad('Lagoa -> Furnas'), self.furnas.id)
+        # The counters change without rebuilding the index, so it does not send them
+        self.assertFalse({'seen', 'clicked'} & set(self.client.get('/api/v1/ad', {'on': 'home', 'platform': 'android'}).json()))
+        self.client.post(f'/api/v1/ad/click?id={self.furnas.id}')
+        self.assertEqual(self.client.post('/api/v1/ad/click?id=999').status_code, 404)
+        self.assertEqual(flush_ad_counters(), 5)
+
+        self.furnas.refresh_from_db()
+        self.home.refresh_from_db()
+        self.assertEqual((self.furnas.seen, self.furnas.clicked, self.home.seen), (2, 1, 2))
+        self.assertEqual(list(AdDailyStat.objects.filter(ad=self.furnas).values_list('date', 'seen', 'clicked')),
+                         [(timezone.localdate(), 2, 1)])
+
+        self.furnas.status = 'inactive'
+        self.furnas.save()
+        self.assertEqual(self.get_ad('Lagoa -> Furnas'), self.default.id)
+
+
+class AdConflictTests(TestCase):
+    """Test that overlapping campaigns are found when ads are saved"""
+
+    def setUp(self):
+        self.now = timezone.now()
+
+    def tearDown(self):
+        invalidate_generation(ADS_GENERATION_NAME)
+
+    def create_ad(self, advertise_on, start, end, platform='android'):
+        return Ad.objects.create(entity=advertise_on, media='ad.png', advertise_on=advertise_on, platform=platform, status='active',
+                                 start=self.now + timedelta(days=start), end=self.now + timedelta(days=end))
+
+    def test_overlapping_campaigns(self):
+        """Test that only ads of the same group and platform running at the same time conflict"""
+        first = self.create_ad('furnas,lagoa', -2, 2)
+        self.assertFalse(AdConflict.objects.exists())
+        second = self.create_ad('Lagoa', 1, 5)
+        self.create_ad('lagoa', 1, 5, platform='ios')
+        self.create_ad('lagoa', 6, 8)
+        self.create_ad('furnas', 3, 4)
+        self.assertEqual(list(AdConflict.objects.values_list('ad', 'other_ad', 'group', 'platform', 'start', 'end')),
+                         [(first.id, second.id, 'lagoa', 'android', second.start, first.end)])
+
+        conflicts = self.client.get('/api/v1/ad/conflicts', {'platform': 'android'}).json()
+        self.assertEqual([(conflict['ad'], conflict['other_ad']) for conflict in conflicts], [(first.id, second.id)])
+        self.assertEqual(self.client.get('/api/v1/ad/conflicts', {'platform': 'ios'}).json(), [])
+
+        response = self.client.get('/api/v1/ad', {'on': 'home', 'platform': 'android', 'verify': 'true',
+                                                   'now': (self.now + timedelta(days=1, hours=1)).timestamp()}).json()
+        self.assertEqual((response['ad-1']['id'], response['ad-2']['id']), (first.id, second.id))
+
+        second.status = 'inactive'
+        second.save()
+        self.assertFalse(AdConflict.objects.exists())
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'default'},
+                           'gmaps': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'gmaps'},
+                           'generations': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'generations'}})
+class GmapsCacheTests(TestCase):
+    """Test that Google Directions responses are reused for the same search"""
+
+    def setUp(self):
+        Variables.objects.create(version='5', maps=True)
+        Stop.objects.create(name='Furnas', latitude=37.77451, longitude=-25.30412)
+
+    def tearDown(self):
+        caches['gmaps'].clear()
+
+    def get_gmaps(self, start, origin='Furnas'):
+        return self.client.get('/api/v1/gmaps', {'origin': origin, 'destination': 'Lagoa', 'day': '2026-10-19', 'start': start,
+                                                 'key': 'dummy_auth', 'version': '5', 'platform': 'android'})
+
+    @patch('app.views.v1.views.requests.get')
+    def test_repeated_searches(self, get):
+        """Test that searches in the same time bucket make one request and save one Data row"""
+        get.return_value = Mock(status_code=200, json=Mock(return_value={'status': 'OK', 'routes': []}))
+        self.assertEqual(self.get_gmaps('08h01').json()['status'], 'OK')
+        self.assertEqual(self.get_gmaps('08h09').json()['status'], 'OK')
+        self.assertEqual((get.call_count, Data.objects.count()), (1, 1))
+        self.assertEqual(Job.objects.get().payload, {'data_id': Data.objects.get().id})
+        self.get_gmaps('08h10')
+        self.assertEqual(get.call_count, 2)
+
+        get.return_value = Mock(status_code=200, json=Mock(return_value={'status': 'ZERO_RESULTS', 'routes': []}))
+        self.get_gmaps('08h10', origin='Lagoa')
+        self.get_gmaps('08h10', origin='Lagoa')
+        self.assertEqual((get.call_count, Data.objects.count()), (4, 2))
+
+    @patch('app.views.v1.views.requests.get')
+    def test_time_that_is_not_a_timestamp(self, get):
+        """Test that a time other than a timestamp is passed to Google without being cached"""
+        get.return_value = Mock(status_code=200, json=Mock(return_value={'status': 'OK', 'routes': []}))
+        params = {'origin': 'Furnas', 'destination': 'Lagoa', 'time': 'now', 'key': 'dummy_auth', 'version': '5'}
+        for _ in range(2):
+            self.assertEqual(self.client.get('/api/v1/gmaps', params).status_code, 200)
+        self.assertEqual(get.call_count, 2)
+        self.assertIn('departure_time=now', get.call_args[0][0])
+
+    def test_stale_while_revalidate(self):
+        """Test that a stale response is served while it is fetched again, and only once"""
+        key = directions_key('37.774512,-25.304118', 'lagoa', 'en', 'departure', 1000)
+        self.assertEqual(key, directions_key('37.77449,-25.30412', 'lagoa', 'en', 'departure', 1100))
+        fetched = []
+        def fetch():
+            fetched.append(len(fetched))
+            return 200, {'status': 'OK', 'version': len(fetched)}
+
+        self.assertEqual(get_directions(key, fetch), (200, {'status': 'OK', 'version': 1}))
+        entry = caches['gmaps'].get(key)
+        entry['fetched'] -= settings.GMAPS_CACHE_SECONDS
+        caches['gmaps'].set(key, entry)
+        self.assertEqual(get_directions(key, fetch), (200, {'status': 'OK', 'version': 1}))
+        for thread in threading.enumerate():
+            if thread.name == 'gmaps-revalidate':
+                thread.join()
+        self.assertEqual(get_directions(key, fetch), (200, {'status': 'OK', 'version': 2}))
+        self.assertEqual(len(fetched), 2)
+
+    def test_concurrent_fetches_coalesced(self):
+        """Test that identical requests made while one is being fetched wait for it instead of fetching again"""
+        key = directions_key('furnas', 'lagoa', 'en', 'departure', 1000)
+        fetching = threading.Event()
+        release = threading.Event()
+        fetched = []
+        def fetch():
+            fetched.append(len(fetched))
+            fetching.set()
+            release.wait(5)
+            return 200, {'status': 'OK'}
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(get_directions(key, fetch))) for _ in range(5)]
+        threads[0].start()
+        fetching.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [(200, {'status': 'OK'})] * 5)
+        self.assertEqual(len(fetched), 1)
+
+    def test_file_lock_times_out(self):
+        """Test that the host lock is exclusive and waited for at most the given time"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = striped_lock_path(directory, 'directions:key')
+            with file_lock(path, 1) as locked:
+                self.assertTrue(locked)
+                with file_lock(path, 0.1) as other_locked:
+                    self.assertFalse(other_locked)
+            with file_lock(path, 0.1) as locked:
+                self.assertTrue(locked)
+
+
+def directions_response():
+    def stop(name, lat, lng):
+        return {'name': name, 'location': {'lat': lat, 'lng': lng}}
+    step = {'travel_mode': 'TRANSIT', 'transit_details': {
+        'departure_time': {'text': '08:15'}, 'arrival_time': {'text': '09:05'},
+        'departure_stop': stop('Ponta Delgada', 37.7412, -25.6756), 'arrival_stop': stop('Furnas', 37.7745, -25.3041),
+        'line': {'short_name': 'C318'}}}
+    return {'status': 'OK', 'routes': [{'legs': [{'departure_time': {'value': 1792397700}, 'steps': [step]}]}]}
+
+
+class JobTests(TestCase):
+    """Test the background job queue run by the run_jobs command"""
+
+    def run_jobs(self):
+        call_command('run_jobs', once=True, stdout=StringIO())
+
+    def test_trips_extracted_by_worker(self):
+        """Test that trips are extracted from a Data row by the worker and the job is then deleted"""
+        data = Data.objects.create(data=directions_response(), origin='Ponta Delgada', destination='Furnas')
+        enqueue('extract_trips', data_id=data.id)
+        self.assertFalse(Trip.objects.exists())
+        self.run_jobs()
+        # Trip.save keeps the stops as a string, like Route
+        self.assertEqual(list(Trip.objects.values_list('route', 'stops')), [('318', str({'Ponta Delgada': '08h15', 'Furnas': '09h05'}))])
+        self.assertEqual(TripStop.objects.count(), 2)
+        self.assertFalse(Job.objects.exists())
+
+    @override_settings(JOB_MAX_ATTEMPTS=2, JOB_RETRY_SECONDS=60)
+    def test_retries(self):
+        """Test that a failed job is retried later and marked failed after the last attempt"""
+        job = enqueue('extract_trips', data_id=999)
+        self.run_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('pending', 1))
+        self.assertIn('DoesNotExist', job.error)
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=50))
+
+        # Not due yet
+        self.run_jobs()
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 1)
+        Job.objects.filter(id=job.id).update(run_after=timezone.now())
+        self.run_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+
+    def test_abandoned_jobs_claimed_again(self):
+        """Test that a job left running by a stopped worker is claimed again, and a running one is not"""
+        job = enqueue('extract_trips', data_id=999)
+        Job.objects.filter(id=job.id).update(status='running', started=timezone.now())
+        self.assertIsNone(claim_job())
+        Job.objects.filter(id=job.id).update(started=timezone.now() - timedelta(seconds=settings.JOB_TIMEOUT_SECONDS + 1))
+        self.assertEqual(claim_job().id, job.id)
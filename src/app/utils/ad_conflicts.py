@@ -0,0 +1,45 @@
+import heapq
+import logging
+
+from django.db import transaction
+
+from app.models import Ad, AdConflict
+from app.utils.ad_index import advertise_on_keys
+
+logger = logging.getLogger(__name__)
+
+def find_conflicts(ads):
+    """The (ad, other ad, group, platform, start, end) of every two ``ads`` of a platform advertised on a group at the same time.
+
+    The ads of each (group, platform) are swept by start, keeping the ones still running in a heap by end,
+    so every ad is only compared with the ones it overlaps. Ads run from their start to their end, both included.
+    """
+    campaigns = {}
+    for ad in ads:
+        for group in advertise_on_keys(ad.advertise_on):
+            campaigns.setdefault((group, ad.platform), []).append(ad)
+
+    conflicts = []
+    for (group, platform), campaign in sorted(campaigns.items()):
+        running = []
+        for ad in sorted(campaign, key=lambda ad: (ad.start, ad.id)):
+            while running and running[0][0] < ad.start:
+                heapq.heappop(running)
+            for end, _, other in running:
+                first, second = sorted([ad, other], key=lambda ad: ad.id)
+                conflicts.append((first, second, group, platform, ad.start, min(end, ad.end)))
+            heapq.heappush(running, (ad.end, ad.id, ad))
+    return conflicts
+
+def detect_ad_conflicts():
+    """Replace the stored conflicts with the ones of the current active ads, returning how many there are."""
+    conflicts = find_conflicts(Ad.objects.filter(status='active').order_by('id'))
+    with transaction.atomic():
+        AdConflict.objects.all().delete()
+        AdConflict.objects.bulk_create([
+            AdConflict(ad=ad, other_ad=other, group=group, platform=platform, start=start, end=end)
+            for ad, other, group, platform, start, end in conflicts
+        ])
+    if conflicts:
+        logger.warning(f"{len(conflicts)} ad campaign conflicts")
+    return len(conflicts)
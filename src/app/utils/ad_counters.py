@@ -0,0 +1,62 @@
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from app.models import Ad, AdDailyStat
+from app.utils.write_buffer import WriteBuffer
+
+COUNTERS = ['seen', 'clicked']
+
+def increments(counts, counter):
+    """``counter`` plus this batch's increment of every ad in ``counts``, as one CASE expression."""
+    whens = [When(id=ad_id, then=Value(count)) for (ad_id, field), count in counts.items() if field == counter]
+    return F(counter) + Case(*whens, default=Value(0), output_field=IntegerField())
+
+def write_counts(counts):
+    """Add ``counts``, keyed by (ad id, date, counter), to the ads and their daily stats."""
+    totals = Counter()
+    daily = {}
+    for (ad_id, date, counter), count in counts.items():
+        totals[(ad_id, counter)] += count
+        daily.setdefault((ad_id, date), Counter())[counter] += count
+
+    with transaction.atomic():
+        ads = Ad.objects.filter(id__in={ad_id for ad_id, _ in totals})
+        ads.update(**{counter: increments(totals, counter) for counter in COUNTERS})
+        # Ads deleted since the increment have no row to update
+        existing = set(ads.values_list('id', flat=True))
+        for (ad_id, date), day_counts in daily.items():
+            if ad_id not in existing:
+                continue
+            update = {counter: F(counter) + count for counter, count in day_counts.items()}
+            if AdDailyStat.objects.filter(ad_id=ad_id, date=date).update(**update):
+                continue
+            try:
+                with transaction.atomic():
+                    AdDailyStat.objects.create(ad_id=ad_id, date=date, **day_counts)
+            except IntegrityError:
+                # Another worker created the row in the meantime
+                AdDailyStat.objects.filter(ad_id=ad_id, date=date).update(**update)
+
+class AdCounterBuffer(WriteBuffer):
+    """Ad seen and clicked increments summed in this worker and written with one UPDATE of the ads.
+
+    Flushed every ``AD_COUNTER_BUFFER_SIZE`` increments and ``AD_COUNTER_BUFFER_SECONDS``.
+    """
+    name = 'ad-counter-buffer'
+    size_setting = 'AD_COUNTER_BUFFER_SIZE'
+    seconds_setting = 'AD_COUNTER_BUFFER_SECONDS'
+
+    def write(self, increments):
+        write_counts(Counter(increments))
+
+_ad_counters = AdCounterBuffer()
+
+def count_ad(ad_id, counter):
+    """Add one to the ``counter`` ('seen' or 'clicked') of ad ``ad_id`` with the next flush."""
+    _ad_counters.add((ad_id, timezone.localdate(), counter))
+
+def flush_ad_counters():
+    return _ad_counters.flush()
@@ -0,0 +1,59 @@
+import logging
+import random
+from bisect import bisect_right
+
+from app.models import Ad
+from app.serializers import AdSerializer
+from app.utils.generation import GenerationCache
+from app.utils.stop_matcher import get_stop_matcher
+
+logger = logging.getLogger(__name__)
+
+GENERATION_NAME = 'ads'
+NOT_FOUND = 'not found'
+# Saves of only these fields keep the index, so they are left out of its payloads instead of going stale there
+COUNTER_FIELDS = {'seen', 'clicked'}
+
+def advertise_on_keys(advertise_on):
+    return {key.strip().lower() for key in advertise_on.split(',') if key.strip()}
+
+class AdIndex():
+    """Active and default ads by (platform, advertised group).
+
+    Ads are kept sorted by start, so the ones running at a moment are found by bisecting on the start
+    and checking the end. The key None holds every ad of a platform and the platform 'all' every ad.
+    """
+    def __init__(self):
+        self.running_ads = {}
+        self.defaults = {}
+        self.data = {}
+        for ad in Ad.objects.filter(status__in=['active', 'default']).order_by('id'):
+            self.data[ad.id] = {field: value for field, value in AdSerializer(ad).data.items() if field not in COUNTER_FIELDS}
+            if ad.status == 'default':
+                self.defaults.setdefault(ad.platform, []).append(ad)
+                continue
+            for platform in {ad.platform, 'all'}:
+                for key in advertise_on_keys(ad.advertise_on) | {None}:
+                    self.running_ads.setdefault((platform, key), []).append(ad)
+        for ads in self.running_ads.values():
+            ads.sort(key=lambda ad: ad.start)
+        self.starts = {key: [ad.start for ad in ads] for key, ads in self.running_ads.items()}
+
+    def running(self, platform, key, moment):
+        """The ads of ``platform`` advertised on ``key`` (every ad for None) that run at ``moment``."""
+        ads = self.running_ads.get((platform, key), [])
+        started = bisect_right(self.starts.get((platform, key), []), moment)
+        return [ad for ad in ads[:started] if ad.end >= moment]
+
+    def group_of(self, stop):
+        """The name of the Group listing ``stop``, or else its most similar Stop, as advertise_on matches it."""
+        return get_stop_matcher().group_name(stop) or NOT_FOUND
+
+    def choose(self, ads):
+        return random.choice(ads) if ads else None
+
+_ad_index = GenerationCache(GENERATION_NAME, AdIndex)
+
+def get_ad_index():
+    """Return this worker's ad index, rebuilt when an Ad or Group changed in any worker."""
+    return _ad_index.get()
@@ -0,0 +1,102 @@
+import logging
+import threading
+import uuid
+
+from django.core.cache import caches
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# Tokens live in their own cache, which never fills up and culls them like the default one can
+CACHE_ALIAS = 'generations'
+
+_caches = {}
+# Names invalidated by the open transaction of each thread
+_pending = threading.local()
+
+def get_generation(name):
+    """Return the current generation token of ``name``, shared by every worker through the cache.
+
+    A missing token, e.g. after the cache was cleared, starts a new generation, so no copy built under an older one matches.
+    """
+    key = f"generation:{name}"
+    generation = caches[CACHE_ALIAS].get(key)
+    if generation is None:
+        # Workers racing here all end up with the token that was added first
+        caches[CACHE_ALIAS].add(key, uuid.uuid4().hex, None)
+        generation = caches[CACHE_ALIAS].get(key)
+    return generation
+
+def bump_generation(name):
+    """Mark every in-process copy of ``name`` as stale."""
+    generation = uuid.uuid4().hex
+    caches[CACHE_ALIAS].set(f"generation:{name}", generation, None)
+    return generation
+
+def invalidate_generation(name):
+    """Once the change is committed, drop this worker's copies of ``name`` and tell the other workers.
+
+    Saves made in one transaction share a single new generation, and nothing is rebuilt from uncommitted rows.
+    """
+    # Every save queues a callback; the first one run by the commit does the work for all of them
+    pending = _pending.__dict__.setdefault('names', set())
+    pending.add(name)
+
+    def invalidate():
+        if name not in pending:
+            return
+        pending.discard(name)
+        for generation_cache in _caches.get(name, []):
+            generation_cache.clear()
+        bump_generation(name)
+    transaction.on_commit(invalidate)
+
+class GenerationCache():
+    """A value built once per worker and rebuilt whenever the shared generation of ``name`` changes.
+
+    With ``background``, a value that is only out of date keeps being served while one thread rebuilds it,
+    so the requests of every worker do not wait for the rebuild when another worker bumps the generation.
+    """
+    def __init__(self, name, build, background=False):
+        self.name = name
+        self.build = build
+        self.background = background
+        self.value = None
+        self.generation = None
+        self.refreshing = False
+        self.lock = threading.Lock()
+        _caches.setdefault(name, []).append(self)
+
+    def get(self):
+        generation = get_generation(self.name)
+        if self.value is not None and generation != self.generation and self.background:
+            self.refresh(generation)
+        elif self.value is None or generation != self.generation:
+            with self.lock:
+                if self.value is None or generation != self.generation:
+                    self.value = self.build()
+                    self.generation = generation
+        return self.value
+
+    def refresh(self, generation):
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+
+        def run():
+            try:
+                value = self.build()
+                with self.lock:
+                    self.value = value
+                    self.generation = generation
+            except Exception:
+                logger.exception(f"Could not rebuild {self.name}")
+            finally:
+                self.refreshing = False
+                connections.close_all()
+
+        threading.Thread(target=run, name=f'{self.name}-refresh', daemon=True).start()
+
+    def clear(self):
+        self.value = None
@@ -0,0 +1,100 @@
+import hashlib
+import logging
+import threading
+import time
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+
+from app.utils.single_flight import SingleFlight, file_lock, striped_lock_path
+
+logger = logging.getLogger(__name__)
+
+CACHE_ALIAS = 'gmaps'
+
+_revalidating = set()
+_lock = threading.Lock()
+_flights = SingleFlight()
+
+def round_query(query):
+    """Round a 'latitude,longitude' query to GMAPS_COORDINATE_DIGITS; place names are kept as they are."""
+    try:
+        latitude, longitude = (float(value) for value in query.split(','))
+    except ValueError:
+        return query
+    digits = settings.GMAPS_COORDINATE_DIGITS
+    return f"{latitude:.{digits}f},{longitude:.{digits}f}"
+
+def directions_key(origin, destination, language_code, arrival_departure, time):
+    """The cache key of a Directions request, with ``time`` rounded down to GMAPS_TIME_BUCKET_MINUTES."""
+    bucket = settings.GMAPS_TIME_BUCKET_MINUTES * 60
+    request = f"{round_query(origin)}|{round_query(destination)}|{language_code}|{arrival_departure}|{int(time) // bucket * bucket}"
+    # Place names have spaces, which not every cache backend accepts in keys
+    return f"directions:{hashlib.sha1(request.encode()).hexdigest()}"
+
+def is_cacheable(status_code, data):
+    return status_code == 200 and data.get('status') == 'OK'
+
+def cached_entry(key, max_age):
+    entry = caches[CACHE_ALIAS].get(key)
+    if entry is not None and time.time() - entry['fetched'] < max_age:
+        return entry
+    return None
+
+def host_lock(key):
+    if not settings.GMAPS_LOCK_DIR:
+        return nullcontext()
+    return file_lock(striped_lock_path(settings.GMAPS_LOCK_DIR, key), settings.GMAPS_LOCK_SECONDS)
+
+def fetch_and_store(key, fetch, max_age):
+    """Fetch ``key`` unless an entry younger than ``max_age`` shows up meanwhile.
+
+    Concurrent calls for a key share one fetch in this worker and, with GMAPS_LOCK_DIR, wait for the one of another
+    worker on the host; the entry it stored is then served instead of fetching again.
+    """
+    def fetch_once():
+        with host_lock(key):
+            entry = cached_entry(key, max_age)
+            if entry is not None:
+                return 200, entry['data']
+            status_code, data = fetch()
+            if is_cacheable(status_code, data):
+                caches[CACHE_ALIAS].set(key, {'data': data, 'fetched': time.time()},
+                                        settings.GMAPS_CACHE_SECONDS + settings.GMAPS_CACHE_STALE_SECONDS)
+            return status_code, data
+    return _flights.do(key, fetch_once)
+
+def revalidate(key, fetch):
+    """Fetch ``key`` again in a background thread, unless this worker is already doing so."""
+    with _lock:
+        if key in _revalidating:
+            return
+        _revalidating.add(key)
+
+    def run():
+        try:
+            fetch_and_store(key, fetch, settings.GMAPS_CACHE_SECONDS)
+        except Exception:
+            logger.exception(f"Could not revalidate {key}")
+        finally:
+            with _lock:
+                _revalidating.discard(key)
+            connections.close_all()
+
+    threading.Thread(target=run, name='gmaps-revalidate', daemon=True).start()
+
+def get_directions(key, fetch):
+    """Return the (status code, data) of a Directions request, from the cache when possible.
+
+    ``fetch`` makes the request, returning its status code and JSON. Only OK responses are cached. They are
+    served as they are for GMAPS_CACHE_SECONDS, and then for GMAPS_CACHE_STALE_SECONDS while being fetched again.
+    """
+    entry = caches[CACHE_ALIAS].get(key)
+    if entry is not None:
+        age = time.time() - entry['fetched']
+        if age >= settings.GMAPS_CACHE_SECONDS:
+            revalidate(key, fetch)
+        return 200, entry['data']
+    return fetch_and_store(key, fetch, settings.GMAPS_CACHE_SECONDS + settings.GMAPS_CACHE_STALE_SECONDS)
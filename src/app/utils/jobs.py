@@ -0,0 +1,71 @@
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from app.models import Data, Job
+from app.utils.trip_extraction import extract_trips
+
+logger = logging.getLogger(__name__)
+
+def extract_trips_task(payload):
+    extract_trips(Data.objects.get(id=payload['data_id']))
+
+# Task name -> function of the job payload
+TASKS = {
+    'extract_trips': extract_trips_task,
+}
+
+def enqueue(task, **payload):
+    """Queue ``task`` to be run by the run_jobs command with ``payload``, which has to be JSON serializable."""
+    if task not in TASKS:
+        raise ValueError(f"Unknown task {task}")
+    return Job.objects.create(task=task, payload=payload)
+
+def due_jobs(now):
+    """The pending jobs whose time has come, and the running ones abandoned by a worker that stopped."""
+    abandoned = now - timedelta(seconds=settings.JOB_TIMEOUT_SECONDS)
+    return Job.objects.filter(Q(status='pending', run_after__lte=now) | Q(status='running', started__lt=abandoned))
+
+def claim_job():
+    """Mark the oldest due job as running and return it, or None when no job is due."""
+    now = timezone.now()
+    for job_id in due_jobs(now).order_by('id').values_list('id', flat=True)[:10]:
+        # Workers racing for a job all run this UPDATE, only one of them still finds it due
+        if due_jobs(now).filter(id=job_id).update(status='running', started=now, attempts=F('attempts') + 1):
+            return Job.objects.get(id=job_id)
+    return None
+
+def run_job(job):
+    """Run a claimed job, deleting it when it succeeds and scheduling its retry or marking it failed otherwise."""
+    try:
+        with transaction.atomic():
+            TASKS[job.task](job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts >= settings.JOB_MAX_ATTEMPTS:
+            logger.error(f"Job {job.id} ({job.task}) failed after {job.attempts} attempts")
+            Job.objects.filter(id=job.id).update(status='failed', error=error)
+        else:
+            delay = settings.JOB_RETRY_SECONDS * 2 ** (job.attempts - 1)
+            logger.warning(f"Job {job.id} ({job.task}) failed, retrying in {delay} seconds")
+            Job.objects.filter(id=job.id).update(status='pending', error=error, run_after=timezone.now() + timedelta(seconds=delay))
+        return False
+    Job.objects.filter(id=job.id).delete()
+    return True
+
+def run_due_jobs():
+    """Run jobs until none is due, returning the (succeeded, failed) counts."""
+    succeeded = failed = 0
+    job = claim_job()
+    while job is not None:
+        if run_job(job):
+            succeeded += 1
+        else:
+            failed += 1
+        job = claim_job()
+    return succeeded, failed
@@ -0,0 +1,188 @@
+import logging
+
+from app.utils.generation import GenerationCache
+from app.utils.route_index import get_route_index
+from app.utils.timetable_snapshot import GENERATION_NAME, get_snapshot
+
+logger = logging.getLogger(__name__)
+
+MINUTES_PER_DAY = 24 * 60
+
+class Trip():
+    """One bus run of a Route: the times it calls at each stop of its pattern."""
+    def __init__(self, route_id, route, information, stops, times, labels):
+        self.route_id = route_id
+        self.route = route
+        self.information = information
+        self.stops = stops
+        self.times = times
+        self.labels = labels
+
+class Pattern():
+    """Trips that call at the same sequence of stops, sorted by departure."""
+    def __init__(self, stops):
+        self.stops = stops
+        self.trips = []
+
+    def earliest_trip(self, position, time):
+        """Return the first trip leaving ``position`` at or after ``time``."""
+        best = None
+        for trip in self.trips:
+            if trip.times[position] >= time and (best is None or trip.times[position] < best.times[position]):
+                best = trip
+        return best
+
+class Timetable():
+    """RAPTOR timetable of every active Route, split by type of day."""
+    def __init__(self, route_stops):
+        trips = {}
+        for route_id, route, information, type_of_day, stop, cleaned_stop, time, minutes in route_stops:
+            if minutes is None:
+                continue
+            trip = trips.setdefault(route_id, (type_of_day, Trip(route_id, route, information, [], [], [])))[1]
+            # A run that goes past midnight keeps counting upwards
+            if trip.times and minutes + MINUTES_PER_DAY // 2 < trip.times[-1]:
+                minutes += MINUTES_PER_DAY
+            trip.stops.append((cleaned_stop, stop))
+            trip.times.append(minutes)
+            trip.labels.append(time)
+
+        self.patterns = {}
+        self.stop_patterns = {}
+        for type_of_day, trip in trips.values():
+            if len(trip.stops) < 2:
+                continue
+            key = tuple(cleaned_stop for cleaned_stop, _ in trip.stops)
+            patterns = self.patterns.setdefault(type_of_day, {})
+            if key not in patterns:
+                patterns[key] = Pattern(key)
+                for position, cleaned_stop in enumerate(key):
+                    self.stop_patterns.setdefault(type_of_day, {}).setdefault(cleaned_stop, []).append((patterns[key], position))
+            patterns[key].trips.append(trip)
+        for patterns in self.patterns.values():
+            for pattern in patterns.values():
+                pattern.trips.sort(key=lambda trip: trip.times[0])
+
+    def raptor(self, origins, destinations, type_of_day, departure, max_transfers, min_transfer):
+        """Run the RAPTOR rounds and return the journeys that improve the arrival time with each extra transfer."""
+        stop_patterns = self.stop_patterns.get(type_of_day, {})
+        best = {}
+        labels = [{stop: (departure, None) for stop in origins}]
+        marked = set(origins)
+        journeys = []
+        best_arrival = None
+        for round_ in range(1, max_transfers + 2):
+            previous = labels[-1]
+            current = {}
+            labels.append(current)
+
+            queue = {}
+            for stop in marked:
+                for pattern, position in stop_patterns.get(stop, []):
+                    if pattern not in queue or position < queue[pattern]:
+                        queue[pattern] = position
+            marked = set()
+
+            for pattern, first_position in queue.items():
+                trip = None
+                boarded_at = None
+                for position in range(first_position, len(pattern.stops)):
+                    stop = pattern.stops[position]
+                    if trip is not None:
+                        arrival = trip.times[position]
+                        bound = min(best.get(stop, arrival + 1), best_arrival if best_arrival is not None else arrival + 1)
+                        if arrival < bound:
+                            current[stop] = (arrival, (trip, boarded_at, position))
+                            best[stop] = arrival
+                            marked.add(stop)
+                    if stop in previous:
+                        ready = previous[stop][0] + (min_transfer if previous[stop][1] is not None else 0)
+                        if trip is None or ready <= trip.times[position]:
+                            earlier_trip = pattern.earliest_trip(position, ready)
+                            if earlier_trip is not None and (trip is None or earlier_trip.times[position] < trip.times[position]):
+                                trip = earlier_trip
+                                boarded_at = position
+
+            reached = [stop for stop in destinations if stop in current]
+            if reached:
+                stop = min(reached, key=lambda stop: current[stop][0])
+                best_arrival = current[stop][0]
+                journeys.append(self.reconstruct(labels, round_, stop))
+            if not marked:
+                break
+        return journeys
+
+    def reconstruct(self, labels, round_, stop):
+        legs = []
+        while round_ > 0:
+            trip, boarded_at, alighted_at = labels[round_][stop][1]
+            legs.append({
+                'id': trip.route_id,
+                'route': trip.route,
+                'origin': trip.stops[boarded_at][1],
+                'destination': trip.stops[alighted_at][1],
+                'start': trip.labels[boarded_at],
+                'end': trip.labels[alighted_at],
+                'information': trip.information,
+                '_departure': trip.times[boarded_at],
+                '_arrival': trip.times[alighted_at],
+            })
+            # The boarding stop was reached in the previous round
+            stop = trip.stops[boarded_at][0]
+            round_ -= 1
+        legs.reverse()
+        return legs
+
+def build_timetable():
+    timetable = Timetable(get_snapshot().route_stop_rows())
+    logger.info(f"Built journey planner timetable with {sum(len(patterns) for patterns in timetable.patterns.values())} patterns")
+    return timetable
+
+_timetable = GenerationCache(GENERATION_NAME, build_timetable)
+
+def get_timetable():
+    return _timetable.get()
+
+def dominates(journey, other):
+    """Whether ``journey`` leaves no earlier, arrives no later and changes bus no more often than ``other``, and differs from it."""
+    departure, arrival = journey['legs'][0]['_departure'], journey['legs'][-1]['_arrival']
+    other_departure, other_arrival = other['legs'][0]['_departure'], other['legs'][-1]['_arrival']
+    return (departure >= other_departure and arrival <= other_arrival and journey['transfers'] <= other['transfers']
+            and (departure, arrival, journey['transfers']) != (other_departure, other_arrival, other['transfers']))
+
+def plan_journeys(origin, destination, type_of_day, start_minutes=0, max_transfers=2, min_transfer=5, limit=5):
+    """Return up to ``limit`` journeys from ``origin`` to ``destination`` leaving at or after ``start_minutes``.
+
+    Origin and destination are matched against the cleaned stop names the same way route searches are.
+    Each journey is a dict with its departure, arrival, number of transfers and legs.
+    """
+    index = get_route_index()
+    origins = set(index.match(origin))
+    destinations = set(index.match(destination))
+    if not origins or not destinations:
+        return []
+
+    timetable = get_timetable()
+    journeys = {}
+    departure = start_minutes
+    while len(journeys) < limit:
+        found = [legs for legs in timetable.raptor(origins, destinations, type_of_day.upper(), departure, max_transfers, min_transfer) if legs]
+        if not found:
+            break
+        for legs in found:
+            # Boarding the same buses at a later matching stop replaces the earlier variant
+            journeys[tuple(leg['id'] for leg in legs)] = {
+                'start': legs[0]['start'],
+                'end': legs[-1]['end'],
+                'transfers': len(legs) - 1,
+                'legs': legs,
+            }
+        departure = min(legs[0]['_departure'] for legs in found) + 1
+
+    journeys = sorted(journeys.values(), key=lambda journey: journey['legs'][0]['_departure'])
+    journeys = [journey for journey in journeys if not any(dominates(other, journey) for other in journeys)][:limit]
+    for journey in journeys:
+        for leg in journey['legs']:
+            leg.pop('_departure', None)
+            leg.pop('_arrival', None)
+    return journeys
@@ -0,0 +1,126 @@
+import gzip
+import hashlib
+import logging
+import re
+
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils import timezone
+from django.utils.http import parse_etags
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from app.models import Holiday, Info, Variables
+from app.serializers import HolidaySerializer
+from app.utils.generation import GenerationCache
+from app.utils.timetable_snapshot import get_snapshot
+
+try:
+    import brotli
+except ImportError:
+    # Brotli is optional, gzip is always available
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:
+    # Without msgpack the columnar layout is still served as JSON
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+GENERATION_NAME = 'load'
+ACCEPTS_BROTLI = re.compile(r'\bbr\b')
+ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+
+class ColumnarJSONRenderer(JSONRenderer):
+    """The columnar load layout, selected with ``?format=columnar`` or its media type."""
+    media_type = 'application/vnd.saomiguelbus.columnar+json'
+    format = 'columnar'
+    columnar = True
+
+class MessagePackRenderer(BaseRenderer):
+    """The columnar load layout encoded as MessagePack, selected with ``?format=msgpack``."""
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+    columnar = True
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return msgpack.packb(data, use_bin_type=True)
+
+# The first renderer is the default, so clients that do not ask keep getting the LoadRoute list
+LOAD_RENDERERS = [JSONRenderer, ColumnarJSONRenderer] + ([MessagePackRenderer] if msgpack else [])
+
+def wants_columnar(request):
+    """Whether content negotiation picked one of the columnar load renderers."""
+    return getattr(request.accepted_renderer, 'columnar', False)
+
+class LoadBundle():
+    """A rendered load payload with its precompressed variants and a strong ETag."""
+    def __init__(self, data, renderer=None):
+        renderer = renderer or JSONRenderer()
+        self.content_type = renderer.media_type
+        self.body = renderer.render(data)
+        self.gzip = gzip.compress(self.body, compresslevel=9, mtime=0)
+        self.brotli = brotli.compress(self.body) if brotli else None
+        self.etag = hashlib.sha256(self.body).hexdigest()[:32]
+
+    def etags(self):
+        return [f'"{self.etag}"', f'"{self.etag}-gzip"', f'"{self.etag}-br"']
+
+    def response(self, request):
+        """Serve the variant the client accepts, or a 304 when it already has this version."""
+        if set(parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))) & set(self.etags() + ['*']):
+            response = HttpResponseNotModified()
+            response['ETag'] = f'"{self.etag}"'
+            return response
+
+        accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if self.brotli is not None and ACCEPTS_BROTLI.search(accept_encoding):
+            response = HttpResponse(self.brotli, content_type=self.content_type)
+            response['Content-Encoding'] = 'br'
+            response['ETag'] = f'"{self.etag}-br"'
+        elif ACCEPTS_GZIP.search(accept_encoding):
+            response = HttpResponse(self.gzip, content_type=self.content_type)
+            response['Content-Encoding'] = 'gzip'
+            response['ETag'] = f'"{self.etag}-gzip"'
+        else:
+            response = HttpResponse(self.body, content_type=self.content_type)
+            response['ETag'] = f'"{self.etag}"'
+        response['Content-Length'] = len(response.content)
+        response['Vary'] = 'Accept, Accept-Encoding'
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+class LoadData():
+    """Holidays, infos and variables sent by the load endpoints, plus the bundles built from them."""
+    def __init__(self):
+        variable = Variables.objects.all().first()
+        self.variable = variable.__dict__ if variable else None
+        self.holidays = HolidaySerializer(Holiday.objects.all(), many=True).data
+        self.infos = list(Info.objects.all())
+        self.snapshot = None
+        self.bundles = {}
+
+    def active_infos(self):
+        now = timezone.now()
+        return [info for info in self.infos if info.start <= now <= info.end]
+
+    def bundle(self, name, key, build, renderer=None):
+        """Return the bundle ``name`` for ``key``, building it from the current timetable snapshot once per renderer."""
+        snapshot = get_snapshot()
+        if snapshot is not self.snapshot:
+            self.snapshot = snapshot
+            self.bundles = {}
+        renderer = renderer or JSONRenderer()
+        bundle_key = (name, key, renderer.format)
+        if bundle_key not in self.bundles:
+            self.bundles[bundle_key] = LoadBundle(build(snapshot), renderer)
+            logger.info(f"Built {name} {renderer.format} load bundle of {len(self.bundles[bundle_key].body)} bytes")
+        return self.bundles[bundle_key]
+
+_load_data = GenerationCache(GENERATION_NAME, LoadData)
+
+def get_load_data():
+    """Return this worker's load data, rebuilt when a Holiday, Info or Variables row changed in any worker."""
+    return _load_data.get()
@@ -0,0 +1,104 @@
+import heapq
+import logging
+
+import numpy as np
+
+from app.utils.generation import invalidate_generation
+from app.utils.str_utils import clean_string
+from app.utils.timetable_snapshot import GENERATION_NAME, get_snapshot
+
+logger = logging.getLogger(__name__)
+
+class RouteIndex():
+    """Inverted index from each cleaned stop name to the routes that serve it.
+
+    Reads the timetable snapshot, where the route stops are ordered by stop, type
+    of day and departure minutes: the posting list of a stop is one slice of it,
+    so an origin/destination search is an intersection of two posting lists, and
+    finding the departures after a given time is a bisect inside the slice.
+    """
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.names = snapshot.stops
+        self.routes = len(snapshot)
+        self._matches = {}
+
+    def match(self, term):
+        """Return the indexed stop names containing ``term``, like the old ``cleaned_stops__contains`` filter."""
+        term = clean_string(term)
+        if term not in self._matches:
+            self._matches[term] = [name for name in self.names if term in name] if term else []
+        return self._matches[term]
+
+    def rows(self, name):
+        stop_id = self.snapshot.stop_lookup[name]
+        return int(self.snapshot.stop_offsets[stop_id]), int(self.snapshot.stop_offsets[stop_id + 1])
+
+    def positions(self, term):
+        """Map each route serving a stop that matches ``term`` to the positions where it stops there."""
+        snapshot = self.snapshot
+        positions = {}
+        for name in self.match(term):
+            start, end = self.rows(name)
+            route_ids = snapshot.route_ids[snapshot.departure_routes[start:end]].tolist()
+            for route_id, position in zip(route_ids, snapshot.departure_sequences[start:end].tolist()):
+                positions.setdefault(route_id, []).append(position)
+        return positions
+
+    def departures_after(self, term, type_of_day=None, start_minutes=0):
+        """Iterate over the (minutes, route id, position) departures from the stops matching ``term``, in time order."""
+        snapshot = self.snapshot
+        if type_of_day and type_of_day.upper() not in snapshot.type_lookup:
+            return iter([])
+        streams = []
+        for name in self.match(term):
+            start, end = self.rows(name)
+            types = snapshot.departure_types[start:end]
+            type_ids = [snapshot.type_lookup[type_of_day.upper()]] if type_of_day else np.unique(types).tolist()
+            for type_id in type_ids:
+                first = start + int(np.searchsorted(types, type_id, 'left'))
+                last = start + int(np.searchsorted(types, type_id, 'right'))
+                first += int(np.searchsorted(snapshot.departure_minutes[first:last], start_minutes, 'left'))
+                streams.append(zip(
+                    snapshot.departure_minutes[first:last].tolist(),
+                    snapshot.route_ids[snapshot.departure_routes[first:last]].tolist(),
+                    snapshot.departure_sequences[first:last].tolist(),
+                ))
+        return heapq.merge(*streams)
+
+    def search(self, origin, destination, type_of_day=None, start_minutes=0, limit=None):
+        """Return the ids of the routes going from ``origin`` to ``destination``, ordered by their departure from
+        ``origin`` at or after ``start_minutes``. Stops early once ``limit`` routes are found."""
+        destinations = self.positions(destination)
+        route_ids = []
+        found = set()
+        for _, route_id, position in self.departures_after(origin, type_of_day, start_minutes):
+            if route_id in found or route_id not in destinations or position >= max(destinations[route_id]):
+                continue
+            found.add(route_id)
+            route_ids.append(route_id)
+            if limit and len(route_ids) >= limit:
+                break
+        return route_ids
+
+_route_index = None
+
+def get_route_index():
+    """Return this worker's route index over the current timetable snapshot, rebuilt whenever the snapshot is."""
+    global _route_index
+    snapshot = get_snapshot()
+    index = _route_index
+    if index is None or index.snapshot is not snapshot:
+        index = _route_index = RouteIndex(snapshot)
+        logger.info(f"Built route index with {index.routes} routes and {len(index.names)} stops")
+    return index
+
+def invalidate_route_index():
+    invalidate_generation(GENERATION_NAME)
+
+def warm_route_index():
+    """Build the index at worker start so the first search does not pay for it."""
+    try:
+        get_route_index()
+    except Exception as e:
+        logger.warning(f"Could not build route index at startup: {e}")
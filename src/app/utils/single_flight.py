@@ -0,0 +1,75 @@
+import fcntl
+import logging
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+class Call():
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight():
+    """Runs one call per key at a time in this process; callers arriving while it runs wait and share its result."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, function):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
+
+@contextmanager
+def file_lock(path, seconds):
+    """Hold an exclusive lock on ``path`` shared by every process of the host, waiting for it at most ``seconds``.
+
+    When the wait times out the block runs without the lock, so a stuck holder only costs the duplicate work.
+    """
+    with open(path, 'a') as lock_file:
+        deadline = time.monotonic() + seconds
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                locked = True
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    logger.warning(f"Gave up waiting for {path}")
+                    locked = False
+                    break
+                time.sleep(0.05)
+        try:
+            yield locked
+        finally:
+            if locked:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def striped_lock_path(directory, key, stripes=256):
+    """One of ``stripes`` lock files of ``directory`` for ``key``, so the locks do not leave a file per key behind."""
+    os.makedirs(directory, exist_ok=True)
+    # Unlike hash(), crc32 gives every worker the same stripe
+    return os.path.join(directory, f"{zlib.crc32(key.encode()) % stripes}.lock")
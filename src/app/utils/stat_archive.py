@@ -0,0 +1,25 @@
+from django.db.models import Max
+
+from app.models import StatArchive
+from app.utils.generation import GenerationCache, invalidate_generation
+
+GENERATION_NAME = 'stat-archive'
+
+def archived_until():
+    """The end of the newest archived month, None when nothing was archived.
+
+    The raw stats before it only live in the archive files, so their rollups can never be recomputed.
+    """
+    return StatArchive.objects.aggregate(end=Max('end'))['end']
+
+# Wrapped in a dict, since the cache rebuilds a None value on every call
+_archived_until = GenerationCache(GENERATION_NAME, lambda: {'end': archived_until()})
+
+def get_archived_until():
+    """``archived_until``, read once per worker until archive_stats archives another month."""
+    return _archived_until.get()['end']
+
+def record_archive(month, end, path, rows):
+    archive = StatArchive.objects.create(month=month, end=end, path=path, rows=rows)
+    invalidate_generation(GENERATION_NAME)
+    return archive
@@ -0,0 +1,23 @@
+from app.utils.stat_rollup import save_stats
+from app.utils.write_buffer import WriteBuffer
+
+class StatBuffer(WriteBuffer):
+    """Stat events queued in this worker and written, with their rollups, in one bulk INSERT.
+
+    Flushed every ``STAT_BUFFER_SIZE`` events and ``STAT_BUFFER_SECONDS``.
+    """
+    name = 'stat-buffer'
+    size_setting = 'STAT_BUFFER_SIZE'
+    seconds_setting = 'STAT_BUFFER_SECONDS'
+
+    def write(self, stats):
+        save_stats(stats)
+
+_stat_buffer = StatBuffer()
+
+def buffer_stat(stat):
+    """Queue ``stat`` to be saved with the next bulk INSERT."""
+    _stat_buffer.add(stat)
+
+def flush_stats():
+    return _stat_buffer.flush()
@@ -0,0 +1,68 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+from rest_framework.settings import api_settings
+
+from app.models import Stat
+
+STAT_FIELDS = [field.name for field in Stat._meta.fields]
+CHUNK_SIZE = 2000
+
+class StreamingRenderer(BaseRenderer):
+    """Marks a format that the view streams itself; only error responses go through ``render``."""
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, cls=DjangoJSONEncoder).encode()
+
+class CSVRenderer(StreamingRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+class NDJSONRenderer(StreamingRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+EXPORT_RENDERERS = list(api_settings.DEFAULT_RENDERER_CLASSES) + [CSVRenderer, NDJSONRenderer]
+
+class Echo():
+    """A file-like object that hands back what is written, so csv.writer can feed a stream."""
+    def write(self, value):
+        return value
+
+def paginate(stats, after=None, limit=None):
+    """Order ``stats`` by id from the cursor ``after``, returning the page and the cursor of the next one."""
+    stats = stats.order_by('id')
+    if after is not None:
+        stats = stats.filter(id__gt=after)
+    if limit is None:
+        return stats, None
+    # The id of the last row of the page, found on the primary key index before streaming it
+    last_id = stats.values_list('id', flat=True)[limit - 1:limit].first()
+    if last_id is None or not stats.filter(id__gt=last_id).exists():
+        return stats[:limit], None
+    return stats.filter(id__lte=last_id), last_id
+
+def stream_rows(stats, fields, format):
+    rows = stats.values_list(*fields).iterator(chunk_size=CHUNK_SIZE)
+    if format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(fields)
+        for row in rows:
+            yield writer.writerow([value.isoformat() if hasattr(value, 'isoformat') else value for value in row])
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(fields, row)), cls=DjangoJSONEncoder) + '\n'
+
+def streaming_export(stats, fields, format, next_cursor=None):
+    """Stream ``fields`` of ``stats`` as CSV or NDJSON, reading the rows in chunks."""
+    renderer = CSVRenderer if format == 'csv' else NDJSONRenderer
+    response = StreamingHttpResponse(stream_rows(stats, fields, format), content_type=f'{renderer.media_type}; charset=utf-8')
+    if format == 'csv':
+        response['Content-Disposition'] = 'attachment; filename="stats.csv"'
+    if next_cursor is not None:
+        response['X-Next-Cursor'] = str(next_cursor)
+    return response
@@ -0,0 +1,86 @@
+import logging
+import operator
+from collections import Counter
+from functools import reduce
+
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Value, When
+from django.db.models.functions import TruncHour
+
+from app.models import Stat, StatRollup
+from app.utils.stat_archive import archived_until
+from app.utils.stat_sketches import update_sketches
+from app.utils.stop_matcher import get_stop_matcher
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_FIELDS = ['request', 'platform', 'language', 'origin', 'destination']
+# Keys per statement, keeping the query parameters under the database limits
+ROLLUP_CHUNK_SIZE = 100
+
+def rollup_hour(timestamp):
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+def save_stats(stats):
+    """Resolve the stops of ``stats``, insert them and add them to the hourly rollups in the same transaction.
+
+    The sketches are only updated in memory, and merged into the stored ones by this worker's sketch buffer.
+    """
+    matcher = get_stop_matcher()
+    for stat in stats:
+        matcher.resolve_stat(stat)
+    with transaction.atomic():
+        Stat.objects.bulk_create(stats)
+        add_to_rollups(stats)
+    update_sketches(stats)
+
+def add_to_rollups(stats):
+    """Add ``stats`` to their hourly rollups with a few set-based statements per ROLLUP_CHUNK_SIZE keys.
+
+    The missing rows are inserted with a count of 0, ignoring the ones another worker inserted meanwhile,
+    and then every row gets its increment from one CASE expression.
+    """
+    counts = Counter((rollup_hour(stat.timestamp), *(getattr(stat, field) for field in ROLLUP_FIELDS)) for stat in stats)
+    keys = list(counts)
+    for start in range(0, len(keys), ROLLUP_CHUNK_SIZE):
+        chunk = keys[start:start + ROLLUP_CHUNK_SIZE]
+        StatRollup.objects.bulk_create([StatRollup(count=0, **dict(zip(['hour'] + ROLLUP_FIELDS, key))) for key in chunk],
+                                       ignore_conflicts=True)
+        matching = reduce(operator.or_, (Q(**dict(zip(['hour'] + ROLLUP_FIELDS, key))) for key in chunk))
+        increments = {rollup_id: counts[tuple(key)]
+                      for rollup_id, *key in StatRollup.objects.filter(matching).values_list('id', 'hour', *ROLLUP_FIELDS)}
+        whens = [When(id=rollup_id, then=Value(count)) for rollup_id, count in increments.items()]
+        StatRollup.objects.filter(id__in=increments).update(count=F('count') + Case(*whens, default=Value(0), output_field=IntegerField()))
+
+def rebuild_rollups(start=None, end=None):
+    """Recompute the rollups of the hours from ``start`` up to, not including, ``end`` from the raw stats.
+
+    Both bounds are rounded down to the hour. Hours of the months archived by archive_stats are never recomputed:
+    the rollups are all that is left of their stats. Returns the number of rollup rows written.
+    """
+    archived = archived_until()
+    if archived is not None:
+        start = archived if start is None else max(start, archived)
+
+    stats = Stat.objects.all()
+    rollups = StatRollup.objects.all()
+    if start is not None:
+        stats = stats.filter(timestamp__gte=rollup_hour(start))
+        rollups = rollups.filter(hour__gte=rollup_hour(start))
+    if end is not None:
+        stats = stats.filter(timestamp__lt=rollup_hour(end))
+        rollups = rollups.filter(hour__lt=rollup_hour(end))
+
+    rows = stats.annotate(hour=TruncHour('timestamp')).values('hour', *ROLLUP_FIELDS).annotate(count=Count('id')).order_by()
+    with transaction.atomic():
+        rollups.delete()
+        written = 0
+        batch = []
+        for row in rows.iterator():
+            batch.append(StatRollup(**row))
+            if len(batch) == 1000:
+                written += len(StatRollup.objects.bulk_create(batch))
+                batch = []
+        written += len(StatRollup.objects.bulk_create(batch))
+    logger.info(f"Rebuilt {written} stat rollups")
+    return written
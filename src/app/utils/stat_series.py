@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from django.db.models import Count
+from django.db.models.functions import TruncDate, TruncHour
+from django.utils import timezone
+
+UNITS = {
+    'day': (TruncDate, timedelta(days=1)),
+    'hour': (TruncHour, timedelta(hours=1)),
+}
+
+def first_bucket(moment, unit):
+    moment = timezone.localtime(moment)
+    return moment.date() if unit == 'day' else moment.replace(minute=0, second=0, microsecond=0)
+
+def count_series(queryset, start, end, unit='day', field='timestamp', count=None):
+    """Return (day or hour, count) pairs for every bucket from ``start`` to ``end``, empty ones included.
+
+    The counts come from a single GROUP BY on ``field`` truncated to ``unit`` in the current time zone.
+    ``count`` is the aggregate to use, Count('id') by default.
+    """
+    trunc, step = UNITS[unit]
+    rows = (queryset.filter(**{f'{field}__range': (start, end)})
+            .annotate(bucket=trunc(field)).order_by().values('bucket')
+            .annotate(total=count or Count('id')).values_list('bucket', 'total'))
+    counts = {bucket: total for bucket, total in rows}
+
+    series = []
+    bucket, last = first_bucket(start, unit), first_bucket(end, unit)
+    while bucket <= last:
+        series.append((bucket, counts.get(bucket, 0)))
+        bucket += step
+    return series
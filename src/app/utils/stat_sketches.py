@@ -0,0 +1,188 @@
+import hashlib
+import json
+import math
+from collections import Counter
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Sum
+
+from app.models import StatRollup, StatSketch
+from app.utils.write_buffer import WriteBuffer
+
+SEARCH_REQUESTS = ['get_route', 'get_directions', 'find_routes']
+TOP_CAPACITY = 500
+HLL_PRECISION = 12
+
+def item_hash(item):
+    return int.from_bytes(hashlib.blake2b(item.encode(), digest_size=8).digest(), 'big')
+
+class SpaceSaving():
+    """Space-Saving summary of the most frequent items: at most ``capacity`` counters, each an upper bound
+    of its item's count, exact for items that were never evicted."""
+    def __init__(self, capacity=TOP_CAPACITY, counters=None):
+        self.capacity = capacity
+        # item -> [count, overestimation]
+        self.counters = counters or {}
+
+    def add(self, item, count=1):
+        if item in self.counters:
+            self.counters[item][0] += count
+        elif len(self.counters) < self.capacity:
+            self.counters[item] = [count, 0]
+        else:
+            evicted = min(self.counters, key=lambda key: self.counters[key][0])
+            minimum = self.counters.pop(evicted)[0]
+            self.counters[item] = [minimum + count, minimum]
+
+    def merge(self, other):
+        """Add the counts of ``other``. An item missing from a full summary is counted at that summary's
+        minimum, the most it can have had, so every counter stays an upper bound."""
+        def floor(summary):
+            return min(count for count, _ in summary.counters.values()) if len(summary.counters) >= summary.capacity else 0
+        own_floor, other_floor = floor(self), floor(other)
+        merged = {}
+        for item in self.counters.keys() | other.counters.keys():
+            count, error = self.counters.get(item, [own_floor, own_floor])
+            other_count, other_error = other.counters.get(item, [other_floor, other_floor])
+            merged[item] = [count + other_count, error + other_error]
+        self.counters = dict(sorted(merged.items(), key=lambda pair: -pair[1][0])[:self.capacity])
+
+    def top(self, n):
+        return sorted(((item, count) for item, (count, _) in self.counters.items()), key=lambda pair: -pair[1])[:n]
+
+    def to_bytes(self):
+        return json.dumps({'capacity': self.capacity, 'counters': self.counters}).encode()
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = json.loads(bytes(data).decode())
+        return cls(data['capacity'], data['counters'])
+
+class HyperLogLog():
+    """HyperLogLog distinct counter with 2 ** ``precision`` registers, about 1.6% standard error at the default precision."""
+    def __init__(self, precision=HLL_PRECISION, registers=None):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8) if registers is None else registers
+
+    def add(self, item):
+        value = item_hash(item)
+        register = value >> (64 - self.precision)
+        rest = value & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[register]:
+            self.registers[register] = rank
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self):
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / float(np.sum(np.power(2.0, -self.registers.astype(np.float64))))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate while many registers are still empty
+            return round(m * math.log(m / zeros))
+        return round(estimate)
+
+    def to_bytes(self):
+        return bytes([self.precision]) + self.registers.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = bytes(data)
+        return cls(data[0], np.frombuffer(data[1:], dtype=np.uint8).copy())
+
+def search_keys(request, origin, destination):
+    """The (sketch key, item) pairs a stat counts towards, with the same filters as the exact dashboard queries."""
+    keys = []
+    if request in SEARCH_REQUESTS and destination != 'null':
+        keys.append(('destination', destination))
+    if request == 'get_route' and origin != 'null':
+        keys.append(('origin', origin))
+        if destination != 'null':
+            keys.append(('route', f"{origin} -> {destination}"))
+    return keys
+
+SKETCHES = {
+    **{f'top:{key}': SpaceSaving for key in ['destination', 'origin', 'route']},
+    **{f'distinct:{key}': HyperLogLog for key in ['destination', 'origin', 'route']},
+}
+
+def load_sketches(for_update=False):
+    rows = StatSketch.objects.all()
+    if for_update:
+        rows = rows.select_for_update()
+    stored = {row.name: row.data for row in rows}
+    return {name: sketch.from_bytes(stored[name]) if name in stored else sketch() for name, sketch in SKETCHES.items()}
+
+def save_sketches(sketches):
+    for name, sketch in sketches.items():
+        StatSketch.objects.update_or_create(name=name, defaults={'data': sketch.to_bytes()})
+
+def add_counts(sketches, counts):
+    for (key, item), count in counts.items():
+        sketches[f'top:{key}'].add(item, count)
+        sketches[f'distinct:{key}'].add(item)
+
+def merge_sketches(pending):
+    """Merge ``pending`` sketches into the stored ones, locking them so every worker's sketches are counted."""
+    with transaction.atomic():
+        sketches = load_sketches(for_update=True)
+        for name, sketch in pending.items():
+            sketches[name].merge(sketch)
+        save_sketches(sketches)
+
+class SketchBuffer(WriteBuffer):
+    """The sketch items of the stats saved in this worker, made into sketches and merged into the stored ones.
+
+    Merged every ``STAT_SKETCH_BUFFER_SECONDS`` and ``STAT_SKETCH_BUFFER_SIZE`` items, so saving stats never waits for the lock.
+    """
+    name = 'stat-sketch-buffer'
+    size_setting = 'STAT_SKETCH_BUFFER_SIZE'
+    seconds_setting = 'STAT_SKETCH_BUFFER_SECONDS'
+
+    def write(self, items):
+        pending = {name: sketch() for name, sketch in SKETCHES.items()}
+        add_counts(pending, Counter(items))
+        merge_sketches(pending)
+
+_sketch_buffer = SketchBuffer()
+
+def update_sketches(stats):
+    """Add ``stats`` to this worker's sketches, merged into the stored ones with the next flush."""
+    for stat in stats:
+        for key in search_keys(stat.request, stat.origin, stat.destination):
+            _sketch_buffer.add(key)
+
+def flush_sketches():
+    return _sketch_buffer.flush()
+
+def sketches_from_rollups(rows):
+    """Build the sketches from (request, origin, destination, count) rollup rows."""
+    counts = Counter()
+    for request, origin, destination, total in rows:
+        for key in search_keys(request, origin, destination):
+            counts[key] += total
+    sketches = {name: sketch() for name, sketch in SKETCHES.items()}
+    # Largest first, so the Space-Saving counters start from the items that matter
+    add_counts(sketches, dict(counts.most_common()))
+    return sketches
+
+def rollup_rows(rollups):
+    return (rollups.filter(request__in=SEARCH_REQUESTS).order_by()
+            .values_list('request', 'origin', 'destination').annotate(total=Sum('count')).iterator())
+
+def rebuild_sketches():
+    """Recompute the stored sketches from the hourly rollups, returning them."""
+    sketches = sketches_from_rollups(rollup_rows(StatRollup.objects.all()))
+    with transaction.atomic():
+        StatSketch.objects.all().delete()
+        save_sketches(sketches)
+    return sketches
+
+def sketch_summary(most_searched_n):
+    """The approximate most searched destinations, origins and routes, plus the distinct count of each."""
+    sketches = load_sketches()
+    return {key: (sketches[f'top:{key}'].top(most_searched_n), sketches[f'distinct:{key}'].count())
+            for key in ['destination', 'origin', 'route']}
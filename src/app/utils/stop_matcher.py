@@ -0,0 +1,92 @@
+import logging
+from difflib import SequenceMatcher
+
+from app.models import GroupStop, Stop
+from app.utils.generation import GenerationCache
+from app.utils.str_utils import clean_string
+
+logger = logging.getLogger(__name__)
+
+GENERATION_NAME = 'stops'
+# Names come from clients, so the memo is bounded
+MAX_MATCHES = 10000
+# Placeholders the apps send when a stat has no stop
+UNKNOWN_NAMES = {'NA', 'null'}
+
+def is_junk(character):
+    return character in ['do', 'da', 'das', 'dos', 'de', ' ']
+
+class StopMatcher():
+    """The Stop names and Group memberships, with every free-text name already matched to its most similar Stop remembered.
+
+    ``stops`` and ``memberships`` default to the current Stop (id, name) and GroupStop (group id, group name, stop name) rows.
+    Memberships are looked up by cleaned name, the first group listing a name keeping it.
+    """
+    def __init__(self, stops=None, memberships=None):
+        stops = list(Stop.objects.order_by('id').values_list('id', 'name')) if stops is None else stops
+        if memberships is None:
+            memberships = GroupStop.objects.order_by('group_id', 'sequence').values_list('group_id', 'group__name', 'name')
+        self.originals = [name for _, name in stops]
+        self.names = [name.lower() for name in self.originals]
+        self.stop_ids = {}
+        for stop_id, name in stops:
+            self.stop_ids.setdefault(name, stop_id)
+        self.group_ids = {}
+        self.group_names = {}
+        self.members = {}
+        for group_id, group_name, name in memberships:
+            self.group_ids.setdefault(clean_string(name), group_id)
+            self.group_names.setdefault(group_id, group_name)
+            self.members.setdefault(group_name, []).append(name)
+        self.matches = {}
+
+    def most_similar(self, stop):
+        if stop not in self.matches:
+            if len(self.matches) >= MAX_MATCHES:
+                self.matches = {}
+            most_similar_stop = stop
+            most_similar_stop_score = 0
+            for name, original in zip(self.names, self.originals):
+                score = SequenceMatcher(is_junk, name, stop.lower()).ratio()
+                if score > most_similar_stop_score:
+                    most_similar_stop = original
+                    most_similar_stop_score = score
+            self.matches[stop] = most_similar_stop
+        return self.matches[stop]
+
+    def resolve(self, name):
+        """Return the (Stop id, Group id) of a free-text stop name, either None when it cannot be resolved.
+
+        The stop is the most similar Stop; the group is the one listing the name itself, or else its stop.
+        """
+        if not name or name in UNKNOWN_NAMES:
+            return None, None
+        stop = self.most_similar(name)
+        return self.stop_ids.get(stop), self.group_id(name) or self.group_id(stop)
+
+    def group_id(self, name):
+        return self.group_ids.get(clean_string(name))
+
+    def group_name(self, name):
+        """The name of the Group listing ``name``, or else its most similar Stop; None when neither is listed."""
+        group_id = self.group_id(name) or self.group_id(self.most_similar(name))
+        return self.group_names.get(group_id)
+
+    def resolve_stat(self, stat):
+        stat.origin_stop_id, stat.origin_group_id = self.resolve(stat.origin)
+        stat.destination_stop_id, stat.destination_group_id = self.resolve(stat.destination)
+
+    def resolve_stats(self, stats):
+        """Set the stop and group ids of every Stat row, one UPDATE per distinct name; returns the number of names."""
+        resolved = 0
+        for field in ['origin', 'destination']:
+            for name in stats.order_by().values_list(field, flat=True).distinct():
+                stop_id, group_id = self.resolve(name)
+                stats.filter(**{field: name}).update(**{f'{field}_stop_id': stop_id, f'{field}_group_id': group_id})
+                resolved += 1
+        return resolved
+
+_stop_matcher = GenerationCache(GENERATION_NAME, StopMatcher)
+
+def get_stop_matcher():
+    return _stop_matcher.get()
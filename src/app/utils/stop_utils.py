@@ -0,0 +1,26 @@
+import ast
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+TIME_PATTERN = re.compile(r'(\d{1,2})\s*[h:]\s*(\d{2})')
+
+def parse_stops(stops):
+    """Return the (stop name, time string) pairs stored in a Route/Trip ``stops`` field, in order."""
+    if isinstance(stops, dict):
+        return list(stops.items())
+    try:
+        parsed = ast.literal_eval(str(stops))
+        if isinstance(parsed, dict):
+            return [(str(name), str(time)) for name, time in parsed.items()]
+    except (ValueError, SyntaxError):
+        logger.warning(f"Could not parse stops: {stops}")
+    return []
+
+def time_to_minutes(time):
+    """Convert a '09h15' / '09:15' style time (suffixes such as '*' are ignored) to minutes after midnight."""
+    match = TIME_PATTERN.search(str(time))
+    if match is None:
+        return None
+    return int(match.group(1)) * 60 + int(match.group(2))
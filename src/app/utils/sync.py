@@ -0,0 +1,68 @@
+from django.db import transaction
+from django.utils import timezone
+
+from app.models import Change, DataVersion, Holiday, Info, LoadRoute, Route
+from app.serializers import HolidaySerializer, InfoSerializer
+from app.utils.timetable_snapshot import get_snapshot
+
+def record_change(model, object_id, action):
+    """Journal a change under the next data version.
+
+    The counter row stays locked until the transaction commits, so a transaction that takes a later version commits
+    later too, and a client holding a version has already seen every change below it.
+    """
+    with transaction.atomic():
+        counter, _ = DataVersion.objects.select_for_update().get_or_create(id=1)
+        counter.version += 1
+        counter.save(update_fields=['version'])
+        return Change.objects.create(version=counter.version, model=model, object_id=object_id, action=action)
+
+def get_data_version():
+    return DataVersion.objects.filter(id=1).values_list('version', flat=True).first() or 0
+
+def current_infos():
+    # Infos that have not started yet are sent too, no change will announce their start
+    return Info.objects.filter(end__gte=timezone.now())
+
+def full_sync(data_version):
+    """Everything the apps keep locally, for new clients or clients older than the journal."""
+    return {
+        'data_version': data_version,
+        'full': True,
+        'routes': {'changed': get_snapshot().load_routes(), 'removed': []},
+        'holidays': {'changed': HolidaySerializer(Holiday.objects.all(), many=True).data, 'removed': []},
+        'infos': {'changed': InfoSerializer(current_infos(), many=True).data, 'removed': []},
+    }
+
+def delta_sync(since, data_version):
+    """The routes, holidays and infos added, changed or removed after data version ``since``."""
+    changed = {'route': set(), 'holiday': set(), 'info': set()}
+    removed = {'route': set(), 'holiday': set(), 'info': set()}
+    # Only the last change of each row matters
+    for model, object_id, action in Change.objects.filter(version__gt=since, version__lte=data_version).order_by('version').values_list('model', 'object_id', 'action'):
+        (changed if action == 'save' else removed)[model].add(object_id)
+        (removed if action == 'save' else changed)[model].discard(object_id)
+
+    routes = Route.objects.filter(id__in=changed['route'], disabled=False).prefetch_related('route_stops')
+    load_routes = []
+    for route in routes:
+        stop_times = route.get_stop_times()
+        load_routes.append(LoadRoute(route.id, route.route, [stop for stop, _ in stop_times], [time for _, time in stop_times], route.type_of_day, route.information).__dict__)
+    holidays = Holiday.objects.filter(id__in=changed['holiday'])
+    infos = current_infos().filter(id__in=changed['info'])
+
+    # Rows saved and then deleted, disabled or expired are removed as well
+    return {
+        'data_version': data_version,
+        'full': False,
+        'routes': {'changed': load_routes, 'removed': sorted(removed['route'] | (changed['route'] - {route['id'] for route in load_routes}))},
+        'holidays': {'changed': HolidaySerializer(holidays, many=True).data, 'removed': sorted(removed['holiday'] | (changed['holiday'] - {holiday.id for holiday in holidays}))},
+        'infos': {'changed': InfoSerializer(infos, many=True).data, 'removed': sorted(removed['info'] | (changed['info'] - {info.id for info in infos}))},
+    }
+
+def sync(since):
+    """Return the changes after data version ``since``, or a full snapshot when the journal no longer reaches back to it."""
+    data_version = get_data_version()
+    if since is None or since <= 0 or since > data_version or not Change.objects.filter(version=since).exists():
+        return full_sync(data_version)
+    return delta_sync(since, data_version)
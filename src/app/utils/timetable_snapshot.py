@@ -0,0 +1,260 @@
+import json
+import logging
+import os
+import shutil
+from contextlib import nullcontext
+from itertools import groupby
+
+import numpy as np
+from django.conf import settings
+
+from app.models import LoadRoute, Route, RouteStop
+from app.utils.generation import GenerationCache, get_generation
+from app.utils.single_flight import file_lock
+
+logger = logging.getLogger(__name__)
+
+GENERATION_NAME = 'routes'
+POINTER_FILE = 'current'
+COMPILE_LOCK_FILE = 'compile.lock'
+KEEP_SNAPSHOTS = 2
+
+# Per route, ordered by id
+ROUTE_ARRAYS = ['route_ids', 'route_names', 'route_types', 'route_information', 'route_offsets']
+# Per route stop, ordered by route and sequence
+STOP_TIME_ARRAYS = ['stop_ids', 'stop_names', 'stop_times', 'minutes']
+# Per route stop, ordered by stop, type of day and minutes
+DEPARTURE_ARRAYS = ['stop_offsets', 'departure_routes', 'departure_sequences', 'departure_types', 'departure_minutes']
+ARRAYS = ROUTE_ARRAYS + STOP_TIME_ARRAYS + DEPARTURE_ARRAYS
+
+class TimetableSnapshot():
+    """The active timetable as flat integer arrays plus a string table.
+
+    ``stops`` holds the cleaned stop names, sorted, and ``strings`` every other
+    value (route numbers, raw stop names, time labels, types of day and
+    information), both referenced by position from the arrays. Minutes after
+    midnight are -1 when a time could not be parsed.
+    """
+    def __init__(self, arrays, stops, strings, generation=None):
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        self.stops = stops
+        self.strings = strings
+        self.generation = generation
+        self.stop_lookup = {stop: stop_id for stop_id, stop in enumerate(stops)}
+        self.type_lookup = {strings[type_id]: type_id for type_id in np.unique(self.route_types).tolist()}
+
+    def __len__(self):
+        return len(self.route_ids)
+
+    def route_stop_rows(self):
+        """Iterate over (route id, route, information, type of day, stop, cleaned stop, time, minutes) rows in route order."""
+        strings = self.strings
+        route_offsets = self.route_offsets.tolist()
+        stop_ids = self.stop_ids.tolist()
+        stop_names = self.stop_names.tolist()
+        stop_times = self.stop_times.tolist()
+        minutes = self.minutes.tolist()
+        for route, route_id in enumerate(self.route_ids.tolist()):
+            route_name = strings[self.route_names[route]]
+            information = strings[self.route_information[route]]
+            type_of_day = strings[self.route_types[route]]
+            for row in range(route_offsets[route], route_offsets[route + 1]):
+                yield (route_id, route_name, information, type_of_day, strings[stop_names[row]], self.stops[stop_ids[row]],
+                       strings[stop_times[row]], minutes[row] if minutes[row] >= 0 else None)
+
+    def route(self, route_id):
+        """Return the (route, type of day, information, [(stop, time)]) of ``route_id``, or None when it is not active."""
+        route = int(np.searchsorted(self.route_ids, route_id))
+        if route >= len(self) or self.route_ids[route] != route_id:
+            return None
+        strings = self.strings
+        rows = range(self.route_offsets[route], self.route_offsets[route + 1])
+        return (strings[self.route_names[route]], strings[self.route_types[route]], strings[self.route_information[route]],
+                [(strings[self.stop_names[row]], strings[self.stop_times[row]]) for row in rows])
+
+    def load_routes(self):
+        """Return the LoadRoute dictionaries of every route, as sent by the load endpoints."""
+        routes = []
+        for route_id, rows in groupby(self.route_stop_rows(), key=lambda row: row[0]):
+            rows = list(rows)
+            _, route, information, type_of_day = rows[0][:4]
+            routes.append(LoadRoute(route_id, route, [row[4] for row in rows], [row[6] for row in rows], type_of_day, information).__dict__)
+        return routes
+
+    def columnar_routes(self):
+        """Return every route in the columnar load layout.
+
+        Stop names are sent once, sorted, in ``stops``; each route lists indices into
+        it and minutes after midnight (None when a time could not be parsed). Times
+        whose label is not the plain ``HHhMM`` form of its minutes (``07h25*``,
+        ``12h05d``) are listed in ``labels`` as [route position, stop position, label].
+        """
+        strings = self.strings
+        route_offsets = self.route_offsets.tolist()
+        stop_names = self.stop_names.tolist()
+        stop_times = self.stop_times.tolist()
+        minutes = self.minutes.tolist()
+
+        names = sorted({strings[name] for name in set(stop_names)})
+        positions = {name: position for position, name in enumerate(names)}
+        name_positions = {name: positions[strings[name]] for name in set(stop_names)}
+
+        columns = {'id': self.route_ids.tolist(), 'route': [], 'weekday': [], 'information': [], 'stops': [], 'times': [], 'labels': []}
+        for route in range(len(self)):
+            columns['route'].append(strings[self.route_names[route]])
+            columns['weekday'].append(strings[self.route_types[route]])
+            columns['information'].append(strings[self.route_information[route]])
+            rows = range(route_offsets[route], route_offsets[route + 1])
+            columns['stops'].append([name_positions[stop_names[row]] for row in rows])
+            columns['times'].append([minutes[row] if minutes[row] >= 0 else None for row in rows])
+            for position, row in enumerate(rows):
+                label = strings[stop_times[row]]
+                if minutes[row] < 0 or label != f"{minutes[row] // 60:02d}h{minutes[row] % 60:02d}":
+                    columns['labels'].append([route, position, label])
+        return {'stops': names, 'routes': columns}
+
+def compile_timetable():
+    """Compile every active Route and its RouteStop rows into a TimetableSnapshot."""
+    routes = list(Route.objects.filter(disabled=False).order_by('id').values_list('id', 'route', 'type_of_day', 'information'))
+    route_stops = RouteStop.objects.filter(route__disabled=False).order_by('route_id', 'sequence').values_list(
+        'route_id', 'sequence', 'stop', 'cleaned_stop', 'time', 'minutes_after_midnight')
+
+    strings = []
+    string_ids = {}
+    def string_id(value):
+        key = json.dumps(value, sort_keys=True)
+        if key not in string_ids:
+            string_ids[key] = len(strings)
+            strings.append(value)
+        return string_ids[key]
+
+    route_index = {route_id: index for index, (route_id, _, _, _) in enumerate(routes)}
+    rows = [row for row in route_stops if row[0] in route_index]
+    stops = sorted({cleaned_stop for _, _, _, cleaned_stop, _, _ in rows})
+    stop_lookup = {stop: stop_id for stop_id, stop in enumerate(stops)}
+
+    arrays = {
+        'route_ids': np.array([route_id for route_id, _, _, _ in routes], dtype=np.int32),
+        'route_names': np.array([string_id(route) for _, route, _, _ in routes], dtype=np.int32),
+        'route_types': np.array([string_id(type_of_day) for _, _, type_of_day, _ in routes], dtype=np.int32),
+        'route_information': np.array([string_id(information) for _, _, _, information in routes], dtype=np.int32),
+        'stop_ids': np.array([stop_lookup[cleaned_stop] for _, _, _, cleaned_stop, _, _ in rows], dtype=np.int32),
+        'stop_names': np.array([string_id(stop) for _, _, stop, _, _, _ in rows], dtype=np.int32),
+        'stop_times': np.array([string_id(time) for _, _, _, _, time, _ in rows], dtype=np.int32),
+        'minutes': np.array([-1 if minutes is None else minutes for _, _, _, _, _, minutes in rows], dtype=np.int32),
+    }
+    row_routes = np.array([route_index[route_id] for route_id, _, _, _, _, _ in rows], dtype=np.int32)
+    arrays['route_offsets'] = np.searchsorted(row_routes, np.arange(len(routes) + 1)).astype(np.int32)
+
+    sequences = np.array([sequence for _, sequence, _, _, _, _ in rows], dtype=np.int32)
+    row_types = arrays['route_types'][row_routes]
+    order = np.lexsort((arrays['minutes'], row_types, arrays['stop_ids']))
+    arrays['stop_offsets'] = np.searchsorted(arrays['stop_ids'][order], np.arange(len(stops) + 1)).astype(np.int32)
+    arrays['departure_routes'] = row_routes[order]
+    arrays['departure_sequences'] = sequences[order]
+    arrays['departure_types'] = row_types[order].astype(np.int32)
+    arrays['departure_minutes'] = arrays['minutes'][order]
+    return TimetableSnapshot(arrays, stops, strings)
+
+def get_snapshot_dir():
+    return settings.TIMETABLE_SNAPSHOT_DIR
+
+def write_snapshot(snapshot, routes_generation):
+    """Write ``snapshot`` under a new generation number and point the other workers to it."""
+    directory = get_snapshot_dir()
+    os.makedirs(directory, exist_ok=True)
+    generation = (read_pointer() or 0) + 1
+    while True:
+        path = os.path.join(directory, str(generation))
+        try:
+            os.mkdir(path)
+            break
+        except FileExistsError:
+            generation += 1
+
+    for name in ARRAYS:
+        np.save(os.path.join(path, f"{name}.npy"), getattr(snapshot, name))
+    with open(os.path.join(path, 'strings.json'), 'w') as strings_file:
+        json.dump({'stops': snapshot.stops, 'strings': snapshot.strings, 'routes_generation': routes_generation}, strings_file)
+
+    pointer = os.path.join(directory, POINTER_FILE)
+    with open(f"{pointer}.{generation}", 'w') as pointer_file:
+        pointer_file.write(str(generation))
+    os.replace(f"{pointer}.{generation}", pointer)
+    logger.info(f"Wrote timetable snapshot {generation} with {len(snapshot)} routes")
+    return generation
+
+def read_pointer():
+    try:
+        with open(os.path.join(get_snapshot_dir(), POINTER_FILE)) as pointer_file:
+            return int(pointer_file.read().strip())
+    except (OSError, ValueError):
+        return None
+
+def read_snapshot(generation):
+    """Memory-map snapshot ``generation`` read-only, so every worker shares the same pages."""
+    path = os.path.join(get_snapshot_dir(), str(generation))
+    with open(os.path.join(path, 'strings.json')) as strings_file:
+        tables = json.load(strings_file)
+    arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r') for name in ARRAYS}
+    snapshot = TimetableSnapshot(arrays, tables['stops'], tables['strings'], generation)
+    return snapshot, tables['routes_generation']
+
+def remove_old_snapshots(keep=KEEP_SNAPSHOTS):
+    """Delete all but the newest ``keep`` snapshots; workers still mapping them keep their pages."""
+    directory = get_snapshot_dir()
+    generations = sorted(int(name) for name in os.listdir(directory) if name.isdigit())
+    for generation in generations[:-keep]:
+        shutil.rmtree(os.path.join(directory, str(generation)), ignore_errors=True)
+
+def current_snapshot(routes_generation):
+    """The snapshot the pointer names, if it was compiled for ``routes_generation``."""
+    generation = read_pointer()
+    if generation is not None:
+        try:
+            snapshot, snapshot_routes_generation = read_snapshot(generation)
+            if snapshot_routes_generation == routes_generation:
+                return snapshot
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Could not read timetable snapshot {generation}: {e}")
+    return None
+
+def compile_lock():
+    try:
+        os.makedirs(get_snapshot_dir(), exist_ok=True)
+    except OSError:
+        return nullcontext()
+    return file_lock(os.path.join(get_snapshot_dir(), COMPILE_LOCK_FILE), settings.TIMETABLE_COMPILE_LOCK_SECONDS)
+
+def load_snapshot():
+    """Map the current snapshot if it matches the Route data, otherwise compile and publish a new one.
+
+    One worker of the host compiles at a time; the others wait for it and map the snapshot it wrote.
+    """
+    routes_generation = get_generation(GENERATION_NAME)
+    snapshot = current_snapshot(routes_generation)
+    if snapshot is not None:
+        return snapshot
+    with compile_lock():
+        snapshot = current_snapshot(routes_generation)
+        if snapshot is not None:
+            return snapshot
+        return compile_and_write(routes_generation)
+
+def compile_and_write(routes_generation):
+    snapshot = compile_timetable()
+    try:
+        generation = write_snapshot(snapshot, routes_generation)
+        remove_old_snapshots()
+        return read_snapshot(generation)[0]
+    except OSError as e:
+        logger.warning(f"Could not write timetable snapshot, keeping it in memory: {e}")
+        return snapshot
+
+# After a Route change elsewhere, requests keep the previous timetable while it is reloaded in the background
+_snapshot = GenerationCache(GENERATION_NAME, load_snapshot, background=True)
+
+def get_snapshot():
+    """Return this worker's view of the timetable snapshot, reloading it when the Route generation changes."""
+    return _snapshot.get()
@@ -0,0 +1,116 @@
+import math
+from datetime import datetime
+
+from django.utils import timezone
+
+from app.models import Holiday, Trip, TripStop
+from app.utils.day_utils import get_type_of_day
+
+def is_within_50km_radius(lat, lon):
+    def haversine(lat1, lon1, lat2, lon2):
+        lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
+        
+        dlat = lat2 - lat1
+        dlon = lon2 - lon1
+        
+        a = math.sin(dlat / 2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2)**2
+        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+        
+        R = 6371.0
+        distance = R * c
+        
+        return distance
+    
+    center_lat, center_lon = 37.782213, -25.499806
+    radius = 50
+    
+    distance = haversine(center_lat, center_lon, lat, lon)
+    
+    return distance <= radius
+
+
+def data_to_route(data):
+    bus_stop_locations = {}
+    bus_schedules = []  
+    for key in data:
+        if key == "routes":
+            for route in data[key]:
+                bus_schedule = {}
+
+                for leg in route["legs"]:
+                    departure_timestamp = leg["departure_time"]["value"]
+                    trip_date = datetime.utcfromtimestamp(departure_timestamp).strftime('%Y-%m-%d')
+    
+                    bus_numbers = []
+                    for step in leg["steps"]:
+                        if step["travel_mode"] == "TRANSIT":
+                            transit_details = step["transit_details"]
+                            
+                            departure_time = transit_details["departure_time"]["text"]
+                            arrival_time = transit_details["arrival_time"]["text"]
+                            
+                            if 'AM' in departure_time or 'PM' in departure_time:
+                                departure_time = datetime.strptime(departure_time, '%I:%M %p').strftime('%Hh%M')
+                                arrival_time = datetime.strptime(arrival_time, '%I:%M %p').strftime('%Hh%M')
+                            else:
+                                departure_time = datetime.strptime(departure_time, '%H:%M').strftime('%Hh%M')
+                                arrival_time = datetime.strptime(arrival_time, '%H:%M').strftime('%Hh%M')
+
+                            bus_schedule[transit_details["departure_stop"]["name"]] = departure_time
+                            bus_schedule[transit_details["arrival_stop"]["name"]] = arrival_time
+                            bus_numbers.append(transit_details["line"]["short_name"].replace('C', ''))
+                            departure_stop = transit_details["departure_stop"]["name"]
+                            departure_location = (
+                                transit_details["departure_stop"]["location"]["lat"],
+                                transit_details["departure_stop"]["location"]["lng"]
+                            )
+                            arrival_stop = transit_details["arrival_stop"]["name"]
+                            arrival_location = (
+                                transit_details["arrival_stop"]["location"]["lat"],
+                                transit_details["arrival_stop"]["location"]["lng"]
+                            )
+                            
+                            if not is_within_50km_radius(departure_location[0], departure_location[1]) or not is_within_50km_radius(arrival_location[0], arrival_location[1]):
+                                continue
+                            
+                            bus_stop_locations[departure_stop] = departure_location
+                            bus_stop_locations[arrival_stop] = arrival_location
+                bus_schedules.append({'bus': " / ".join(bus_numbers), 'stops': bus_schedule, 'day': trip_date})
+    return bus_schedules, bus_stop_locations
+
+
+def extract_trips(data):
+    """Save the TripStops and Trips of a Data row's Google Directions response, returning its (trips, stops)."""
+    # From unix timestamp to datetime in Azores timezone
+    trips, stops = data_to_route(data.data)
+    
+    # Bulk create TripStops if they do not exist
+    existing_stops = TripStop.objects.filter(name__in=stops.keys()).values_list('name', flat=True)
+    new_stops = [
+        TripStop(name=stop, latitude=coords[0], longitude=coords[1])
+        for stop, coords in stops.items()
+        if stop not in existing_stops
+    ]
+    TripStop.objects.bulk_create(new_stops, ignore_conflicts=True)
+                    
+    for trip in trips:
+        bus_number = trip['bus']
+        bus_stops = trip['stops']
+        trip_day_str = trip['day']
+        trip_day_date = datetime.strptime(trip_day_str, '%Y-%m-%d')
+        
+        try:
+            type_of_day = get_type_of_day(trip_day_date, Holiday.objects.filter(date=trip_day_date).exists())
+        except:
+            type_of_day = trip_day_date.upper()
+
+        trip_day_date = trip_day_date.date()
+                    
+        # Update or create the Trip
+        Trip.objects.update_or_create(
+            route=bus_number,
+            stops=bus_stops,
+            type_of_day=type_of_day,
+            defaults={'added': timezone.now()}
+        )
+    return trips, stops
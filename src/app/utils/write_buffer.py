@@ -0,0 +1,82 @@
+import atexit
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+class WriteBuffer():
+    """Items queued in this worker and written together.
+
+    A background thread writes the queue every ``seconds_setting`` seconds, and straight
+    away once it holds the number of items in the ``size_setting`` setting; the request
+    that fills it only wakes the thread. The queue is also written when the worker exits.
+    A size of 1 or less writes every item in the request instead. Subclasses implement ``write``.
+    """
+    name = 'write-buffer'
+    size_setting = None
+    seconds_setting = None
+
+    def __init__(self):
+        self.reset()
+        atexit.register(self.flush)
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.items = []
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.flusher = None
+
+    def write(self, items):
+        raise NotImplementedError
+
+    def add(self, item):
+        if self.pid != os.getpid():
+            # Forked after items were queued: the parent still owns them
+            self.reset()
+        size = getattr(settings, self.size_setting)
+        if size <= 1:
+            self.write([item])
+            return
+        with self.lock:
+            self.items.append(item)
+            full = len(self.items) >= size
+            if self.flusher is None:
+                self.flusher = self.start_flusher()
+        if full:
+            self.wake.set()
+
+    def start_flusher(self):
+        flusher = threading.Thread(target=self.flush_periodically, name=self.name, daemon=True)
+        flusher.start()
+        return flusher
+
+    def flush(self):
+        """Write the queued items, returning how many were written."""
+        with self.lock:
+            items, self.items = self.items, []
+        if not items:
+            return 0
+        try:
+            self.write(items)
+        except Exception:
+            logger.exception(f"Could not write {len(items)} items of {self.name}")
+            with self.lock:
+                # Kept for the next flush, but never more than a few batches
+                self.items = (items + self.items)[-10 * getattr(settings, self.size_setting):]
+            return 0
+        return len(items)
+
+    def flush_periodically(self):
+        while True:
+            self.wake.wait(getattr(settings, self.seconds_setting))
+            self.wake.clear()
+            try:
+                self.flush()
+            finally:
+                # This thread's connection would otherwise stay open between flushes
+                connections.close_all()
@@ -1,5 +1,6 @@
 from .v1.views import *
 from .v2.views import *
+from .v3.views import *
 from .ads.views import *
 from .models.views import *
 from .feedback import *
@@ -23,7 +23,7 @@ def like_trip(request, trip_id):
         else:
             trip.likes += 1
 
-        trip.save()
+        trip.save(update_fields=['likes', 'dislikes'])
         return JsonResponse({'message': 'Likes updated successfully', 'likes_percent': trip.likes_percent, 'dislikes_percent': trip.dislikes_percent}, status=200)
     except (Trip.DoesNotExist, Route.DoesNotExist):
         return JsonResponse({'error': 'Trip not found'}, status=404)
@@ -47,7 +47,7 @@ def dislike_trip(request, trip_id):
         else:
             trip.dislikes += 1
 
-        trip.save()
+        trip.save(update_fields=['likes', 'dislikes'])
         return JsonResponse({'message': 'Dislikes updated successfully', 'likes_percent': trip.likes_percent, 'dislikes_percent': trip.dislikes_percent}, status=200)
     except (Trip.DoesNotExist, Route.DoesNotExist):
         return JsonResponse({'error': 'Trip not found'}, status=404)
@@ -65,12 +65,12 @@ def reset_likes_dislikes(request):
     for trip in Trip.objects.all():
         trip.likes = 0
         trip.dislikes = 0
-        trip.save()
+        trip.save(update_fields=['likes', 'dislikes'])
 
     for route in Route.objects.all():
         route.likes = 0
         route.dislikes = 0
-        route.save()
+        route.save(update_fields=['likes', 'dislikes'])
 
     return JsonResponse({'message': 'Likes and dislikes reset successfully'}, status=200)
 
@@ -1,23 +1,36 @@
-import collections
-from difflib import SequenceMatcher
 from django.shortcuts import render
 from django.utils import timezone
 from SaoMiguelBus import settings
 from numpy import full
 import django.db.models as models
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, renderer_classes
 from rest_framework.response import Response
-from app.models import Holiday, Stop, Route, Stat, ReturnRoute, LoadRoute, Trip, TripStop, Variables, Ad, Group, Info, Data as route_data
-from app.serializers import DataSerializer, HolidaySerializer, StopSerializer, RouteSerializer, StatSerializer, ReturnRouteSerializer, LoadRouteSerializer, TripSerializer, TripStopSerializer, VariablesSerializer, AdSerializer, GroupSerializer, InfoSerializer
+from app.models import Holiday, Stop, Route, Stat, StatRollup, StatSketch, ReturnRoute, LoadRoute, Trip, TripStop, Variables, Ad, AdConflict, Group, GroupStop, Info, Data as route_data
+from app.serializers import DataSerializer, HolidaySerializer, StopSerializer, RouteSerializer, StatSerializer, StatEventSerializer, ReturnRouteSerializer, LoadRouteSerializer, TripSerializer, TripStopSerializer, VariablesSerializer, AdSerializer, AdConflictSerializer, GroupSerializer, InfoSerializer
 from django.views.decorators.http import require_GET, require_POST
 from datetime import datetime, date, timedelta
 from statistics import median
 import requests
 from django.http import JsonResponse
+from django.core.cache import caches
+from django.db import transaction
 import pytz
 
-from app.utils.day_utils import get_type_of_day
+from app.utils.gmaps_cache import directions_key, get_directions
+from app.utils.jobs import enqueue
 from app.utils.str_utils import clean_string
+from app.utils.stop_utils import time_to_minutes
+from app.utils.route_index import get_route_index
+from app.utils.ad_counters import count_ad
+from app.utils.ad_index import get_ad_index
+from app.utils.stat_buffer import buffer_stat
+from app.utils.stat_export import EXPORT_RENDERERS, STAT_FIELDS, paginate, streaming_export
+from app.utils.stop_matcher import get_stop_matcher
+from app.utils.trip_extraction import extract_trips
+from app.utils.stat_rollup import save_stats
+from app.utils.stat_series import count_series
+from app.utils.stat_sketches import sketch_summary
+from app.utils.load_bundle import LOAD_RENDERERS, get_load_data, wants_columnar
 
 #Get All Stops
 @api_view(['GET'])
@@ -46,55 +59,47 @@ def get_trip_v1(request):
         type_of_day = request.GET.get('day', '')
         start_time = request.GET.get('start', '')
         full = True if request.GET.get('full', '').lower() == 'true' else False
+        limit = request.GET.get('limit', '')
+        limit = int(limit) if limit.isdigit() else None
 
-        return_routes = get_trip_v1_logic(origin, destination, type_of_day, start_time, full)
+        return_routes = get_trip_v1_logic(origin, destination, type_of_day, start_time, full, limit=limit)
         return Response(return_routes) if return_routes is not None else Response(status=404)
     
-def get_trip_v1_logic(origin, destination, type_of_day, start_time, full, prefix=False):
+def get_trip_v1_logic(origin, destination, type_of_day, start_time, full, prefix=False, limit=None):
     try:
-        routes = Route.objects.all()
-        routes = routes.exclude(disabled=True)
         return_routes = []
-        if origin in ['Povoacão', 'Lomba do Loucão', 'Ponta Garca']:
-            origin = origin.replace('c', 'ç')
-
         if origin == '' or destination == '':
             return Response({'error': 'Origin and destination are required'})
-        
-        routes = routes.filter(disabled=False).filter(
-                cleaned_stops__contains=origin).filter(
-                    cleaned_stops__contains=destination
+
+        start_minutes = time_to_minutes(start_time) if start_time else 0
+        if start_minutes is None:
+            raise ValueError(f"Invalid start time: {start_time}")
+
+        # Ordered by departure from the origin, so no sorting is needed afterwards
+        route_index = get_route_index()
+        route_ids = route_index.search(origin, destination, type_of_day, start_minutes, limit)
+        # The timetable comes from the snapshot, only the votes from the database
+        votes = Route.objects.only('likes', 'dislikes').in_bulk(route_ids)
+        for route_id in route_ids:
+            votes_route = votes.get(route_id)
+            if votes_route is None:
+                continue
+            route, route_type, information, stop_times = route_index.snapshot.route(route_id)
+            return_routes.append(
+                ReturnRoute(
+                    route_id,
+                    f'C{route}' if prefix and votes_route.likes_percent < 60 else route,
+                    origin,
+                    destination,
+                    stop_times[0][1],
+                    stop_times[-1][1],
+                    str(dict(stop_times)),
+                    route_type,
+                    information,
+                    votes_route.likes_percent,
+                    votes_route.dislikes_percent
+                ).__dict__
             )
-        if type_of_day:
-            routes = routes.filter(type_of_day=type_of_day.upper())
-        # Use a list to collect routes to exclude instead of modifying the queryset in the loop            
-        if origin:
-            if start_time:
-                start_hour, start_minute = map(int, start_time.split('h')) if 'h' in start_time else map(int, start_time.split(':'))
-            else:
-                start_hour, start_minute = 0, 0
-            for route in routes:
-                if str(route.stops).find(origin) > str(route.stops).find(destination):
-                    continue
-                route_start_time = route.stops.split(',')[0].split(':')[1].replace('{', '').replace('\'', '').strip()
-                route_start_hour, route_start_minute = map(int, route_start_time.split('h')) if 'h' in route_start_time else map(int, route_start_time.split(':'))
-                if route_start_hour < start_hour or (route_start_hour == start_hour and route_start_minute < start_minute):
-                    continue
-                return_routes.append(
-                    ReturnRoute(
-                        route.id,
-                        f'C{route.route}' if prefix and route.likes_percent < 60 else route.route,
-                        origin,
-                        destination,
-                        route.stops.split(':')[1].split(",")[0].replace('\'', '').strip(),
-                        route.stops.split(':')[-1].split(",")[0].replace('\'', '').replace('}', '').strip(),
-                        route.stops,
-                        route.type_of_day,
-                        route.information,
-                        route.likes_percent,
-                        route.dislikes_percent
-                    ).__dict__
-                )
 
         if not full:
             #TODO: format route.stops to exclude stops outside the scope
@@ -158,27 +163,39 @@ def get_gmaps_v1(request):
         f"&{'arrival_time' if arrival_departure == 'arrival' else 'departure_time'}={time}"
     )
 
-    try:
+    def fetch():
         response = requests.get(maps_url)
-        if response.status_code == 200:
-            data = response.json()
-            if data['status'] == 'OK':
-                try:
-                    routeData = route_data(
-                        data=data,
-                        origin=str(origin),
-                        destination=str(destination),
-                        language_code=str(language_code),
-                        time=str(time),
-                        platform=str(platform),
-                    )
-                    routeData.save()
-                    get_data_v1(request._request, routeData.id)
-                except Exception as e:
-                    print(e)
+        if response.status_code != 200:
+            return response.status_code, None
+        data = response.json()
+        if data['status'] == 'OK':
+            try:
+                routeData = route_data(
+                    data=data,
+                    origin=str(origin),
+                    destination=str(destination),
+                    language_code=str(language_code),
+                    time=str(time),
+                    platform=str(platform),
+                )
+                routeData.save()
+                # The run_jobs command extracts the trips, the directions are returned straight away
+                enqueue('extract_trips', data_id=routeData.id)
+            except Exception as e:
+                print(e)
+        return response.status_code, data
+
+    try:
+        if str(time).isdigit():
+            # Repeated searches are answered from the cache, without a request nor a new Data row
+            status_code, data = get_directions(directions_key(origin_query, destination_query, language_code, arrival_departure, time), fetch)
+        else:
+            # Times that are not timestamps, such as 'now', have no time bucket and are passed to Google uncached
+            status_code, data = fetch()
+        if status_code == 200:
             return JsonResponse(data)
         else:
-            return JsonResponse({'warning': 'NA'}, status=response.status_code)
+            return JsonResponse({'warning': 'NA'}, status=status_code)
     except Exception as e:
         return JsonResponse({'warning': 'NA'}, status=500)
 
@@ -197,6 +214,7 @@ def get_route_v1(request, route_id):
             return Response(status=404)
 
 @api_view(['GET'])
+@renderer_classes(EXPORT_RENDERERS)
 @require_GET
 def get_stats_v1(request):
     if request.method == 'GET':
@@ -207,8 +225,23 @@ def get_stats_v1(request):
             start_time = timezone.make_aware(datetime.fromtimestamp(int(start_time)), timezone.get_current_timezone())
             end_time = timezone.make_aware(datetime.fromtimestamp(int(end_time)), timezone.get_current_timezone())
             stats = stats.filter(timestamp__range=(start_time, end_time))
-            serializer = StatSerializer(stats, many=True)
-            return Response(serializer.data)
+
+            fields = request.GET.get('fields', '')
+            fields = fields.split(',') if fields else STAT_FIELDS
+            if not set(fields) <= set(STAT_FIELDS):
+                return Response({'error': f"Unknown fields, choose from {','.join(STAT_FIELDS)}"}, status=400)
+            after = request.GET.get('after', '')
+            limit = request.GET.get('limit', '')
+            stats, next_cursor = paginate(stats, int(after) if after.isdigit() else None, int(limit) if limit.isdigit() and int(limit) > 0 else None)
+
+            # ?format=csv and ?format=ndjson stream the rows instead of building the whole response in memory
+            if request.accepted_renderer.format in ('csv', 'ndjson'):
+                return streaming_export(stats, fields, request.accepted_renderer.format, next_cursor)
+            data = StatSerializer(stats, many=True).data if fields == STAT_FIELDS else list(stats.values(*fields))
+            response = Response(data)
+            if next_cursor is not None:
+                response['X-Next-Cursor'] = str(next_cursor)
+            return response
         except Exception as e:
             print(e)
             return Response(status=404)
@@ -226,12 +259,33 @@ def add_stat_v1(request):
             stat.time = request.GET.get('time', 'NA')
             stat.platform = request.GET.get('platform', 'NA')
             stat.language = request.GET.get('language', 'NA')
-            #stat.timestamp = datetime.now()
-            stat.save()
+            buffer_stat(stat)
             return Response({'status': 'ok'})
         except Exception as e:
             print(e)
             return Response(status=404)
+
+@api_view(['POST'])
+@require_POST
+def add_stats_v1(request):
+    """Save a JSON array of stat events in one INSERT, reporting the events that did not validate."""
+    events = request.data
+    if not isinstance(events, list):
+        return Response({'error': 'Expected a JSON array of stat events'}, status=400)
+    if len(events) > settings.STAT_BATCH_LIMIT:
+        return Response({'error': f'At most {settings.STAT_BATCH_LIMIT} stat events per request'}, status=400)
+
+    stats = []
+    rejected = []
+    now = timezone.now()
+    for index, event in enumerate(events):
+        serializer = StatEventSerializer(data=event)
+        if serializer.is_valid():
+            stats.append(Stat(**{'timestamp': now, **serializer.validated_data}))
+        else:
+            rejected.append({'index': index, 'errors': serializer.errors})
+    save_stats(stats)
+    return Response({'status': 'ok', 'created': len(stats), 'rejected': rejected})
         
 @api_view(['GET'])
 @require_GET
@@ -256,14 +310,7 @@ def get_group_stats_v1(request):
             stats = Stat.objects.all()
             stats = stats.filter(timestamp__range=(start_time, end_time))
             stats = stats.filter(language=language) if language != 'all' else stats
-            if platform != 'all':
-                if platform.find(',') != -1:
-                    #remove stats that are not from the platform.split(',')
-                    for stat in stats:
-                        if stat.platform not in platform.split(','):
-                            stats = stats.exclude(id=stat.id)
-                else:
-                    stats = stats.filter(platform=platform)
+            stats = stats.filter(platform__in=platform.split(',')) if platform != 'all' else stats
 
             search_stops = []
             home_page_impressions = 0
@@ -271,35 +318,26 @@ def get_group_stats_v1(request):
             for group in groups.split(','):
                 if group == "home":
                     # Get the median value of the home page impressions
-                    daily_loads = [
-                        len(stats.filter(request='android_load', timestamp__range=(start_time + timedelta(days=i), start_time + timedelta(days=i+1))))
-                        for i in range((end_time - start_time).days)
-                    ]
-                    median_loads = median(daily_loads)                
-                    home_page_impressions = int(median_loads * (end_time - start_time).days)                  
+                    daily_loads = [count for _, count in count_series(stats.filter(request='android_load'), start_time, end_time)]
+                    median_loads = median(daily_loads)
+                    home_page_impressions = int(median_loads * len(daily_loads))
                     continue
 
-                for stop in Group.objects.get(name=group).stops.split(','):
-                        search_stops.append(stop)
+                # An unknown group is a KeyError, answered with a 404 like the other errors
+                search_stops.extend(get_stop_matcher().members[group])
 
             response['search_stops'] = search_stops
 
-            # Find stats that have at least one of the stops at destination     
-            # TODO: Fix this part           
-            for stat in stats:
-                if stat.destination == 'NA':
-                    stats = stats.exclude(id=stat.id)
-                    continue
-                if stat.destination in search_stops or get_most_similar_stop(stat.destination) in search_stops:
-                    continue
-                else:
-                    stats = stats.exclude(id=stat.id)
+            # Keep the stats whose destination is, or was resolved to, one of the stops
+            stats = stats.exclude(destination='NA').filter(
+                models.Q(destination__in=search_stops) | models.Q(destination_stop__name__in=search_stops))
 
-            response['total_impressions'] = len(stats) + home_page_impressions
+            page_impressions = dict(stats.order_by().values_list('request').annotate(count=models.Count('id')))
+            response['total_impressions'] = sum(page_impressions.values()) + home_page_impressions
             response['home_page_impressions'] = home_page_impressions
-            response['search_page_impressions'] = len(stats.filter(request='get_route'))
-            response['find_page_impressions'] = len(stats.filter(request='find_routes'))
-            response['directions_page_impressions'] = len(stats.filter(request='get_directions'))
+            response['search_page_impressions'] = page_impressions.get('get_route', 0)
+            response['find_page_impressions'] = page_impressions.get('find_routes', 0)
+            response['directions_page_impressions'] = page_impressions.get('get_directions', 0)
 
             for stat in stats:
                 detailed_impressions.append(get_detailed_impression(stat))
@@ -372,98 +410,66 @@ def get_detailed_impression(stat):
 @api_view(['GET'])
 @require_GET
 def get_ad_v1(request):
-    ads = Ad.objects.all()
     if request.method == 'GET':
         ad_time = request.GET.get('now', timezone.now().timestamp())
         advertise_on = request.GET.get('on', 'all').lower()
         platform = request.GET.get('platform', 'all')
         datetime_ad_time = timezone.make_aware(datetime.fromtimestamp(float(ad_time)), timezone.get_default_timezone())
-        ads = ads.filter(status='active')
-        ads = ads.filter(platform=platform) if platform != 'all' else ads
-        ads = ads.filter(start__lte=datetime_ad_time, end__gte=datetime_ad_time)
+        # Ads and groups come from this worker's index and the seen counter is buffered, so this needs no query
+        index = get_ad_index()
+        ads = index.running(platform, None, datetime_ad_time)
 
         # Verify if there is multiple ad campaigns for the same advertise_on
         verify = request.GET.get('verify', False)
         if verify:
-            for ad in ads:
-                groups = ad.advertise_on.split(',')
-                for ad_ in ads:
-                    if ad.id != ad_.id:
-                        groups_ = ad_.advertise_on.split(',')
-                        for group in groups:
-                            if group in groups_:
-                                return Response({'error': 'There are two active ads for the same campaign',
-                                                 'ad-1': AdSerializer(ad).data,
-                                                 'ad-2': AdSerializer(ad_).data})
+            # Conflicts are found when ads are saved, see app.utils.ad_conflicts
+            conflicts = AdConflict.objects.filter(start__lte=datetime_ad_time, end__gte=datetime_ad_time)
+            conflicts = conflicts.filter(platform=platform) if platform != 'all' else conflicts
+            conflict = conflicts.select_related('ad', 'other_ad').first()
+            if conflict is not None:
+                return Response({'error': 'There are two active ads for the same campaign',
+                                 'ad-1': AdSerializer(conflict.ad).data,
+                                 'ad-2': AdSerializer(conflict.other_ad).data})
 
         if advertise_on in ["home", "all"]:
-            ads = ads.filter(advertise_on__icontains=advertise_on) if advertise_on != 'all' else ads
+            ads = index.running(platform, advertise_on, datetime_ad_time) if advertise_on != 'all' else ads
         else:
             stops = advertise_on.split('->') 
             origin = stops[0].strip()
             destination = stops[-1].strip()
 
-            destination_ads = ads.filter(advertise_on__icontains=get_advertise_on_value(destination))
             #Priority for destination ads
-            if destination_ads.count() > 0:
-                ads = destination_ads
-            else:
-                ads = ads.filter(advertise_on__icontains=get_advertise_on_value(origin))
-                
+            ads = (index.running(platform, get_advertise_on_value(destination).lower(), datetime_ad_time)
+                   or index.running(platform, get_advertise_on_value(origin).lower(), datetime_ad_time))
+
         # If multiple ads are found, choose a random one
-        if ads.count() > 1:
-            print('Multiple ads found for time: ' + str(ad_time))
-            print('Choosing a random ad from the list:' )
-            for ad in ads:
-                print(ad)
-            ads = ads.order_by('?')[:1]
+        ad = index.choose(ads)
 
         # Return a default ad if no ads are found
-        if ads.count() == 0:
-            ads = Ad.objects.filter(platform=platform)
-            ads = ads.filter(status='default')
+        if ad is None:
             #Choose a random default ad
-            ads = ads.order_by('?')[:1]
-            
-        if ads.count() == 0:
+            ad = index.choose(index.defaults.get(platform, []))
+
+        if ad is None:
             print('No ads found for time: ' + str(ad_time))
             return Response(status=404)
-        
-        ad = ads[0]
-        serializer = AdSerializer(ad)
-        ad.seen += 1 
-        ad.save()
-        return Response(serializer.data)
+
+        count_ad(ad.id, 'seen')
+        return Response(index.data[ad.id])
     
+@api_view(['GET'])
+@require_GET
+def get_ad_conflicts_v1(request):
+    """The stored conflicts between active ad campaigns, optionally of one platform."""
+    platform = request.GET.get('platform', 'all')
+    conflicts = AdConflict.objects.all()
+    conflicts = conflicts.filter(platform=platform) if platform != 'all' else conflicts
+    return Response(AdConflictSerializer(conflicts, many=True).data)
+
 #Get advertise on value based on the stop
 def get_advertise_on_value(stop):
-    #Find the group which the stop belongs to
-    group = Group.objects.filter(stops__icontains=stop)
-    if group.count() > 0:
-        group = group[0]
-        return group.name
-    most_similar_stop = get_most_similar_stop(stop)
-    group = Group.objects.filter(stops__icontains=most_similar_stop)
-    if group.count() > 0:
-        group = group[0]
-        return group.name
-    
-    return "not found"
-
-#Get the most similar stop
-def get_most_similar_stop(stop):
-    stops = Stop.objects.all()
-    most_similar_stop = stop
-    most_similar_stop_score = 0
-    for stop_entity in stops:
-        score = SequenceMatcher(
-            lambda x: x in ['do', 'da', 'das', 'dos', 'de', ' '], 
-            stop_entity.name.lower(), stop.lower()).ratio()
-        if score > most_similar_stop_score:
-            most_similar_stop = stop_entity.name
-            most_similar_stop_score = score
-    return most_similar_stop
-
+    #Find the group which the stop belongs to, or else the group of its most similar stop
+    return get_ad_index().group_of(stop)
 
 #Increase ad clicked counter
 @api_view(['POST'])
@@ -474,9 +480,9 @@ def click_ad_v1(request):
             ad_id = request.GET.get('id', '')
             if ad_id == '':
                 return Response(status=404)
-            ad = Ad.objects.get(id=ad_id)
-            ad.clicked += 1
-            ad.save()
+            if not Ad.objects.filter(id=ad_id).exists():
+                return Response(status=404)
+            count_ad(int(ad_id), 'clicked')
             return Response({'status': 'ok'})
         except Exception as e:
             print(e)
@@ -487,27 +493,21 @@ def click_ad_v1(request):
 def get_all_groups_v1(request):
     if request.method == 'GET':
         if request.GET.get('verify', False):
-            all_stops_obj = Stop.objects.all()
-            all_stops_names = [stop.name for stop in all_stops_obj]
-            all_groups = Group.objects.all()
-            all_groups_stops = [group.stops for group in all_groups]
-            all_groups_stops = [stop for stops in all_groups_stops for stop in stops.split(',')]
-            # check for duplicates on all_groups_stops and if all_stops_names are in all_groups_stops
-            if len(all_groups_stops) != len(set(all_groups_stops)) or not set(all_stops_names).issubset(set(all_groups_stops)):
-                #Get missing stops
-                missing_stops = set(all_stops_names) - set(all_groups_stops)
-                #get duplicated stops
-                duplicated_stops = [item for item, count in collections.Counter(all_groups_stops).items() if count > 1]
-
+            # Stops in no group and stop names listed by more than one group
+            missing_stops = set(Stop.objects.filter(group_stops=None).values_list('name', flat=True))
+            duplicated_stops = list(GroupStop.objects.order_by().values('name').annotate(count=models.Count('id'))
+                                    .filter(count__gt=1).values_list('name', flat=True))
+            if missing_stops or duplicated_stops:
                 return Response({'status': 'error', 'message': 'There is a problem with the defined groups', 
                                  'Missing stops': str(missing_stops), 
                                  'Duplicated stops':  str(duplicated_stops)})
         try:
             groups = Group.objects.all()
             serializer = GroupSerializer(groups, many=True)
+            members = get_stop_matcher().members
             for group in serializer.data:
+                group['stops'] = members.get(group['name'], [])
                 group['name'] = group['name'].title()
-                group['stops'] = group['stops'].split(',')
             return Response(serializer.data)
         except Exception as e:
             print(e)
@@ -528,43 +528,41 @@ def get_infos_v1(request):
             return Response(status=404)
 
 @api_view(['GET'])
+@renderer_classes(LOAD_RENDERERS)
 @require_GET
 def get_android_load_v1(request):
         if request.method == 'GET':
             try:
-                all_routes = Route.objects.all()
-                all_routes = all_routes.exclude(disabled=True)
-                routes = []
-                for route in all_routes:
-                    stops = route.stops.replace('\'', '').replace('{', '').replace('}', '').split(',')
-                    all_stops = [stop.split(':')[0].strip() for stop in stops]
-                    all_times = [stop.split(':')[1].strip() for stop in stops]
-                    routes.append(LoadRoute(route.id, route.route, all_stops, all_times, route.type_of_day, route.information).__dict__)
-                return Response(routes)
+                if wants_columnar(request):
+                    build = lambda snapshot: snapshot.columnar_routes()
+                else:
+                    build = lambda snapshot: snapshot.load_routes()
+                bundle = get_load_data().bundle('android_load_v1', None, build, request.accepted_renderer)
+                return bundle.response(request)
             except Exception as e:
                 print(e)
                 return Response(status=404)
 
 @api_view(['GET'])
+@renderer_classes(LOAD_RENDERERS)
 @require_GET
 def get_android_load_v2(request):
         if request.method == 'GET':
             try:
-                all_routes = Route.objects.all()
-                all_routes = all_routes.exclude(disabled=True)
-                holidays = Holiday.objects.all()
-                routes = []
-                try:
-                    variable = Variables.objects.all().first().__dict__
-                    routes = [{'version': variable['version'], 'maps': variable['maps'], 'holidays': HolidaySerializer(holidays, many=True).data}]
-                except Exception as e:
-                    print(e)
-                for route in all_routes:
-                    stops = route.stops.replace('\'', '').replace('{', '').replace('}', '').split(',')
-                    all_stops = [stop.split(':')[0].strip() for stop in stops]
-                    all_times = [stop.split(':')[1].strip() for stop in stops]
-                    routes.append(LoadRoute(route.id, route.route, all_stops, all_times, route.type_of_day, route.information).__dict__)
-                return Response(routes)
+                load_data = get_load_data()
+                columnar = wants_columnar(request)
+                def build(snapshot):
+                    routes = []
+                    try:
+                        variable = load_data.variable
+                        routes = [{'version': variable['version'], 'maps': variable['maps'], 'holidays': load_data.holidays}]
+                    except Exception as e:
+                        print(e)
+                    if columnar:
+                        # The header fields sit next to the stop dictionary and route columns
+                        return dict(*routes, **snapshot.columnar_routes())
+                    return routes + snapshot.load_routes()
+                return load_data.bundle('android_load_v2', None, build, request.accepted_renderer).response(request)
             except Exception as e:
                 print(e)
                 return Response(status=404)
@@ -581,21 +579,23 @@ def set_info_v1(request):
                 return Response(status=404)
             updated = 0
             routes_updated = []
-            if clean:
-                for route in Route.objects.all():
-                    print(route.information, info)
-                    if stop in route.stops and route.information == info and route.information != 'None':
-                        route.information = 'None'
-                        route.save()
-                        updated += 1
-                        routes_updated.append(route.route)
-            else:
-                for route in Route.objects.all():
-                    if stop in route.stops and route.information == "None":
-                        route.information = info
-                        route.save()
-                        updated += 1
-                        routes_updated.append(route.route)
+            # One transaction, so the timetable is invalidated once for all the routes
+            with transaction.atomic():
+                if clean:
+                    for route in Route.objects.all():
+                        print(route.information, info)
+                        if stop in route.stops and route.information == info and route.information != 'None':
+                            route.information = 'None'
+                            route.save()
+                            updated += 1
+                            routes_updated.append(route.route)
+                else:
+                    for route in Route.objects.all():
+                        if stop in route.stops and route.information == "None":
+                            route.information = info
+                            route.save()
+                            updated += 1
+                            routes_updated.append(route.route)
             return Response({'status': 'ok', 'updated': updated, 'routes_updated': routes_updated})
         except Exception as e:
             print(e)
@@ -625,213 +625,100 @@ def index (request):
 def stats (request):
     start_time = request.GET.get('start_time', datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
     end_time = request.GET.get('end_time', datetime.now().timestamp())
-    start_time = datetime.fromtimestamp(int(start_time))
-    end_time = datetime.fromtimestamp(int(end_time))
-
-    # format to     
-    start_time = start_time.strftime('%Y-%m-%d %H:%M:%S')
-    end_time = end_time.strftime('%Y-%m-%d %H:%M:%S')
-
-    ALL = Stat.objects.all()
+    start_time = timezone.make_aware(datetime.fromtimestamp(int(start_time)), timezone.get_current_timezone())
+    end_time = timezone.make_aware(datetime.fromtimestamp(int(end_time)), timezone.get_current_timezone())
 
     latest_n = int(request.GET.get('latest', '10'))
     most_searched_n = int(request.GET.get('most_searched', '10'))
 
-    android_loads, android_loads_labels, android_loads_no = get_android_loads()
-
-    latests_activity = [stat for stat in ALL.order_by('-timestamp')[:latest_n]]
+    # All-time figures come from the hourly rollups, the window from the raw stats; both are cached for a short while
+    # and the window is keyed by the minute so the default "until now" window is shared too
+    # ?exact=true counts the most searched stops from the rollups instead of the approximate sketches
+    exact = request.GET.get('exact', 'false').lower() == 'true'
+    totals = caches['stats'].get_or_set(f"stats:totals:{most_searched_n}:{exact}", lambda: get_stats_totals(most_searched_n, exact), settings.STATS_CACHE_SECONDS)
+    window = caches['stats'].get_or_set(f"stats:window:{int(start_time.timestamp())}:{int(end_time.timestamp()) // 60}:{latest_n}",
+                                        lambda: get_stats_window(start_time, end_time, latest_n), settings.STATS_CACHE_SECONDS)
 
-    android_loads_today = android_loads.filter(timestamp__range=(start_time, end_time)) # filter objects created today
-    get_routes_today = Stat.objects.filter(request="get_route").filter(timestamp__range=(start_time, end_time)) # filter objects created today
-    find_routes_today = Stat.objects.filter(request="find_routes").filter(timestamp__range=(start_time, end_time)) # filter objects created today
-    get_directions_today = Stat.objects.filter(request="get_directions").filter(timestamp__range=(start_time, end_time)) # filter objects created today
+    context = {
+        'label': 'Android App Loads (%)',
+        'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S'),
+        'end_time': end_time.strftime('%Y-%m-%d %H:%M:%S'),
+        **totals,
+        **window,
+        }
+    
+    return render(request, 'app/templates/statistics.html', context)
 
+def get_stats_totals(most_searched_n, exact=False):
+    android_loads_labels, android_loads_no = get_android_loads()
 
     #TODO: Get stops names conversions to portuguese
     '''Get Most Searched Destinations'''
-    most_searched_destinations_labels, most_searched_destinations_values = get_most_searched("destination", ALL.filter(request='get_route').exclude(destination='null') | ALL.filter(request='get_directions').exclude(destination='null') | ALL.filter(request='find_routes').exclude(destination='null'), most_searched_n)
-    most_searched_origins_labels, most_searched_origins_values = get_most_searched("origin", ALL.filter(request='get_route').exclude(origin='null'), most_searched_n)
-    most_searched_routes_labels, most_searched_routes_values = get_most_searched("route", ALL.filter(request='get_route').exclude(origin='null').exclude(destination='null'), most_searched_n)
-    
+    approximate = not exact and StatSketch.objects.exists()
+    most_searched = sketch_summary(most_searched_n) if approximate else get_exact_most_searched(most_searched_n)
+
     #TODO: get route android vs web
 
-    android_loads_timestamp_keys, android_loads_timestamp_values = get_android_loads_timestamp(android_loads, start_time, end_time)
+    totals = {'labels': android_loads_labels, 'no': android_loads_no, 'approximate': approximate}
+    for key, name in [('destination', 'destinations'), ('origin', 'origins'), ('route', 'routes')]:
+        top, distinct = most_searched[key]
+        totals[f'most_searched_{name}_labels'] = [label for label, _ in top]
+        totals[f'most_searched_{name}_values'] = [count for _, count in top]
+        totals[f'distinct_{name}'] = distinct
+    return totals
+
+def get_exact_most_searched(most_searched_n):
+    rollups = StatRollup.objects.all()
+    return {
+        'destination': get_most_searched(["destination"], rollups.filter(request__in=['get_route', 'get_directions', 'find_routes']).exclude(destination='null'), most_searched_n),
+        'origin': get_most_searched(["origin"], rollups.filter(request='get_route').exclude(origin='null'), most_searched_n),
+        'route': get_most_searched(["origin", "destination"], rollups.filter(request='get_route').exclude(origin='null').exclude(destination='null'), most_searched_n),
+        }
+
+def get_stats_window(start_time, end_time, latest_n):
+    stats = Stat.objects.filter(timestamp__range=(start_time, end_time))
+    requests_today = dict(stats.order_by().values_list('request').annotate(count=models.Count('id')))
+    android_loads_timestamp_keys, android_loads_timestamp_values = get_android_loads_timestamp(start_time, end_time)
 
-    context = {
-        'labels': android_loads_labels, 'no': android_loads_no, 'label': 'Android App Loads (%)',
-        'latests_activity': latests_activity, 
+    return {
+        'latests_activity': list(Stat.objects.order_by('-timestamp')[:latest_n]),
         'android_loads_timestamp_keys': android_loads_timestamp_keys, 'android_loads_timestamp_values': android_loads_timestamp_values,
-        'android_loads_today_count': android_loads_today.count(), 'get_routes_today': get_routes_today.count(), 'find_routes_today': find_routes_today.count(), 'get_directions_today': get_directions_today.count(),
-        'most_searched_destinations_labels': most_searched_destinations_labels, 'most_searched_destinations_values': most_searched_destinations_values,
-        'most_searched_origins_labels': most_searched_origins_labels, 'most_searched_origins_values': most_searched_origins_values,
-        'most_searched_routes_labels': most_searched_routes_labels, 'most_searched_routes_values': most_searched_routes_values,
-        'start_time': start_time,
-        'end_time': end_time,
+        'android_loads_today_count': requests_today.get('android_load', 0), 'get_routes_today': requests_today.get('get_route', 0),
+        'find_routes_today': requests_today.get('find_routes', 0), 'get_directions_today': requests_today.get('get_directions', 0),
         }
-    
-    return render(request, 'app/templates/statistics.html', context)
 
-def get_android_loads_timestamp(android_loads, start_time, end_time):
-    android_loads = android_loads.filter(timestamp__range=(start_time, end_time))
-    android_loads_timestamp = {}
-    for android_load in android_loads:
-        hour = android_load.timestamp.strftime('%Y-%m-%d %H:00:00')
-        if hour in android_loads_timestamp:
-            android_loads_timestamp[hour] += 1
-        else:
-            android_loads_timestamp[hour] = 1
-    return android_loads_timestamp.keys(), android_loads_timestamp.values()
+def get_android_loads_timestamp(start_time, end_time):
+    android_loads_timestamp = count_series(Stat.objects.filter(request='android_load'), start_time, end_time, unit='hour')
+    return [hour.strftime('%Y-%m-%d %H:00:00') for hour, _ in android_loads_timestamp], [count for _, count in android_loads_timestamp]
 
 def get_android_loads():
-    android_loads = Stat.objects.filter(request='android_load')
-
-    android_loads_en = int(android_loads.filter(language='en').count())*100/android_loads.count()
-    android_loads_pt = int(android_loads.filter(language='pt').count())*100/android_loads.count()
-    android_loads_esp = int(android_loads.filter(language='es').count())*100/android_loads.count()
-    android_loads_fr = int(android_loads.filter(language='fr').count())*100/android_loads.count()
-    android_loads_ger = int(android_loads.filter(language='de').count())*100/android_loads.count()
+    android_loads = dict(StatRollup.objects.filter(request='android_load').order_by().values_list('language').annotate(total=models.Sum('count')))
+    total = sum(android_loads.values()) or 1
+
+    android_loads_en = android_loads.get('en', 0)*100/total
+    android_loads_pt = android_loads.get('pt', 0)*100/total
+    android_loads_esp = android_loads.get('es', 0)*100/total
+    android_loads_fr = android_loads.get('fr', 0)*100/total
+    android_loads_ger = android_loads.get('de', 0)*100/total
     android_loads_other = 100.0 - (android_loads_pt + android_loads_en + android_loads_fr + android_loads_ger + android_loads_esp)
 
     android_loads_labels = ['Portuguese', 'English', "Spanish", 'French', 'German', 'Other']
     android_loads_no = [android_loads_pt, android_loads_en,  android_loads_esp, android_loads_fr, android_loads_ger, android_loads_other]
 
-    return android_loads, android_loads_labels, android_loads_no
-
-def get_most_searched(n, stats, most_searched_n):
-    most_searched = {}
-    for stat in stats: 
-        key = get_dict_key(n, stat)
-        if key in most_searched:
-            most_searched[key] += 1
-        else:
-            most_searched[key] = 1
-
-    stops = [origin for origin in most_searched.keys()]
-
-    most_searched_labels = sorted(stops, key=lambda x: most_searched[x], reverse=True)[:most_searched_n]
-    most_searched_values = [most_searched[destination] for destination in most_searched_labels]
+    return android_loads_labels, android_loads_no
 
-    return most_searched_labels, most_searched_values
+def get_most_searched(fields, rollups, most_searched_n):
+    most_searched = rollups.order_by().values(*fields).annotate(total=models.Sum('count')).order_by('-total')
+    top = [(" -> ".join(row[field] for field in fields), row['total']) for row in most_searched[:most_searched_n]]
 
-def get_dict_key(n, stat):
-    if n == 'destination':
-        return stat.destination
-    elif n == 'origin':
-        return stat.origin
-    elif n == 'route':
-        return f"{stat.origin} -> {stat.destination}"
-
-import math
-
-def is_within_50km_radius(lat, lon):
-    def haversine(lat1, lon1, lat2, lon2):
-        lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-        
-        dlat = lat2 - lat1
-        dlon = lon2 - lon1
-        
-        a = math.sin(dlat / 2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2)**2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-        
-        R = 6371.0
-        distance = R * c
-        
-        return distance
-    
-    center_lat, center_lon = 37.782213, -25.499806
-    radius = 50
-    
-    distance = haversine(center_lat, center_lon, lat, lon)
-    
-    return distance <= radius
-
-
-def data_to_route(data):
-    bus_stop_locations = {}
-    bus_schedules = []  
-    for key in data:
-        if key == "routes":
-            for route in data[key]:
-                bus_schedule = {}
-
-                for leg in route["legs"]:
-                    departure_timestamp = leg["departure_time"]["value"]
-                    trip_date = datetime.utcfromtimestamp(departure_timestamp).strftime('%Y-%m-%d')
-    
-                    bus_numbers = []
-                    for step in leg["steps"]:
-                        if step["travel_mode"] == "TRANSIT":
-                            transit_details = step["transit_details"]
-                            
-                            departure_time = transit_details["departure_time"]["text"]
-                            arrival_time = transit_details["arrival_time"]["text"]
-                            
-                            if 'AM' in departure_time or 'PM' in departure_time:
-                                departure_time = datetime.strptime(departure_time, '%I:%M %p').strftime('%Hh%M')
-                                arrival_time = datetime.strptime(arrival_time, '%I:%M %p').strftime('%Hh%M')
-                            else:
-                                departure_time = datetime.strptime(departure_time, '%H:%M').strftime('%Hh%M')
-                                arrival_time = datetime.strptime(arrival_time, '%H:%M').strftime('%Hh%M')
-
-                            bus_schedule[transit_details["departure_stop"]["name"]] = departure_time
-                            bus_schedule[transit_details["arrival_stop"]["name"]] = arrival_time
-                            bus_numbers.append(transit_details["line"]["short_name"].replace('C', ''))
-                            departure_stop = transit_details["departure_stop"]["name"]
-                            departure_location = (
-                                transit_details["departure_stop"]["location"]["lat"],
-                                transit_details["departure_stop"]["location"]["lng"]
-                            )
-                            arrival_stop = transit_details["arrival_stop"]["name"]
-                            arrival_location = (
-                                transit_details["arrival_stop"]["location"]["lat"],
-                                transit_details["arrival_stop"]["location"]["lng"]
-                            )
-                            
-                            if not is_within_50km_radius(departure_location[0], departure_location[1]) or not is_within_50km_radius(arrival_location[0], arrival_location[1]):
-                                continue
-                            
-                            bus_stop_locations[departure_stop] = departure_location
-                            bus_stop_locations[arrival_stop] = arrival_location
-                bus_schedules.append({'bus': " / ".join(bus_numbers), 'stops': bus_schedule, 'day': trip_date})
-    return bus_schedules, bus_stop_locations
+    return top, most_searched.count()
 
 # Get all Datas
 @api_view(['GET'])
 @require_GET
 def get_data_v1(request, data_id):
     data = route_data.objects.get(id=data_id)
-    # From unix timestamp to datetime in Azores timezone
-    trips, stops = data_to_route(data.data)
-    
-    # Bulk create TripStops if they do not exist
-    existing_stops = TripStop.objects.filter(name__in=stops.keys()).values_list('name', flat=True)
-    new_stops = [
-        TripStop(name=stop, latitude=coords[0], longitude=coords[1])
-        for stop, coords in stops.items()
-        if stop not in existing_stops
-    ]
-    TripStop.objects.bulk_create(new_stops, ignore_conflicts=True)
-                    
-    for trip in trips:
-        bus_number = trip['bus']
-        bus_stops = trip['stops']
-        trip_day_str = trip['day']
-        trip_day_date = datetime.strptime(trip_day_str, '%Y-%m-%d')
-        
-        try:
-            type_of_day = get_type_of_day(trip_day_date, Holiday.objects.filter(date=trip_day_date).exists())
-        except:
-            type_of_day = trip_day_date.upper()
-
-        trip_day_date = trip_day_date.date()
-                    
-        # Update or create the Trip
-        Trip.objects.update_or_create(
-            route=bus_number,
-            stops=bus_stops,
-            type_of_day=type_of_day,
-            defaults={'added': timezone.now()}
-        )
+    trips, stops = extract_trips(data)
 
     data_serialized = DataSerializer(data, many=True)
     trips_serialized = TripSerializer(Trip.objects.filter(
@@ -3,7 +3,7 @@ import logging
 from django.utils import timezone
 import requests
 from SaoMiguelBus import settings
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, renderer_classes
 from rest_framework.response import Response
 from app.models import Holiday, Info, LoadRoute, Route, Stop, TripStop, ReturnRoute, Trip, Variables
 from app.serializers import HolidaySerializer, InfoSerializer, StopSerializer, TripSerializer
@@ -14,6 +14,8 @@ from django.http import JsonResponse
 
 from app.utils.day_utils import get_type_of_day
 from app.utils.str_utils import clean_string
+from app.utils.load_bundle import LOAD_RENDERERS, get_load_data, wants_columnar
+from app.utils.sync import sync
 from app.views.v1.views import get_trip_v1_logic
 
 logger = logging.getLogger(__name__)
@@ -66,6 +68,8 @@ def get_trip_v2(request):
         date_day = request.GET.get('day', '')
         start_time = request.GET.get('start', '00:00')
         full_ = request.GET.get('full', '').lower() == 'true'
+        limit = request.GET.get('limit', '')
+        limit = int(limit) if limit.isdigit() else None
 
         logger.debug(f"Parameters received - Origin: {origin}, Destination: {destination}, Day: {date_day}, Start Time: {start_time}, Full: {full_}")
 
@@ -140,7 +144,7 @@ def get_trip_v2(request):
                     logger.warning("Variables.objects.get(populate_maps_routes=True) did not find any matching records")
                     logger.info("populate_maps_routes is False. Skipping fetching maps routes.")
 
-            old_routes = get_trip_v1_logic(origin_cleaned, destination_cleaned, day, start_time.replace(':', 'h'), full_, prefix=True) or []
+            old_routes = get_trip_v1_logic(origin_cleaned, destination_cleaned, day, start_time.replace(':', 'h'), full_, prefix=True, limit=limit) or []
             logger.debug(f"Retrieved {len(old_routes)} old routes from get_trip_v1_logic")
 
             # Prepare the start time for comparison
@@ -197,7 +201,7 @@ def get_trip_v2(request):
                     )
                     logger.debug(f"Added route {route.id} to return_routes")
 
-            return_routes.sort(key=lambda x: x['start'])
+            # get_trip_v1_logic already returns the routes ordered by departure from the origin
             logger.info(f"Returning {len(return_routes)} routes")
             return Response(return_routes)
         except Exception as e:
@@ -205,35 +209,48 @@ def get_trip_v2(request):
             return Response(status=404)
         
 @api_view(['GET'])
+@renderer_classes(LOAD_RENDERERS)
 @require_GET
 def get_webapp_load_v2(request):
         if request.method == 'GET':
             try:
-                all_routes = Route.objects.all()
-                all_routes = all_routes.exclude(disabled=True)
-                holidays = Holiday.objects.all()
-                infos = Info.objects.filter(start__lte=timezone.now()).filter(end__gte=timezone.now())
-                routes = []
-                all_stops = set()  # Use a set to store unique stops
-                try:
-                    variable = Variables.objects.all().first().__dict__
-                    routes = [{'version': variable['version'], 'maps': variable['maps'], 'holidays': HolidaySerializer(holidays, many=True).data, 'infos': InfoSerializer(infos, many=True).data}]
-                except Exception as e:
-                    print(e)
-                for route in all_routes:
-                    stops = route.stops.replace('\'', '').replace('{', '').replace('}', '').split(',')
-                    route_stops = [stop.split(':')[0].strip() for stop in stops]
-                    all_stops.update(route_stops)  # Add stops to the set
-                    all_times = [stop.split(':')[1].strip() for stop in stops]
-                    routes.append(LoadRoute(route.id, route.route, route_stops, all_times, route.type_of_day, route.information).__dict__)
-                
-                # Convert set to list for JSON serialization
-                all_stops_list = list(all_stops)
-                
-                # Add all_stops to the response
-                routes[0]['stops'] = all_stops_list
-                
-                return Response(routes)
+                load_data = get_load_data()
+                infos = load_data.active_infos()
+                columnar = wants_columnar(request)
+                def build(snapshot):
+                    routes = []
+                    all_stops = set()  # Use a set to store unique stops
+                    try:
+                        variable = load_data.variable
+                        routes = [{'version': variable['version'], 'maps': variable['maps'], 'holidays': load_data.holidays, 'infos': InfoSerializer(infos, many=True).data}]
+                    except Exception as e:
+                        print(e)
+                    if columnar:
+                        # The stop dictionary already is the sorted list of unique stops
+                        return dict(*routes, **snapshot.columnar_routes())
+                    for route in snapshot.load_routes():
+                        all_stops.update(route['stops'])  # Add stops to the set
+                        routes.append(route)
+
+                    # Sorted so every worker renders the same bytes for the same data
+                    routes[0]['stops'] = sorted(all_stops)
+                    return routes
+
+                # Active infos change with time, so they are part of the bundle key
+                return load_data.bundle('webapp_load_v2', tuple(info.id for info in infos), build, request.accepted_renderer).response(request)
             except Exception as e:
                 print(e)
-                return Response(status=404)
\ No newline at end of file
+                return Response(status=404)
+
+@api_view(['GET'])
+@require_GET
+def get_android_sync_v2(request):
+    logger.info("Received GET request for get_android_sync_v2")
+    if request.method == 'GET':
+        since = request.GET.get('since', '')
+        since = int(since) if since.isdigit() else None
+        try:
+            return Response(sync(since))
+        except Exception as e:
+            logger.exception("Error occurred in get_android_sync_v2")
+            return Response({'error': 'Internal Server Error'}, status=500)
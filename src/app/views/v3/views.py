@@ -0,0 +1,63 @@
+import logging
+from datetime import datetime
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+from django.views.decorators.http import require_GET
+
+from app.models import Holiday
+from app.utils.day_utils import get_type_of_day
+from app.utils.journey_planner import plan_journeys
+from app.utils.stop_utils import time_to_minutes
+
+logger = logging.getLogger(__name__)
+
+MAX_TRANSFERS = 2
+# Callers may ask for one transfer more than the default; every extra transfer multiplies the journeys to search
+MAX_TRANSFERS_LIMIT = MAX_TRANSFERS + 1
+MIN_TRANSFER_MINUTES = 5
+MAX_JOURNEYS = 5
+
+@api_view(['GET'])
+@require_GET
+def get_trip_v3(request):
+    logger.info("Received GET request for get_trip_v3")
+    if request.method == 'GET':
+        origin = request.GET.get('origin', '')
+        destination = request.GET.get('destination', '')
+        date_day = request.GET.get('day', '')
+        start_time = request.GET.get('start', '00:00')
+
+        if not origin or not destination:
+            return Response({'error': 'Origin and destination are required'}, status=400)
+
+        try:
+            max_transfers = int(request.GET.get('max_transfers', MAX_TRANSFERS))
+            min_transfer = int(request.GET.get('min_transfer', MIN_TRANSFER_MINUTES))
+            limit = int(request.GET.get('limit', MAX_JOURNEYS))
+        except ValueError:
+            return Response({'error': 'max_transfers, min_transfer and limit must be integers'}, status=400)
+        if max_transfers < 0 or min_transfer < 0 or limit < 1:
+            return Response({'error': 'max_transfers and min_transfer must not be negative, limit must be positive'}, status=400)
+        max_transfers = min(max_transfers, MAX_TRANSFERS_LIMIT)
+        limit = min(limit, MAX_JOURNEYS * 4)
+
+        start_minutes = time_to_minutes(start_time) if start_time else 0
+        if start_minutes is None:
+            return Response({'error': 'Invalid start time format'}, status=400)
+
+        try:
+            day_date = datetime.strptime(date_day, '%Y-%m-%d')
+            day = get_type_of_day(day_date, Holiday.objects.filter(date=day_date).exists())
+        except ValueError:
+            logger.warning(f"Failed to parse date_day '{date_day}', using upper case: {date_day.upper()}")
+            day = date_day.upper()
+
+        logger.debug(f"Parameters received - Origin: {origin}, Destination: {destination}, Day: {day}, Start: {start_minutes}, Max transfers: {max_transfers}, Min transfer: {min_transfer}")
+
+        try:
+            journeys = plan_journeys(origin, destination, day, start_minutes, max_transfers, min_transfer, limit)
+            logger.info(f"Returning {len(journeys)} journeys")
+            return Response(journeys)
+        except Exception as e:
+            logger.exception("Error occurred in get_trip_v3")
+            return Response({'error': 'Internal Server Error'}, status=500)
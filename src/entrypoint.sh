@@ -1,2 +1,4 @@
 python manage.py createsuperuser --noinput
+python manage.py compile_timetable
+sh ./run_jobs.sh &
 gunicorn -b 0.0.0.0:8080 --workers 2 SaoMiguelBus.wsgi
\ No newline at end of file
@@ -0,0 +1,6 @@
+# Background job worker, started again whenever it stops so queued jobs are never left behind
+while true; do
+    python manage.py run_jobs
+    echo "run_jobs exited with status $?, restarting in 5 seconds"
+    sleep 5
+done
@@ -1,3 +1,5 @@
 python manage.py collectstatic --no-input
 python manage.py migrate
+python manage.py compile_timetable
+sh ./run_jobs.sh &
 gunicorn SaoMiguelBus.wsgi --bind=0.0.0.0:80 --timeout 120